@@ -2,4 +2,12 @@
 echo "running tests for S3helper and DynamoDBHelper."
 python3 test/test_helper.py
 echo "Running tests for datastore"
-python3 test/test_datastore.py
\ No newline at end of file
+python3 test/test_datastore.py
+echo "Running tests for the Textract response parser"
+python3 test/test_trp.py
+echo "Running tests for the Comprehend cache"
+python3 test/test_comprehendCache.py
+echo "Running tests for the document routing"
+python3 test/test_routingHelper.py
+echo "Running tests for the redaction api"
+python3 test/test_redact.py
@@ -13,7 +13,7 @@
 #####################################################################################################################
 
 import datastore
-from helper import S3Helper
+from helper import AwsHelper, S3Helper
 import json
 import uuid
 import boto3
@@ -22,7 +22,7 @@ import os
 
 def generateDocumentID(bucketName):
     documentId = str(uuid.uuid4())
-    s3Client = boto3.client('s3')
+    s3Client = AwsHelper().getClient('s3')
     s3Response = s3Client.list_objects_v2(  # checks for collision
         Bucket=bucketName,
         Prefix='public/{}'.format(documentId),
@@ -13,6 +13,7 @@
  #####################################################################################################################
 
 import boto3
+from helper import AwsHelper
 
 def scanDocuments(table, pageSize, nextToken=None):
     if(nextToken is not None):
@@ -86,7 +87,7 @@ def getDocuments(request):
     response = {}
 
     if(documentsTable is not None):
-        dynamodb = boto3.resource('dynamodb')
+        dynamodb = AwsHelper().getResource('dynamodb')
         table = dynamodb.Table(documentsTable)
         nextToken = request["nextToken"] if "nextToken" in request else None
 
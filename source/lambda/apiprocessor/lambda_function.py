@@ -23,6 +23,7 @@ from document import getDocument, createDocument, deleteDocument
 from redact import redact
 from search import search, deleteESItem
 from kendraHelper import KendraHelper
+from helper import AwsHelper
 
 
 def redactHeadersFromLambdaEvent(lambdaEvent):
@@ -35,7 +36,7 @@ def validate_create_document_request(request):
     """
     load() throws an exception if the object does not exist in the bucket.
     """
-    s3 = boto3.resource('s3')
+    s3 = AwsHelper().getResource('s3')
     try:
         s3.Object(request['bucketName'], request['objectName']).load()
         return True
@@ -16,9 +16,66 @@ from helper import AwsHelper, DynamoDBHelper
 import boto3
 import datastore
 from helper import S3Helper
+from comprehendHelper import getRateLimiter, MAX_COMPREHEND_UTF8_PAGE_SIZE
+from comprehendCache import getComprehendCache
+from concurrent.futures import ThreadPoolExecutor
+import trp
 import json
 import uuid
 import csv
+import os
+import collections
+
+# BatchDetectEntities accepts up to 25 texts per call
+COMPREHEND_BATCH_SIZE = 25
+
+# number of BatchDetectEntities calls in flight for a request
+REDACT_CONCURRENCY = 8
+
+COMPREHEND_ENTITIES_PATH = "public/{}/output/comprehend/comprehendEntities.json"
+
+# output record of the binary response written by og.OutputGenerator
+BINARY_RESPONSE_OUTPUT_TYPE = "textract/ResponseBinary"
+
+# binary responses are downloaded once per container and memory-mapped, only the blocks
+# of the requested page are decoded. The documents of the last requests are kept open.
+BINARY_DOCUMENT_DIRECTORY = "/tmp/textract-binary"
+BINARY_DOCUMENT_CACHE_SIZE = 4
+binaryDocuments = collections.OrderedDict()
+
+# returns the memory-mapped binary copy of the document response, None if the document was
+# processed without binary output. Both are remembered so the output table is queried once.
+def getBinaryDocument(outputTable, documentId):
+    if(documentId in binaryDocuments):
+        binaryDocuments.move_to_end(documentId)
+        return binaryDocuments[documentId][0]
+
+    document = None
+    fileName = None
+    items = DynamoDBHelper.getItems(outputTable, "documentId", documentId) or []
+    for item in items:
+        if(item["outputType"] == BINARY_RESPONSE_OUTPUT_TYPE):
+            os.makedirs(BINARY_DOCUMENT_DIRECTORY, exist_ok=True)
+            fileName = os.path.join(BINARY_DOCUMENT_DIRECTORY, "{}.bin".format(uuid.uuid4()))
+            S3Helper.downloadFromS3(os.environ['CONTENT_BUCKET'], item["outputPath"], fileName)
+            document = trp.BinaryDocument.fromFile(fileName)
+            break
+
+    binaryDocuments[documentId] = (document, fileName)
+    if(len(binaryDocuments) > BINARY_DOCUMENT_CACHE_SIZE):
+        evicted, evictedFileName = binaryDocuments.popitem(last=False)[1]
+        if(evicted is not None):
+            evicted.close()
+            os.remove(evictedFileName)
+    return document
+
+# returns the blocks of a page from the binary copy of the document response, the same
+# list as the page response file. None if the document was processed without binary output.
+def getBinaryPageResponse(outputTable, documentId, page):
+    document = getBinaryDocument(outputTable, documentId)
+    if(document is None):
+        return None
+    return document.pageBlocks(int(page) - 1)
 
 def getPageResponse(request):
     documentsTable = request["documentsTable"]
@@ -28,8 +85,10 @@ def getPageResponse(request):
     ds = datastore.DocumentStore(documentsTable, outputTable)
     doc = ds.getDocument(documentId)
     if(doc and doc["documentStatus"] == "SUCCEEDED"):
-        fileName = "{}-analysis/{}/page-{}-response.json".format(doc["objectName"], doc["documentId"], page)
-        responseJson = json.loads(S3Helper.readFromS3(doc["bucketName"], fileName))
+        responseJson = getBinaryPageResponse(outputTable, documentId, page)
+        if(responseJson is None):
+            fileName = "{}-analysis/{}/page-{}-response.json".format(doc["objectName"], doc["documentId"], page)
+            responseJson = json.loads(S3Helper.readFromS3(doc["bucketName"], fileName))
         doc["textractResponse"] = responseJson
     output = {}
     if(doc):
@@ -75,8 +134,8 @@ def getTableFromString(fileStr):
   return csv.reader(fileStr.splitlines(), delimiter=',')
 
 def parseTables(table):
-  comprehend = getComprehend()
   tables = []
+  cells = []
   tablesIndex = -1
   rowIndex = 1
   for row in table:
@@ -87,21 +146,24 @@ def parseTables(table):
     else:
       columnIndex = 1
       for cell in row:
-        preProcess = {
-          "text": cell,
-          "comprehend": comprehend["entities"](cell)
-        }
-        processedLine = processLine(preProcess)
         cellInstance = {
           "RowIndex": rowIndex,
           "ColumnIndex": columnIndex,
           "RowSpan": 1,
           "ColumnSpan": 1,
-          "content": cell,
-          "tokens": processedLine["phrases"]
+          "content": cell
         }
         columnIndex += 1
         tables[tablesIndex].append(cellInstance)
+        cells.append(cellInstance)
+  # entities of all the cells are detected together, in batches
+  entities = detectEntities([cell["content"] for cell in cells])
+  for cell, cellEntities in zip(cells, entities):
+    processedLine = processLine({
+      "text": cell["content"],
+      "comprehend": cellEntities
+    })
+    cell["tokens"] = processedLine["phrases"]
   return tables
 
 def getPageTable(request):
@@ -128,16 +190,115 @@ def getComprehend(languageCode="en"):
     region = ss.region_name
     client = AwsHelper().getClient('comprehend', region)
 
-    def entities(text):
-        return client.detect_entities(
-            Text=text,
+    def entities(texts):
+        getRateLimiter('batch_detect_entities').acquire()
+        response = client.batch_detect_entities(
+            TextList=texts,
             LanguageCode=languageCode
         )
+        results = [None for text in texts]
+        for result in response["ResultList"]:
+            results[result["Index"]] = {"Entities": result["Entities"]}
+        # texts the batch failed on, e.g. longer than its 5000 bytes limit, are sent on their
+        # own so that they are never taken for texts without entities. Errors are raised.
+        for error in response["ErrorList"]:
+            print("Failed to detect entities in batch, retrying alone: {}".format(error["ErrorMessage"]))
+            getRateLimiter('detect_entities').acquire()
+            result = client.detect_entities(
+                Text=texts[error["Index"]],
+                LanguageCode=languageCode
+            )
+            results[error["Index"]] = {"Entities": result["Entities"]}
+        if(None in results):
+            raise Exception("Comprehend returned no result for {} texts".format(results.count(None)))
+        return results
 
     return {
         "entities": entities
     }
 
+# returns the Comprehend entities of each text, in the same order. Texts are looked up in the
+# Comprehend cache first, then the distinct ones left are sent by batches of 25, several at a time
+def detectEntities(texts, languageCode="en"):
+  cache = getComprehendCache()
+  results = {}
+  missing = []
+  for text in set(texts):
+    # Comprehend rejects empty texts
+    if(text.strip() == ""):
+      results[text] = {"Entities": []}
+      continue
+    cached = cache.get('batch_detect_entities', text, languageCode)
+    if(cached is not None):
+      results[text] = cached
+    else:
+      missing.append(text)
+  if(missing):
+    comprehend = getComprehend(languageCode)
+    batches = [missing[i:i + COMPREHEND_BATCH_SIZE] for i in range(0, len(missing), COMPREHEND_BATCH_SIZE)]
+    with ThreadPoolExecutor(max_workers=REDACT_CONCURRENCY) as executor:
+      for batch, batchResults in zip(batches, executor.map(comprehend["entities"], batches)):
+        for text, result in zip(batch, batchResults):
+          results[text] = result
+          cache.put('batch_detect_entities', text, result, languageCode)
+  return [results[text] for text in texts]
+
+# returns the entities found by ComprehendHelper for the page, or None if they are not available
+# returns the entity occurrences ComprehendHelper found in the page, with their offsets in the
+# page text. None when the entities file is missing or was written without the offsets
+def getPageMentions(documentId, page):
+  try:
+    comprehendEntities = json.loads(S3Helper.readFromS3(os.environ['CONTENT_BUCKET'], COMPREHEND_ENTITIES_PATH.format(documentId)))
+  except Exception as e:
+    print("No Comprehend entities for document {}: {}".format(documentId, e))
+    return None
+  for result in comprehendEntities["results"]:
+    if(str(result["Page"]) == str(page)):
+      return result.get("Mentions")
+  return None
+
+# entities of the page lines, taken from the entities ComprehendHelper found in the page when
+# possible. The page text is rebuilt from the lines as ComprehendHelper.extractTextFromPageLines
+# does and each entity is mapped to the lines it covers. Lines past the page size sent to
+# Comprehend are detected again, and the whole page if the lines are not the ones it was sent.
+def detectLineEntities(documentId, page, lines):
+  mentions = getPageMentions(documentId, page)
+  if(mentions is None):
+    return detectEntities(lines)
+  pageText = "."
+  lineStarts = [None] * len(lines)
+  for i, line in enumerate(lines):
+    # same page size limit and ". " separator as ComprehendHelper.extractTextFromPageLines
+    if(MAX_COMPREHEND_UTF8_PAGE_SIZE > len(pageText) + len(line) + 2):
+      pageText += ". "
+      lineStarts[i] = len(pageText)
+      pageText += line
+  if(any(pageText[mention["BeginOffset"]:mention["EndOffset"]] != mention["Text"] for mention in mentions)):
+    print("Page {} of document {} does not match its Comprehend entities".format(page, documentId))
+    return detectEntities(lines)
+
+  results = [None if lineStarts[i] is None else {"Entities": []} for i in range(len(lines))]
+  for mention in sorted(mentions, key=lambda mention: mention["BeginOffset"]):
+    for i, line in enumerate(lines):
+      if(lineStarts[i] is None):
+        continue
+      # an entity spanning lines is split on them, each line gets the part it holds
+      start = max(mention["BeginOffset"], lineStarts[i])
+      end = min(mention["EndOffset"], lineStarts[i] + len(line))
+      if(start < end):
+        results[i]["Entities"].append({
+          "BeginOffset": start - lineStarts[i],
+          "EndOffset": end - lineStarts[i],
+          "Type": mention["Type"],
+          "Score": mention["Score"],
+          "Text": line[start - lineStarts[i]:end - lineStarts[i]]
+        })
+  remaining = [i for i in range(len(lines)) if results[i] is None]
+  if(remaining):
+    for i, result in zip(remaining, detectEntities([lines[i] for i in remaining])):
+      results[i] = result
+  return results
+
 def parseKey(obj, key, default):
   return obj[key] if key in obj else default
 
@@ -228,27 +389,33 @@ def table(request):
   return getPageTable(request)
 
 def text(request):
-  comprehend = getComprehend()
   document = getPageResponse(request)
   textractResponse = parseKey(document, 'textractResponse', [])
   lines = list(filter(lambda block: block["BlockType"] == "LINE" , textractResponse))
   lines = list(map(lambda line: line["Text"], lines))
-  lines = list(map(lambda line: {"text": line, "comprehend": comprehend["entities"](line)}, lines))
+  entities = detectLineEntities(request["documentId"], request["page"], lines)
+  lines = [{"text": line, "comprehend": lineEntities} for line, lineEntities in zip(lines, entities)]
   return processLines(lines)
 
 def form(request):
-  comprehend = getComprehend()
   document = getPageForm(request)
   textractResponse = parseKey(document, 'textractResponse', [])
+  # keys and values of the pairs that have a value are detected together, in batches
+  texts = []
+  for pair in textractResponse:
+    if(pair["value"] != ""):
+      texts.append(pair["key"])
+      texts.append(pair["value"])
+  entities = iter(detectEntities(texts))
   pairs = list(map(lambda pair:
     {"key":
       {
         "text": pair["key"],
-        "comprehend": [] if pair["value"] == "" else comprehend["entities"](pair["key"])
+        "comprehend": [] if pair["value"] == "" else next(entities)
       },
       "value":{
         "text": pair["value"],
-        "comprehend": [] if pair["value"] == "" else comprehend["entities"](pair["value"])
+        "comprehend": [] if pair["value"] == "" else next(entities)
       }
     }, textractResponse))
   return processPairs(pairs)
@@ -12,38 +12,40 @@
  #  and limitations under the License.                                                                                #
  #####################################################################################################################
 
-from elasticsearch import Elasticsearch, RequestsHttpConnection
-from requests_aws4auth import AWS4Auth
-import boto3
+from elasticsearchHelper import ElasticsearchHelper
+import os
 import re
 import datetime
 
 ES_HIGHLIGHT_FRAGMENT_SIZE = 100
 
+# documents, and the per page documents written alongside them by the OutputGenerator
+ES_INDEX = "textract"
+ES_PAGES_INDEX = "textract-pages"
+
+# "true" when the documents are indexed page by page, the same setting as the OutputGenerator's
+DEFAULT_ES_INDEX_PAGES = "false"
+
+# number of matching pages listed for each document found
+ES_PAGES_PER_DOCUMENT = 100
+
 def deleteESItem(elasticsearchDomain, documentId):
     host = elasticsearchDomain
 
     if(documentId):
-        service = 'es'
-        ss = boto3.Session()
-        credentials = ss.get_credentials()
-        region = ss.region_name
-
-        awsauth = AWS4Auth(credentials.access_key, credentials.secret_key,
-                           region, service, session_token=credentials.token)
-
-        es = Elasticsearch(
-            hosts=[{'host': host, 'port': 443}],
-            http_auth=awsauth,
-            use_ssl=True,
-            verify_certs=True,
-            connection_class=RequestsHttpConnection
-        )
+        es = ElasticsearchHelper.getClient(host)
 
-        if es.exists(index="textract", id=documentId):
-            es.delete(index="textract", id=documentId)
+        if es.exists(index=ES_INDEX, id=documentId):
+            es.delete(index=ES_INDEX, id=documentId)
             print("Deleted document: {}".format(documentId))
 
+        response = es.delete_by_query(
+            index=ES_PAGES_INDEX,
+            body={"query": {"term": {"documentId": documentId}}},
+            ignore_unavailable=True
+        )
+        print("Deleted {} pages of document: {}".format(response.get("deleted", 0), documentId))
+
 
 def calculate_date_matches(document,date_to,date_from):
     match_count = 0
@@ -61,6 +63,7 @@ def search(request):
     documentId = request["documentId"] if "documentId" in request else None
 
     output = request
+    date_from = date_to = None
 
     # extract the dates that the user wants to query
     if 'date:' in keyword:
@@ -85,39 +88,30 @@ def search(request):
 
 
     if(keyword is not None):
+        highlight = {
+            "fields" : {
+                "content" : { "pre_tags" : [""], "post_tags" : [""] },
+            },
+            "fragment_size" : ES_HIGHLIGHT_FRAGMENT_SIZE,
+            "require_field_match": False
+        }
+
+        es = ElasticsearchHelper.getClient(host)
+
+        if(os.environ.get('ES_INDEX_PAGES', DEFAULT_ES_INDEX_PAGES).lower() == "true"):
+            return searchPages(es, keyword, highlight, date_from, date_to)
+
         searchBody = {
                  "query" : {
                     "query_string": {
                         "query": keyword
                        }
                   },
-                  "highlight" : {
-                    "fields" : {
-                        "content" : { "pre_tags" : [""], "post_tags" : [""] },
-                      },
-                      "fragment_size" : ES_HIGHLIGHT_FRAGMENT_SIZE,
-                      "require_field_match": False
-                 }
+                  "highlight" : highlight
             }
 
-        service = 'es'
-        ss = boto3.Session()
-        credentials = ss.get_credentials()
-        region = ss.region_name
-
-        awsauth = AWS4Auth(credentials.access_key, credentials.secret_key,
-                           region, service, session_token=credentials.token)
-
-        es = Elasticsearch(
-            hosts=[{'host': host, 'port': 443}],
-            http_auth=awsauth,
-            use_ssl=True,
-            verify_certs=True,
-            connection_class=RequestsHttpConnection
-        )
-
         output = es.search(
-            index='textract',
+            index=ES_INDEX,
             body=searchBody,
             _source = True,
             filter_path=['hits.hits._id', 'hits.hits._source','hits.hits.highlight']
@@ -154,3 +148,53 @@ def search(request):
                 results.append(obj)
             output = results
         return output
+
+# searches the per page documents. Hits are collapsed on the document so that each matching
+# document counts once, its matching pages come back as inner hits with their highlights
+def searchPages(es, keyword, highlight, date_from, date_to):
+    searchBody = {
+        "query" : {
+            "query_string": {
+                "query": keyword
+            }
+        },
+        "collapse": {
+            "field": "documentId",
+            "inner_hits": {
+                "name": "pages",
+                "size": ES_PAGES_PER_DOCUMENT,
+                "_source": ["page", "date"],
+                "highlight": highlight
+            }
+        }
+    }
+
+    output = es.search(
+        index=ES_PAGES_INDEX,
+        body=searchBody,
+        _source = ["name", "bucket"],
+        filter_path=['hits.hits.fields', 'hits.hits._source', 'hits.hits.inner_hits'],
+        ignore_unavailable = True
+    )
+
+    results = []
+    for hit in output.get("hits", {}).get("hits", []):
+        source = hit["_source"]
+        pageHits = sorted(hit["inner_hits"]["pages"]["hits"]["hits"], key=lambda pageHit: pageHit["_source"]["page"])
+        lines = []
+        date_match_count = 0
+        for pageHit in pageHits:
+            if "highlight" in pageHit:
+                lines.extend(pageHit["highlight"]["content"])
+            # calculate only if date is present in the search query
+            if "date" in keyword:
+                date_match_count += calculate_date_matches(pageHit["_source"],date_to,date_from)
+        results.append({
+            "documentId": hit["fields"]["documentId"][0],
+            "name": source["name"],
+            "bucket": source["bucket"],
+            "count": len(lines) + date_match_count,
+            "lines": lines if lines else [""],
+            "pages": [pageHit["_source"]["page"] for pageHit in pageHits]
+        })
+    return results
@@ -16,57 +16,30 @@ import boto3
 from botocore.exceptions import ClientError
 import json
 import os
+import time
 import uuid
+from concurrent.futures import ThreadPoolExecutor
 from helper import FileHelper, AwsHelper, S3Helper
 from datastore import DocumentStore
 from urllib.parse import unquote_plus
 
+# large documents are uploaded with multipart uploads
+DOCUMENT_EVENTS = ('ObjectCreated:Put', 'ObjectCreated:Copy', 'ObjectCreated:CompleteMultipartUpload')
 
-def generateDocumentID(bucketName, s3Client):
-    documentId = str(uuid.uuid4())
-
-    response = s3Client.list_objects_v2(Bucket=bucketName,
-                                        Prefix='public/{}'.format(documentId),
-                                        MaxKeys=1)
-
-    if response.get('Contents') is not None:
-        return generateDocumentID(bucketName)
-
-    return documentId
-
-
-def downloadDocument(bucketName, documentKey, filename, s3Client):
-
-    # create a local file
-    datafile = open('/tmp/' + filename, 'wb') # nosec B108
-
-    # system error
-    if datafile == None:
-        print("Download Document: failed to open local file: " + filename)
-        return False
-
-    # download s3 object into local file
-    try:
-        s3Client.download_fileobj(bucketName, documentKey, datafile)
-    except Exception as e:
-        print("Download Document: " + str(e))
-        return False
-
-    return True
-
+# number of documents of a batch processed at the same time
+DEFAULT_BULK_CONCURRENCY = 8
 
-def uploadDocument(bucketName, documentKey, filename, s3Client):
 
-    # open local file
-    datafile = open('/tmp/' + filename, 'rb') # nosec B108
+def generateDocumentID(bucketName, s3Client):
+    while(True):
+        documentId = str(uuid.uuid4())
 
-    if datafile == None:
-        print("UploadDocument: failed to open local file: " + filename)
-        return False
+        response = s3Client.list_objects_v2(Bucket=bucketName,
+                                            Prefix='public/{}'.format(documentId),
+                                            MaxKeys=1)
 
-    # upload local file to s3
-    s3Client.upload_fileobj(datafile, bucketName, documentKey)
-    return True
+        if response.get('Contents') is None:
+            return documentId
 
 
 def processDocument(record):
@@ -79,19 +52,7 @@ def processDocument(record):
     ingestionDocumentFilename = unquote_plus(ingestionDocumentFilename)
     ingestionDocumentKey = unquote_plus(ingestionDocumentKey)
 
-    s3Client = boto3.client('s3', region_name=os.environ['AWS_REGION'])
-
-    # get document from bulk bucket
-    ret = downloadDocument(ingestionBucketName,
-                           ingestionDocumentKey,
-                           ingestionDocumentFilename,
-                           s3Client)
-
-    # error trying to dowload document, exit
-    if ret == False:
-        print("ProcessDocument: failed to download locally document:" +
-              ingestionDocumentKey)
-        return
+    s3Client = AwsHelper().getClient('s3', os.environ['AWS_REGION'])
 
     # attempt to get an optional document Kendra policy json file
     policyFilename = ingestionDocumentFilename + ".metadata.json"
@@ -126,19 +87,24 @@ def processDocument(record):
     # generate UUID for document
     documentId = generateDocumentID(os.environ['DOCUMENTS_BUCKET'], s3Client)
 
-    # upload document in document bucket
+    # copy document in document bucket, the copy is done by S3 so the document
+    # does not go through the function
     destinationDocumentKey = "public/" + documentId + "/" + ingestionDocumentFilename
 
-    ret = uploadDocument(os.environ['DOCUMENTS_BUCKET'],
-                         destinationDocumentKey,
-                         ingestionDocumentFilename,
-                         s3Client)
-
-    # in case of error uploading document, we exit
-    if ret == False:
-        print("Failed to upload document into output bucket: " +
-              destinationDocumentKey)
+    start = time.time()
+    try:
+        size = S3Helper.copyObject(ingestionBucketName,
+                                   ingestionDocumentKey,
+                                   os.environ['DOCUMENTS_BUCKET'],
+                                   destinationDocumentKey,
+                                   os.environ['AWS_REGION'])
+    except Exception as e:
+        print("Failed to copy document into output bucket: " +
+              destinationDocumentKey + ". " + str(e))
         return
+    elapsed = time.time() - start
+    print("Copied {} ({} bytes) in {:.2f}s, {:.2f} MB/s".format(
+        ingestionDocumentKey, size, elapsed, size / (1024 * 1024) / max(elapsed, 0.001)))
 
     # if optional Kendra policy was present, upload it to document folder
     # alongside document
@@ -162,29 +128,42 @@ def processDocument(record):
     return
 
 
-def processQueueRecord(queueRecord):
+def getDocumentRecords(queueRecord):
 
     records = json.loads(queueRecord['body'])
 
     # one of more s3 event records
+    documentRecords = []
     if 'Records' in records:
         for record in records['Records']:
-            try:
-                if record['eventSource'] == 'aws:s3':
-                    if record['eventName'] == 'ObjectCreated:Put' or record['eventName'] == 'ObjectCreated:Copy':
-                        processDocument(record)
-            except Exception as e:
-                print("Failed to process s3 record. Exception: {}".format(e))
+            if record.get('eventSource') == 'aws:s3':
+                if record['eventName'] in DOCUMENT_EVENTS:
+                    documentRecords.append(record)
+    return documentRecords
+
+
+def processDocumentRecord(record):
+    try:
+        processDocument(record)
+    except Exception as e:
+        print("Failed to process s3 record. Exception: {}".format(e))
 
 
 def lambda_handler(event, context):
 
     print("Event: {}".format(event))
 
+    documentRecords = []
     if 'Records' in event:
         for queueRecord in event['Records']:
             try:
-                processQueueRecord(queueRecord)
+                documentRecords.extend(getDocumentRecords(queueRecord))
             except Exception as e:
                 print("Failed to process queue record. Exception: {}".format(e))
 
+    # the documents of a batch are copied and registered concurrently
+    start = time.time()
+    concurrency = int(os.environ.get('BULK_CONCURRENCY', DEFAULT_BULK_CONCURRENCY))
+    with ThreadPoolExecutor(max_workers=max(1, concurrency)) as executor:
+        list(executor.map(processDocumentRecord, documentRecords))
+    print("Processed {} documents in {:.2f}s".format(len(documentRecords), time.time() - start))
@@ -15,38 +15,125 @@
 import json
 import os
 import filetype
-from helper import FileHelper, AwsHelper
+from helper import FileHelper, AwsHelper, S3Helper
+from datastore import DocumentStore
+from routingHelper import RoutingHelper, SYNC_ROUTING_PATH, DEFAULT_SYNC_MAX_PDF_BYTES, PDF_TAIL_BYTES, PDF_LINEARIZED_PAGES
 import boto3
 
+# SendMessageBatch accepts at most 10 messages
+SQS_BATCH_SIZE = 10
+
 ASYNC_JOB_TIMEOUT_SECONDS = 900
 SYNC_JOB_TIMEOUT_SECONDS = 180
 
+# filetype only looks at the first 8 KB of a file
+MIME_SNIFF_BYTES = 8192
+# cached verdict for files of no known type
+UNKNOWN_MIME_TYPE = "unknown"
 
-def postMessage(client, qUrl, jsonMessage, delaySeconds=0):
 
-    message = json.dumps(jsonMessage)
+def postMessage(messages, qUrl, jsonMessage, delaySeconds=0):
 
-    client.send_message(
-        QueueUrl=qUrl,
-        MessageBody=message,
-        DelaySeconds=delaySeconds
-    )
-    print("Submitted message to queue: {}".format(message))
+    # messages are collected for the whole stream batch and sent by sendMessages
+    messages.append({
+        'QueueUrl': qUrl,
+        'MessageBody': json.dumps(jsonMessage),
+        'DelaySeconds': delaySeconds
+    })
 
 
-def get_mime_type(request):
+def sendMessages(client, messages):
+    """
+    Sends (sequenceNumber, message) pairs with SendMessageBatch, up to 10 messages per
+    call for each queue. Returns the sequence numbers of the records with messages that
+    could not be sent.
+    """
+    failed = set()
+
+    queues = {}
+    for sequenceNumber, message in messages:
+        queues.setdefault(message['QueueUrl'], []).append((sequenceNumber, message))
+
+    for qUrl, queueMessages in queues.items():
+        for i in range(0, len(queueMessages), SQS_BATCH_SIZE):
+            batch = queueMessages[i:i + SQS_BATCH_SIZE]
+            entries = [{'Id': str(j), 'MessageBody': message['MessageBody'], 'DelaySeconds': message['DelaySeconds']}
+                       for j, (sequenceNumber, message) in enumerate(batch)]
+            try:
+                response = client.send_message_batch(QueueUrl=qUrl, Entries=entries)
+            except Exception as e:
+                print("Failed to submit {} messages to queue {}. Exception: {}".format(len(batch), qUrl, e))
+                failed.update(sequenceNumber for sequenceNumber, message in batch)
+                continue
+            for failure in response.get('Failed', []):
+                print("Failed to submit message to queue {}: {}".format(qUrl, failure))
+                failed.add(batch[int(failure['Id'])][0])
+            print("Submitted {} messages to queue: {}".format(len(response.get('Successful', [])), qUrl))
+
+    return failed
+
+
+def readDocumentHead(request):
+    # the first bytes are read once, for the mime type and for the page count of PDFs
+    if('head' not in request):
+        request['head'] = S3Helper.readBytesFromS3(request['bucketName'], request['objectName'], 0, MIME_SNIFF_BYTES)
+    return request['head']
+
+
+def get_mime_type(request, docStore, document):
     """
     Utilizes magic number checking via the 'filetype' library to determine if the files are of a valid type.
+    Only the first bytes of the document are read, and the verdict is kept on the document record so
+    that documents being processed again are not read a second time.
+    """
+    if(document and 'mimeType' in document):
+        print("Cached mime type: {}".format(document['mimeType']))
+        return document['mimeType']
+
+    file_type = filetype.guess(readDocumentHead(request))
+    mimeType = file_type.mime if file_type else UNKNOWN_MIME_TYPE
+    print("Detected mime type: {}".format(mimeType))
+
+    docStore.updateDocumentMimeType(request['documentId'], mimeType)
+    return mimeType
+
+
+def getPdfPageCount(request, size):
+    """
+    Reads the page count of a PDF from its first bytes and, unless the file is
+    linearized, from its last PDF_TAIL_BYTES, without reading the whole file.
+    """
+    head = readDocumentHead(request)
+    if(size <= len(head) or PDF_LINEARIZED_PAGES.search(head)):
+        return RoutingHelper.getPdfPageCount(head, b'')
+    tail = S3Helper.readBytesFromS3(request['bucketName'], request['objectName'], -PDF_TAIL_BYTES, PDF_TAIL_BYTES)
+    return RoutingHelper.getPdfPageCount(head, tail)
+
+
+def getRoutingPath(request, docStore, document, mimeType):
     """
-    client = boto3.client('s3')
-    local_path = f"/tmp/{request['objectName'].rsplit('/',1)[-1]}" # nosec B108
-    client.download_file(request['bucketName'],
-                         request['objectName'], local_path)
+    Sends single page PDFs and small images to the synchronous Textract APIs, and
+    everything else to the asynchronous ones. The decision is recorded on the document.
+    """
+    if(document and 'routingPath' in document):
+        print("Cached routing path: {}".format(document['routingPath']))
+        return document['routingPath']
+
+    size = S3Helper.getObjectSize(request['bucketName'], request['objectName'])
+    pageCount = None
+    # the page count is only needed for PDFs small enough for the synchronous APIs
+    if(mimeType in ['application/pdf'] and size <= int(os.environ.get('SYNC_MAX_PDF_BYTES', DEFAULT_SYNC_MAX_PDF_BYTES))):
+        pageCount = getPdfPageCount(request, size)
+    routingPath = RoutingHelper.getRoutingPath(mimeType, size, pageCount)
 
-    return filetype.guess(local_path)
+    print("Routing decision: {}".format(json.dumps({'documentId': request['documentId'], 'mimeType': mimeType,
+                                                    'objectSize': size, 'pageCount': pageCount,
+                                                    'routingPath': routingPath})))
+    docStore.updateDocumentRouting(request['documentId'], routingPath, size, pageCount)
+    return routingPath
 
 
-def processRequest(request):
+def processRequest(request, messages):
 
     output = ""
 
@@ -59,22 +146,26 @@ def processRequest(request):
 
     print("Input Object: {}/{}".format(bucketName, objectName))
 
-    client = AwsHelper().getClient('sqs')
+    docStore = DocumentStore(os.environ['DOCUMENTS_TABLE'], os.environ.get('OUTPUT_TABLE'))
+    document = docStore.getDocument(documentId)
+    if(document and 'documentQueuedOn' in document):
+        print("Document {} is already queued, skipping".format(documentId))
+        return
 
-    file_type = get_mime_type(request)
+    mimeType = get_mime_type(request, docStore, document)
 
     # If not expected extension, change status to FAILED and exit
-    if not file_type or file_type.mime not in ['application/pdf', 'image/png', 'image/jpeg']:
+    if mimeType not in ['application/pdf', 'image/png', 'image/jpeg']:
         jsonErrorHandlerMessage = {
             'documentId': documentId
         }
-        postMessage(client, jobErrorHandlerQueueUrl, jsonErrorHandlerMessage)
+        postMessage(messages, jobErrorHandlerQueueUrl, jsonErrorHandlerMessage)
         return
 
-    if(file_type.mime in ['image/png', 'image/jpeg']):
+    if(getRoutingPath(request, docStore, document, mimeType) == SYNC_ROUTING_PATH):
         qUrl = request['syncQueueUrl']
         errorHandlerTimeoutSeconds = SYNC_JOB_TIMEOUT_SECONDS
-    elif (file_type.mime in ['application/pdf']):
+    else:
         qUrl = request['asyncQueueUrl']
         errorHandlerTimeoutSeconds = ASYNC_JOB_TIMEOUT_SECONDS
 
@@ -84,19 +175,19 @@ def processRequest(request):
                        "features": features,
                        'bucketName': bucketName,
                        'objectName': objectName}
-        postMessage(client, qUrl, jsonMessage)
+        postMessage(messages, qUrl, jsonMessage)
 
         jsonErrorHandlerMessage = {
             'documentId': documentId
         }
-        postMessage(client, jobErrorHandlerQueueUrl,
+        postMessage(messages, jobErrorHandlerQueueUrl,
                     jsonErrorHandlerMessage, errorHandlerTimeoutSeconds)
 
     output = "Completed routing for documentId: {}, object: {}/{}".format(
         documentId, bucketName, objectName)
 
 
-def processRecord(record, syncQueueUrl, asyncQueueUrl, errorHandlerQueueUrl):
+def processRecord(record, syncQueueUrl, asyncQueueUrl, errorHandlerQueueUrl, messages):
 
     newImage = record["dynamodb"]["NewImage"]
 
@@ -125,30 +216,70 @@ def processRecord(record, syncQueueUrl, asyncQueueUrl, errorHandlerQueueUrl):
         request['syncQueueUrl'] = syncQueueUrl
         request['asyncQueueUrl'] = asyncQueueUrl
         request['errorHandlerQueueUrl'] = errorHandlerQueueUrl
-        processRequest(request)
+        processRequest(request, messages)
+
+    return documentId
+
+
+def getSequenceNumber(record):
+    if("dynamodb" in record and record["dynamodb"]):
+        return record["dynamodb"].get("SequenceNumber")
+    return None
 
 
 def lambda_handler(event, context):
 
+    # records whose messages were not all sent are reported so that only they are retried
+    failed = set()
+    # documents of the records with messages, by record sequence number
+    queued = {}
+
     try:
 
         print("Event: {}".format(event))
 
+        docStore = DocumentStore(os.environ['DOCUMENTS_TABLE'], os.environ.get('OUTPUT_TABLE'))
         syncQueueUrl = os.environ['SYNC_QUEUE_URL']
         asyncQueueUrl = os.environ['ASYNC_QUEUE_URL']
         errorHandlerQueueUrl = os.environ['ERROR_HANDLER_QUEUE_URL']
+        messages = []
         if("Records" in event and event["Records"]):
             for record in event["Records"]:
+                sequenceNumber = getSequenceNumber(record)
                 try:
                     print("Processing record: {}".format(record))
 
                     if("eventName" in record and record["eventName"] == "INSERT"):
                         if("dynamodb" in record and record["dynamodb"] and "NewImage" in record["dynamodb"]):
-                            processRecord(record, syncQueueUrl,
-                                          asyncQueueUrl, errorHandlerQueueUrl)
+                            recordMessages = []
+                            documentId = processRecord(record, syncQueueUrl,
+                                                       asyncQueueUrl, errorHandlerQueueUrl, recordMessages)
+                            if(recordMessages):
+                                queued[sequenceNumber] = documentId
+                                messages.extend((sequenceNumber, message) for message in recordMessages)
 
                 except Exception as e:
                     print("Failed to process record. Exception: {}".format(e))
+                    failed.add(sequenceNumber)
+
+        if(messages):
+            failed.update(sendMessages(AwsHelper().getClient('sqs'), messages))
+
+        # documents are only marked once all their messages were sent, so that a record
+        # delivered again is skipped. A record retried before its document was marked sends
+        # its messages again, the async processor and the sync processor ignore duplicates.
+        for sequenceNumber, documentId in queued.items():
+            if(sequenceNumber not in failed):
+                try:
+                    docStore.markDocumentQueued(documentId)
+                except Exception as e:
+                    print("Failed to mark document {} as queued. Exception: {}".format(documentId, e))
 
     except Exception as e:
         print("Failed to process records. Exception: {}".format(e))
+        failed.update(getSequenceNumber(record) for record in event.get("Records", []))
+
+    failed.discard(None)
+    return {
+        "batchItemFailures": [{"itemIdentifier": sequenceNumber} for sequenceNumber in sorted(failed, key=int)]
+    }
@@ -0,0 +1,208 @@
+
+######################################################################################################################
+#  Copyright 2020 Amazon.com, Inc. or its affiliates. All Rights Reserved.                                           #
+#                                                                                                                    #
+#  Licensed under the Apache License, Version 2.0 (the License). You may not use this file except in compliance    #
+#  with the License. A copy of the License is located at                                                             #
+#                                                                                                                    #
+#      http://www.apache.org/licenses/LICENSE-2.0                                                                    #
+#                                                                                                                    #
+#  or in the 'license' file accompanying this file. This file is distributed on an 'AS IS' BASIS, WITHOUT WARRANTIES #
+#  OR CONDITIONS OF ANY KIND, express or implied. See the License for the specific language governing permissions    #
+#  and limitations under the License.                                                                                #
+#####################################################################################################################
+
+import hashlib
+import json
+import os
+import tempfile
+import threading
+import collections
+from helper import AwsHelper
+
+# language of the texts sent to Comprehend
+DEFAULT_LANGUAGE = "en"
+
+# number of results kept by the in-memory cache of a Lambda container
+DEFAULT_MEMORY_CACHE_SIZE = 2048
+
+# folder of the local disk cache, /tmp survives between warm invocations
+DEFAULT_DISK_CACHE_DIRECTORY = "/tmp/comprehend-cache"
+
+# key prefix of the results cached in S3
+DEFAULT_S3_CACHE_PREFIX = "comprehend-cache/"
+
+
+class MemoryCacheBackend:
+    """
+    Least recently used cache of results held in the memory of the container.
+    """
+
+    def __init__(self, maxEntries=DEFAULT_MEMORY_CACHE_SIZE):
+        self._maxEntries = maxEntries
+        self._entries = collections.OrderedDict()
+        self._lock = threading.Lock()
+
+    def get(self, key):
+        with self._lock:
+            value = self._entries.get(key)
+            if(value is not None):
+                self._entries.move_to_end(key)
+            return value
+
+    def put(self, key, value):
+        with self._lock:
+            self._entries[key] = value
+            self._entries.move_to_end(key)
+            while(len(self._entries) > self._maxEntries):
+                self._entries.popitem(last=False)
+
+
+class DiskCacheBackend:
+    """
+    Results stored as one json file per key in a local folder.
+    """
+
+    def __init__(self, directory=DEFAULT_DISK_CACHE_DIRECTORY):
+        self._directory = directory
+        os.makedirs(directory, exist_ok=True)
+
+    def get(self, key):
+        try:
+            with open(os.path.join(self._directory, key), 'r') as f:
+                return json.load(f)
+        except FileNotFoundError:
+            return None
+
+    def put(self, key, value):
+        # write to a temporary file first so readers never see a partial result
+        fd, path = tempfile.mkstemp(dir=self._directory)
+        with os.fdopen(fd, 'w') as f:
+            json.dump(value, f)
+        os.replace(path, os.path.join(self._directory, key))
+
+
+class S3CacheBackend:
+    """
+    Results stored as json objects under a prefix of an S3 bucket, shared by all containers.
+    """
+
+    def __init__(self, bucketName, prefix=DEFAULT_S3_CACHE_PREFIX):
+        self._bucketName = bucketName
+        self._prefix = prefix
+
+    def get(self, key):
+        client = AwsHelper().getClient('s3')
+        try:
+            response = client.get_object(Bucket=self._bucketName, Key=self._prefix + key)
+        except client.exceptions.NoSuchKey:
+            return None
+        return json.loads(response['Body'].read().decode('utf-8'))
+
+    def put(self, key, value):
+        client = AwsHelper().getClient('s3')
+        client.put_object(Bucket=self._bucketName, Key=self._prefix + key, Body=json.dumps(value))
+
+
+class DynamoDBCacheBackend:
+    """
+    Results stored as json strings in a DynamoDB table with a "cacheKey" string partition key,
+    shared by all containers. Results are kept as strings since DynamoDB does not take floats.
+    """
+
+    def __init__(self, tableName):
+        self._tableName = tableName
+
+    def get(self, key):
+        table = AwsHelper().getResource('dynamodb').Table(self._tableName)
+        response = table.get_item(Key={'cacheKey': key})
+        if('Item' not in response):
+            return None
+        return json.loads(response['Item']['result'])
+
+    def put(self, key, value):
+        table = AwsHelper().getResource('dynamodb').Table(self._tableName)
+        table.put_item(Item={'cacheKey': key, 'result': json.dumps(value)})
+
+
+class ComprehendCache:
+    """
+    Content addressed cache of Comprehend and Comprehend Medical results. Results are keyed
+    by a hash of the API, the language and the text sent, so identical pages are only
+    analysed once. Backends are looked up in order and a hit in a later backend is copied
+    to the earlier ones. Backend failures are logged and treated as misses.
+    """
+
+    def __init__(self, backends):
+        self._backends = backends
+
+    @staticmethod
+    def key(api, text, language=DEFAULT_LANGUAGE):
+        digest = hashlib.sha256()
+        for part in (api, language, text):
+            digest.update(part.encode('utf-8'))
+            digest.update(b'\0')
+        return digest.hexdigest()
+
+    def get(self, api, text, language=DEFAULT_LANGUAGE):
+        key = ComprehendCache.key(api, text, language)
+        for i, backend in enumerate(self._backends):
+            try:
+                value = backend.get(key)
+            except Exception as e:
+                print("Comprehend cache lookup failed: {}".format(e))
+                continue
+            if(value is not None):
+                for earlier in self._backends[:i]:
+                    self._put(earlier, key, value)
+                return value
+        return None
+
+    def put(self, api, text, value, language=DEFAULT_LANGUAGE):
+        key = ComprehendCache.key(api, text, language)
+        for backend in self._backends:
+            self._put(backend, key, value)
+
+    @staticmethod
+    def _put(backend, key, value):
+        try:
+            backend.put(key, value)
+        except Exception as e:
+            print("Comprehend cache update failed: {}".format(e))
+
+
+_cache = None
+_cacheLock = threading.Lock()
+
+
+#
+# returns the cache of the container, configured with environment variables:
+#
+#   COMPREHEND_CACHE:           comma separated backends looked up in order, among
+#                               "memory", "disk", "s3" and "dynamodb". Defaults to "memory",
+#                               "none" disables the cache
+#   COMPREHEND_CACHE_SIZE:      number of results kept in memory
+#   COMPREHEND_CACHE_DIRECTORY: folder of the disk backend
+#   COMPREHEND_CACHE_BUCKET:    bucket of the s3 backend, COMPREHEND_CACHE_PREFIX is its key prefix
+#   COMPREHEND_CACHE_TABLE:     table of the dynamodb backend
+#
+def getComprehendCache():
+    global _cache
+    with _cacheLock:
+        if(_cache is None):
+            backends = []
+            for name in os.environ.get('COMPREHEND_CACHE', 'memory').split(','):
+                name = name.strip().lower()
+                if(name == 'memory'):
+                    backends.append(MemoryCacheBackend(int(os.environ.get('COMPREHEND_CACHE_SIZE', DEFAULT_MEMORY_CACHE_SIZE))))
+                elif(name == 'disk'):
+                    backends.append(DiskCacheBackend(os.environ.get('COMPREHEND_CACHE_DIRECTORY', DEFAULT_DISK_CACHE_DIRECTORY)))
+                elif(name == 's3'):
+                    backends.append(S3CacheBackend(os.environ['COMPREHEND_CACHE_BUCKET'],
+                                                   os.environ.get('COMPREHEND_CACHE_PREFIX', DEFAULT_S3_CACHE_PREFIX)))
+                elif(name == 'dynamodb'):
+                    backends.append(DynamoDBCacheBackend(os.environ['COMPREHEND_CACHE_TABLE']))
+                elif(name != 'none' and name != ''):
+                    print("Unknown Comprehend cache backend {}".format(name))
+            _cache = ComprehendCache(backends)
+        return _cache
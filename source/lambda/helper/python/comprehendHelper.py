@@ -14,10 +14,12 @@
 
 import boto3
 from botocore.exceptions import ClientError
-from botocore.config import Config
 import json
+import os
 import threading
-from helper import S3Helper
+from concurrent.futures import ThreadPoolExecutor
+from helper import AwsHelper, S3Helper, TokenBucket
+from comprehendCache import getComprehendCache
 import time
 
 
@@ -30,6 +32,43 @@ PAGES_PER_BATCH = 15
 # maximum retries for comprehend and comprehend medical API call
 MAX_API_RETRIES = 6
 
+# pooled client config for comprehend and comprehend medical
+COMPREHEND_CLIENT_CONFIG = {
+    'retries': {
+        'max_attempts': MAX_API_RETRIES,
+        'mode': 'standard'
+    }
+}
+
+# sustained calls per second for each API, kept under the service limits so calls are not
+# throttled. Can be overridden with the <API>_TPS environment variables, i.e. DETECT_ENTITIES_V2_TPS
+DEFAULT_API_TPS = {
+    'batch_detect_entities': 10,
+    'detect_entities': 20,
+    'detect_entities_v2': 10,
+    'infer_icd10_cm': 10
+}
+
+# number of Comprehend and Comprehend Medical calls in flight for a document,
+# can be overridden with the COMPREHEND_CONCURRENCY environment variable
+DEFAULT_COMPREHEND_CONCURRENCY = 16
+
+# one rate limiter per API for the whole process, so concurrent documents share the budget
+_rateLimiters = {}
+_rateLimitersLock = threading.Lock()
+
+
+def getRateLimiter(api):
+    with _rateLimitersLock:
+        limiter = _rateLimiters.get(api)
+        if limiter is None:
+            tps = float(os.environ.get("{}_TPS".format(api.upper()), DEFAULT_API_TPS[api]))
+            # no burst above the sustained rate, calls are spread evenly over each second
+            limiter = TokenBucket(tps, capacity=1)
+            _rateLimiters[api] = limiter
+        return limiter
+
+
 class ComprehendHelper:
 
     def getNumOfPages(self,
@@ -90,6 +129,26 @@ class ComprehendHelper:
 
         return numOfPages
 
+    #
+    # same as extractTextByPages, for line texts already grouped by page, i.e. from a
+    # trp.Document or the PAGELINES output of the OutputGenerator
+    #
+    def extractTextFromPageLines(self,
+                                 pageLines,
+                                 rawPages,
+                                 numOfPages):
+
+        for pageResultIndex in range(0, numOfPages):
+            for text in pageLines[pageResultIndex]:
+
+                # same size limit and ". " separator as for the textract blocks
+                projectedSize = len(rawPages[pageResultIndex]) + len(text) + 2
+                if MAX_COMPREHEND_UTF8_PAGE_SIZE > projectedSize:
+                    rawPages[pageResultIndex] += ". "
+                    rawPages[pageResultIndex] += text
+
+        return numOfPages
+
     #
     # thread execution calling Comprehend synchronously by batch of up to
     # 25 pages
@@ -97,35 +156,28 @@ class ComprehendHelper:
     
     def batchComprehendDetectEntitiesSync(self,
                                           rawPages,
-                                          pagesToProcess,
-                                          pageStartIndex,
+                                          pageIndexes,
                                           comprehendEntities):
 
-        config = Config(
-                        retries = {
-                        'max_attempts': MAX_API_RETRIES,
-                        'mode': 'standard'
-                        }
-        )
-                        
-        client = boto3.client('comprehend', config=config)
+        client = AwsHelper().getClient('comprehend', config=COMPREHEND_CLIENT_CONFIG)
         
         textPages = []
-        endIndex = pageStartIndex + pagesToProcess
-
-        for i in range(pageStartIndex, endIndex):
+        for i in pageIndexes:
             textPages.append(rawPages[i])
 
-        # service limit is around 10tps, sdk implements 3 retries with backoff
-        # if that's not enough then fail
+        # service limit is around 10tps, calls are paced by the rate limiter and
+        # the sdk retries with backoff if that's not enough
+        getRateLimiter('batch_detect_entities').acquire()
         response = client.batch_detect_entities(
             TextList=textPages,
             LanguageCode="en")
 
-        # store results
-        for i in range(0, pagesToProcess):
-            comprehendEntities[pageStartIndex +
-                               i] = response['ResultList'][i]
+        # store results, Index is the position of the page in this batch
+        cache = getComprehendCache()
+        for result in response['ResultList']:
+            pageIndex = pageIndexes[result['Index']]
+            comprehendEntities[pageIndex] = {'Entities': result['Entities']}
+            cache.put('batch_detect_entities', rawPages[pageIndex], comprehendEntities[pageIndex])
     
     #
     # thread execution calling ComprehendMedical Entities synchronously for each page
@@ -136,17 +188,11 @@ class ComprehendHelper:
                                             index,
                                             comprehendMedicalEntities,
                                             mutex):
-        config = Config(
-                        retries = {
-                        'max_attempts': MAX_API_RETRIES,
-                        'mode': 'standard'
-                        }
-        )
-                        
-        client = boto3.client('comprehendmedical', config=config)
+        client = AwsHelper().getClient('comprehendmedical', config=COMPREHEND_CLIENT_CONFIG)
     
-        # service limit is 10tps, sdk implements 3 retries with backoff
-        # if that's not enough then fail
+        # service limit is 10tps, calls are paced by the rate limiter and
+        # the sdk retries with backoff if that's not enough
+        getRateLimiter('detect_entities_v2').acquire()
         response = client.detect_entities_v2(Text=rawPages[index])
 
         # save results for later processing
@@ -157,6 +203,8 @@ class ComprehendHelper:
         comprehendMedicalEntities[index] = response['Entities']
         mutex.release()
 
+        getComprehendCache().put('detect_entities_v2', rawPages[index], response['Entities'])
+
     
     #
     # thread execution calling ComprehendMedical ICD10 synchronously for each page
@@ -168,17 +216,11 @@ class ComprehendHelper:
                                          comprehendMedicalICD10,
                                          mutex):
 
-        config = Config(
-                        retries = {
-                        'max_attempts': MAX_API_RETRIES,
-                        'mode': 'standard'
-                        }
-        )
-
-        client = boto3.client('comprehendmedical', config=config)
+        client = AwsHelper().getClient('comprehendmedical', config=COMPREHEND_CLIENT_CONFIG)
             
-        # service limit is 10tps, sdk implements 3 retries with backoff
-        # if that's not enough then fail
+        # service limit is 10tps, calls are paced by the rate limiter and
+        # the sdk retries with backoff if that's not enough
+        getRateLimiter('infer_icd10_cm').acquire()
         response = client.infer_icd10_cm(Text=rawPages[index])
         
         # save results for later processing
@@ -189,6 +231,8 @@ class ComprehendHelper:
         comprehendMedicalICD10[index] = response['Entities']
         mutex.release()
 
+        getComprehendCache().put('infer_icd10_cm', rawPages[index], response['Entities'])
+
 
     #
     # processes all Comprehend results for all pages
@@ -209,12 +253,23 @@ class ComprehendHelper:
             # page number start at 1 but list of page data starts at 0
             page['Page'] = p + 1
             page['Entities'] = []
+            # every occurrence of the entities with its offsets in the page text sent to
+            # Comprehend, the api processor maps them back to the lines it redacts
+            page['Mentions'] = []
 
             # to detect and skip duplicates
             entities = set()
 
             for e in comprehendEntities[p]['Entities']:
 
+                page['Mentions'].append({
+                    'Text': e['Text'],
+                    'Type': e['Type'],
+                    'Score': e['Score'],
+                    'BeginOffset': e['BeginOffset'],
+                    'EndOffset': e['EndOffset']
+                })
+
                 # add this entity if not already present
                 if e['Text'].upper() not in entities:
                     # add entity to results list
@@ -353,22 +408,36 @@ class ComprehendHelper:
     #   documentPath:               path of the document i.e. "public/1581983617022/premera.pdf/bb2186ec-51e0-11ea-a3c3-2e0ec40645f6/"
     #   maxPages:                   max number of pages to process for the document, counted from page 1. Suggested to limit
     #                               that number to 200 pages or so.
+    #   document:                   optional trp.Document already parsed from the Textract results
+    #   pageLines:                  optional list of line texts per page, i.e. the PAGELINES output of the OutputGenerator
+    #   pageEntities:               optional list filled with the entities of each page, by entity type or category
+    #
+    #   Textract results are only read back from textractResponseLocation when neither document nor pageLines is given.
     #
 
     def processComprehend(self,
                           bucket,
                           textractResponseLocation,
                           comprehendOutputPath,
-                          maxPages=200):
-
-
-        # get textract results from S3
-        textractFile = S3Helper.readFromS3(
-            bucket, textractResponseLocation)
-        textract = json.loads(textractFile)
-
-        # total number of textracted pages
-        numOfPages = self.getNumOfPages(textract)
+                          maxPages=200,
+                          document=None,
+                          pageLines=None,
+                          pageEntities=None):
+
+        if pageLines is None and document is not None:
+            pageLines = [[line.text for line in page.lines] for page in document.pages]
+
+        textract = None
+        if pageLines is None:
+            # get textract results from S3
+            textractFile = S3Helper.readFromS3(
+                bucket, textractResponseLocation)
+            textract = json.loads(textractFile)
+
+            # total number of textracted pages
+            numOfPages = self.getNumOfPages(textract)
+        else:
+            numOfPages = len(pageLines)
 
         # error
         if numOfPages <= 0:
@@ -382,85 +451,102 @@ class ComprehendHelper:
         # initialize rawPages with atleast a 1 character string helps prevent errors produced by comprehend and comprehend medical
         # comprehend and comprehend medical need text with atleast 1 character and infer_icd10_cm() needs a non empty string
         rawPages = ["."] * numOfPages
-        if self.extractTextByPages(textract, rawPages, numOfPages) == False:
+        if textract is None:
+            self.extractTextFromPageLines(pageLines, rawPages, numOfPages)
+        elif self.extractTextByPages(textract, rawPages, numOfPages) == False:
             return False
 
-        # process pages by batches of 25 max, determine how many batches we need
-        numOfBatches = int(numOfPages / PAGES_PER_BATCH)
-        if numOfPages % PAGES_PER_BATCH != 0:
-            numOfBatches += 1
-
         # to store comprehend and medical API calls results.
         comprehendEntities = [None] * numOfPages
         comprehendMedicalEntities = [None] * numOfPages
         comprehendMedicalICD10 = [None] * numOfPages
 
-        pagesProcessed = 0
-
-        # process pages by batch
-        for batch in range(0, numOfBatches):
-
-            pageStartIndex = batch * PAGES_PER_BATCH
-            pagesToProcess = numOfPages - pagesProcessed
-
-            if pagesToProcess > PAGES_PER_BATCH:
-                pagesToProcess = PAGES_PER_BATCH
-
-            # keep track of all threads we spawn
-            threads = list()
-
-            # Comprehend call that can batch up to 25 pages together synchronously
-            x = threading.Thread(target=self.batchComprehendDetectEntitiesSync,
-                                 args=(rawPages, pagesToProcess, pageStartIndex, comprehendEntities))
-            x.start()
-            threads.append(x)
-
-            # comprehendMedicalEntities is shared among threads
-            medicalEntitiesMutex = threading.Lock()
-
-            # ComprehendMedical
-            for index in range(0, pagesToProcess):
-
-                # Comprehend Medical can only handle one page at a time synchronously. The SDK handles
-                # throttling by the service.
-                x = threading.Thread(target=self.comprehendMedicalDetectEntitiesSync,
-                                     args=(rawPages,
-                                           pageStartIndex + index,
-                                           comprehendMedicalEntities,
-                                           medicalEntitiesMutex))
-                x.start()
-                threads.append(x)
-
-            # comprehendMedicalEntities is shared among threads
-            medicalICD10Mutex = threading.Lock()
-
-            # ComprehendMedical
-            for index in range(0, pagesToProcess):
-
-                # Comprehend Medical can only handle one page at a time synchronously. The SDK handles
-                # throttling by the service.
-                x = threading.Thread(target=self.comprehendMedicalDetectICD10Sync,
-                                     args=(rawPages,
-                                           pageStartIndex + index,
-                                           comprehendMedicalICD10,
-                                           medicalICD10Mutex))
-                x.start()
-                threads.append(x)
-
-            # wait on all threads to finish their work
-            for index, thread in enumerate(threads):
-                thread.join()
-
-            print("All threads joined...")
-
-            # check success of threads
-            for i in range(pageStartIndex, pagesToProcess):
-                if (comprehendEntities[pageStartIndex + i] == None) or (comprehendMedicalEntities[pageStartIndex + i] == None):
-                    print("Page failed to process" + str(i))
+        # pages with the same text as an earlier page of the document reuse its results
+        firstPageOfText = {}
+        duplicatePages = {}
+        for i in range(0, numOfPages):
+            first = firstPageOfText.setdefault(rawPages[i], i)
+            if first != i:
+                duplicatePages[i] = first
+
+        # comprehendMedicalEntities and comprehendMedicalICD10 are shared among workers
+        medicalEntitiesMutex = threading.Lock()
+        medicalICD10Mutex = threading.Lock()
+
+        # all calls for the document go through a fixed pool of workers, each API paced by
+        # its own rate limiter. Calls are queued batch after batch without waiting for the
+        # previous batch to complete, so the pool keeps every API at its configured rate.
+        # Only pages missing from the cache are sent.
+        concurrency = int(os.environ.get('COMPREHEND_CONCURRENCY', DEFAULT_COMPREHEND_CONCURRENCY))
+        futures = []
+        with ThreadPoolExecutor(max_workers=concurrency) as executor:
+            # pages analysed before, here or by another document, are served from the cache.
+            # The lookups run on the workers too, the s3 and dynamodb backends are network calls
+            cache = getComprehendCache()
+            lookups = []
+            for i in range(0, numOfPages):
+                if i in duplicatePages:
+                    continue
+                for api, results in (('batch_detect_entities', comprehendEntities),
+                                     ('detect_entities_v2', comprehendMedicalEntities),
+                                     ('infer_icd10_cm', comprehendMedicalICD10)):
+                    lookups.append((results, i, executor.submit(cache.get, api, rawPages[i])))
+            cacheHits = 0
+            for results, i, lookup in lookups:
+                results[i] = lookup.result()
+                if results[i] is not None:
+                    cacheHits += 1
+            print("Comprehend cache hits: {} of {} ({:.1%})".format(cacheHits, len(lookups), cacheHits / len(lookups)))
+
+            for pageStartIndex in range(0, numOfPages, PAGES_PER_BATCH):
+                pageIndexes = range(pageStartIndex, min(pageStartIndex + PAGES_PER_BATCH, numOfPages))
+
+                # Comprehend call that can batch up to 25 pages together synchronously
+                batchIndexes = [i for i in pageIndexes if comprehendEntities[i] is None and i not in duplicatePages]
+                if batchIndexes:
+                    futures.append(executor.submit(self.batchComprehendDetectEntitiesSync,
+                                                   rawPages, batchIndexes, comprehendEntities))
+
+                # Comprehend Medical can only handle one page at a time synchronously
+                for index in pageIndexes:
+                    if index in duplicatePages:
+                        continue
+                    if comprehendMedicalEntities[index] is None:
+                        futures.append(executor.submit(self.comprehendMedicalDetectEntitiesSync,
+                                                       rawPages, index, comprehendMedicalEntities, medicalEntitiesMutex))
+                    if comprehendMedicalICD10[index] is None:
+                        futures.append(executor.submit(self.comprehendMedicalDetectICD10Sync,
+                                                       rawPages, index, comprehendMedicalICD10, medicalICD10Mutex))
+
+            # surface the first failed call
+            for future in futures:
+                try:
+                    future.result()
+                except Exception as e:
+                    print("Comprehend call failed: {}".format(e))
                     return False
 
-            # increment the number of pages processed for the next batch
-            pagesProcessed += pagesToProcess
+        print("All Comprehend calls completed...")
+
+        for i, first in duplicatePages.items():
+            comprehendEntities[i] = comprehendEntities[first]
+            comprehendMedicalEntities[i] = comprehendMedicalEntities[first]
+            comprehendMedicalICD10[i] = comprehendMedicalICD10[first]
+
+        # check success of all pages
+        for i in range(0, numOfPages):
+            if (comprehendEntities[i] == None) or (comprehendMedicalEntities[i] == None) or (comprehendMedicalICD10[i] == None):
+                print("Page failed to process" + str(i))
+                return False
+
+        if pageEntities is not None:
+            for p in range(0, numOfPages):
+                entities = {}
+                for e in comprehendEntities[p]['Entities']:
+                    entities.setdefault(e['Type'], set()).add(e['Text'])
+                for e in comprehendMedicalEntities[p]:
+                    entities.setdefault(e['Category'], set()).add(e['Text'])
+                pageEntities.append({key: sorted(val) for key, val in entities.items()})
 
         # process comprehend data, create the entities result file in S3
         processedComprehendData = self.processAndReturnComprehendEntities(comprehendEntities,
@@ -115,6 +115,88 @@ class DocumentStore:
 
         return err
 
+    def updateDocumentMimeType(self, documentId, mimeType):
+
+        err = None
+
+        dynamodb = AwsHelper().getResource("dynamodb")
+        table = dynamodb.Table(self._documentsTableName)
+
+        try:
+            table.update_item(
+                Key={'documentId': documentId},
+                UpdateExpression='SET mimeType = :mimeTypeValue',
+                ConditionExpression='attribute_exists(documentId)',
+                ExpressionAttributeValues={
+                    ':mimeTypeValue': mimeType
+                }
+            )
+        except ClientError as e:
+            if e.response['Error']['Code'] == "ConditionalCheckFailedException":
+                print(e.response['Error']['Message'])
+                err = {'Error': 'Document does not exist.'}
+            else:
+                raise
+
+        return err
+
+    def updateDocumentRouting(self, documentId, routingPath, objectSize, pageCount=None):
+
+        err = None
+
+        dynamodb = AwsHelper().getResource("dynamodb")
+        table = dynamodb.Table(self._documentsTableName)
+
+        updateExpression = 'SET routingPath = :routingPathValue, objectSize = :objectSizeValue'
+        expressionAttributeValues = {
+            ':routingPathValue': routingPath,
+            ':objectSizeValue': objectSize
+        }
+        if(pageCount is not None):
+            updateExpression += ', pageCount = :pageCountValue'
+            expressionAttributeValues[':pageCountValue'] = pageCount
+
+        try:
+            table.update_item(
+                Key={'documentId': documentId},
+                UpdateExpression=updateExpression,
+                ConditionExpression='attribute_exists(documentId)',
+                ExpressionAttributeValues=expressionAttributeValues
+            )
+        except ClientError as e:
+            if e.response['Error']['Code'] == "ConditionalCheckFailedException":
+                print(e.response['Error']['Message'])
+                err = {'Error': 'Document does not exist.'}
+            else:
+                raise
+
+        return err
+
+    def markDocumentQueued(self, documentId):
+
+        err = None
+
+        dynamodb = AwsHelper().getResource("dynamodb")
+        table = dynamodb.Table(self._documentsTableName)
+
+        try:
+            table.update_item(
+                Key={'documentId': documentId},
+                UpdateExpression='SET documentQueuedOn = :documentQueuedOnValue',
+                ConditionExpression='attribute_exists(documentId)',
+                ExpressionAttributeValues={
+                    ':documentQueuedOnValue': str(datetime.datetime.utcnow())
+                }
+            )
+        except ClientError as e:
+            if e.response['Error']['Code'] == "ConditionalCheckFailedException":
+                print(e.response['Error']['Message'])
+                err = {'Error': 'Document does not exist.'}
+            else:
+                raise
+
+        return err
+
     def getDocument(self, documentId):
 
         dynamodb = AwsHelper().getClient("dynamodb")
@@ -133,6 +215,15 @@ class DocumentStore:
                 'objectName': ddbGetItemResponse['Item']['objectName']['S'],
                 'documentStatus': ddbGetItemResponse['Item']['documentStatus']['S'],
             }
+            if('mimeType' in ddbGetItemResponse['Item']):
+                itemToReturn['mimeType'] = ddbGetItemResponse['Item']['mimeType']['S']
+            if('routingPath' in ddbGetItemResponse['Item']):
+                itemToReturn['routingPath'] = ddbGetItemResponse['Item']['routingPath']['S']
+            if('documentQueuedOn' in ddbGetItemResponse['Item']):
+                itemToReturn['documentQueuedOn'] = ddbGetItemResponse['Item']['documentQueuedOn']['S']
+            for name in ['objectSize', 'pageCount']:
+                if(name in ddbGetItemResponse['Item']):
+                    itemToReturn[name] = int(ddbGetItemResponse['Item'][name]['N'])
 
         return itemToReturn
 
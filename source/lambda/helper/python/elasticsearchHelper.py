@@ -0,0 +1,203 @@
+
+######################################################################################################################
+#  Copyright 2020 Amazon.com, Inc. or its affiliates. All Rights Reserved.                                           #
+#                                                                                                                    #
+#  Licensed under the Apache License, Version 2.0 (the License). You may not use this file except in compliance    #
+#  with the License. A copy of the License is located at                                                             #
+#                                                                                                                    #
+#      http://www.apache.org/licenses/LICENSE-2.0                                                                    #
+#                                                                                                                    #
+#  or in the 'license' file accompanying this file. This file is distributed on an 'AS IS' BASIS, WITHOUT WARRANTIES #
+#  OR CONDITIONS OF ANY KIND, express or implied. See the License for the specific language governing permissions    #
+#  and limitations under the License.                                                                                #
+#####################################################################################################################
+
+import json
+import os
+import random
+import threading
+import time
+import boto3
+from elasticsearch import Elasticsearch, RequestsHttpConnection, client
+from elasticsearch.exceptions import RequestError
+from requests.auth import AuthBase
+from requests_aws4auth import AWS4Auth
+
+ES_SERVICE = 'es'
+
+# bulk requests are sent once they hold this many documents or bytes, or once the oldest
+# buffered document is this old
+DEFAULT_BULK_MAX_ACTIONS = 500
+DEFAULT_BULK_MAX_BYTES = 5 * 1024 * 1024
+DEFAULT_BULK_MAX_DELAY_SECONDS = 5
+
+# refresh parameter of bulk requests, can be overridden with the ES_BULK_REFRESH environment variable
+DEFAULT_BULK_REFRESH = "false"
+
+# retries of documents rejected because the cluster is busy, with exponential backoff
+MAX_BULK_RETRIES = 3
+BULK_BACKOFF_BASE_SECONDS = 0.5
+
+
+class RefreshingAWS4Auth(AuthBase):
+    """
+    Signs requests with the current credentials of the default boto3 session. AWS4Auth
+    keeps the keys it was built with, so a new signer is built whenever the session
+    credentials are rotated.
+    """
+
+    def __init__(self, region, service=ES_SERVICE):
+        self._credentials = boto3.Session().get_credentials()
+        self._region = region
+        self._service = service
+        self._frozenCredentials = None
+        self._auth = None
+        self._lock = threading.Lock()
+
+    def __call__(self, request):
+        credentials = self._credentials.get_frozen_credentials()
+        with self._lock:
+            if(credentials != self._frozenCredentials):
+                self._auth = AWS4Auth(credentials.access_key, credentials.secret_key,
+                                      self._region, self._service, session_token=credentials.token)
+                self._frozenCredentials = credentials
+            auth = self._auth
+        return auth(request)
+
+
+# clients and created indices are kept for the life of the container, so warm invocations
+# reuse the HTTPS connections and do not check the indices again
+_clients = {}
+_bulkIndexers = {}
+_indices = set()
+_lock = threading.Lock()
+
+
+class ElasticsearchHelper:
+
+    @staticmethod
+    def getClient(host):
+        with _lock:
+            es = _clients.get(host)
+            if(es is None):
+                es = Elasticsearch(
+                    hosts=[{'host': host, 'port': 443}],
+                    http_auth=RefreshingAWS4Auth(boto3.Session().region_name),
+                    use_ssl=True,
+                    verify_certs=True,
+                    connection_class=RequestsHttpConnection
+                )
+                _clients[host] = es
+            return es
+
+    @staticmethod
+    def ensureIndex(host, index, body):
+        if((host, index) in _indices):
+            return
+        es = ElasticsearchHelper.getClient(host)
+        es_index_client = client.IndicesClient(es)
+        if not es_index_client.exists(index=index):
+            print("Index '{}' does not exist, creating...".format(index))
+            try:
+                es_index_client.create(index=index, body=body)
+            except RequestError as e:
+                # another container created it first
+                if(e.error != 'resource_already_exists_exception'):
+                    raise
+        with _lock:
+            _indices.add((host, index))
+
+    @staticmethod
+    def getBulkIndexer(host):
+        with _lock:
+            indexer = _bulkIndexers.get(host)
+            if(indexer is None):
+                indexer = ElasticsearchBulkIndexer(host,
+                                                   refresh=os.environ.get('ES_BULK_REFRESH', DEFAULT_BULK_REFRESH))
+                _bulkIndexers[host] = indexer
+            return indexer
+
+
+class ElasticsearchBulkIndexer:
+    """
+    Buffers documents and sends them with the _bulk API. A request is sent once the buffer
+    holds maxActions documents or maxBytes of json, or when a document is added more than
+    maxDelaySeconds after the oldest buffered one. There is no background timer since a
+    Lambda container is frozen between invocations, so callers flush() before returning.
+    Documents rejected with 429 are retried with backoff, other rejected documents are
+    logged and returned by flush(). refresh is passed to every request, "false" leaves
+    refreshing to the index refresh interval.
+    """
+
+    def __init__(self, host, maxActions=DEFAULT_BULK_MAX_ACTIONS, maxBytes=DEFAULT_BULK_MAX_BYTES,
+                 maxDelaySeconds=DEFAULT_BULK_MAX_DELAY_SECONDS, refresh=DEFAULT_BULK_REFRESH):
+        self._host = host
+        self._maxActions = maxActions
+        self._maxBytes = maxBytes
+        self._maxDelaySeconds = maxDelaySeconds
+        self._refresh = refresh
+        self._actions = []
+        self._size = 0
+        self._oldest = None
+        self._failed = []
+        self._lock = threading.Lock()
+
+    def index(self, index, id, document):
+        action = (json.dumps({'index': {'_index': index, '_id': id}}) + "\n" +
+                  json.dumps(document) + "\n")
+        self._add(action)
+
+    def delete(self, index, id):
+        self._add(json.dumps({'delete': {'_index': index, '_id': id}}) + "\n")
+
+    def _add(self, action):
+        batch = None
+        with self._lock:
+            if(self._oldest is None):
+                self._oldest = time.monotonic()
+            self._actions.append(action)
+            self._size = self._size + len(action)
+            if(len(self._actions) >= self._maxActions or self._size >= self._maxBytes or
+               time.monotonic() - self._oldest >= self._maxDelaySeconds):
+                batch = self._takeActions()
+        if(batch):
+            self._send(batch)
+
+    def flush(self):
+        with self._lock:
+            batch = self._takeActions()
+        if(batch):
+            self._send(batch)
+        with self._lock:
+            failed = self._failed
+            self._failed = []
+        return failed
+
+    def _takeActions(self):
+        batch = self._actions
+        self._actions = []
+        self._size = 0
+        self._oldest = None
+        return batch
+
+    def _send(self, actions):
+        es = ElasticsearchHelper.getClient(self._host)
+        retries = 0
+        while(actions):
+            response = es.bulk(body="".join(actions), refresh=self._refresh)
+            if(not response.get('errors')):
+                print("Indexed {} documents".format(len(actions)))
+                return
+            throttled = []
+            for action, item in zip(actions, response['items']):
+                result = next(iter(item.values()))
+                if(result.get('status') == 429 and retries < MAX_BULK_RETRIES):
+                    throttled.append(action)
+                elif('error' in result):
+                    print("Failed to index document {}: {}".format(result.get('_id'), result['error']))
+                    with self._lock:
+                        self._failed.append(result)
+            actions = throttled
+            if(actions):
+                retries = retries + 1
+                time.sleep(random.uniform(0, BULK_BACKOFF_BASE_SECONDS * (2 ** retries)))
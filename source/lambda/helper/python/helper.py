@@ -14,11 +14,24 @@
 
 import boto3
 from botocore.client import Config
+from botocore.exceptions import ClientError
 import os
 import csv
 import io
+import threading
+import time
+import random
+from concurrent.futures import ThreadPoolExecutor
 from boto3.dynamodb.conditions import Key
 
+# BatchWriteItem accepts at most 25 put or delete requests
+DYNAMODB_BATCH_SIZE = 25
+
+# retries of unprocessed batch items, with exponential backoff between attempts
+MAX_BATCH_WRITE_RETRIES = 8
+BATCH_WRITE_BACKOFF_BASE_SECONDS = 0.05
+BATCH_WRITE_BACKOFF_MAX_SECONDS = 5
+
 
 class DynamoDBHelper:
 
@@ -51,47 +64,187 @@ class DynamoDBHelper:
     def deleteItems(tableName, key, value, sk):
         items = DynamoDBHelper.getItems(tableName, key, value)
         if(items):
-            ddb = AwsHelper().getResource("dynamodb")
-            table = ddb.Table(tableName)
-            for item in items:
-                print("Deleting Items")
-                table.delete_item(
-                    Key={
+            print("Deleting Items")
+            with DynamoDBBatchWriter(tableName) as writer:
+                for item in items:
+                    writer.deleteItem({
                         key: value,
                         sk: item[sk]
                     })
-                print("Deleted items")
+            print("Deleted items")
+
+
+class DynamoDBBatchWriter:
+    """
+    Buffers put and delete requests for a table and sends them with BatchWriteItem,
+    DYNAMODB_BATCH_SIZE requests at a time. Unprocessed items are retried with
+    exponential backoff. Requests can be added from several threads; call flush(),
+    or use the writer as a context manager, to send what is left in the buffer.
+    A batch must not contain two requests for the same key.
+    """
+
+    def __init__(self, tableName, awsRegion=None):
+        self._tableName = tableName
+        self._awsRegion = awsRegion
+        self._requests = []
+        self._lock = threading.Lock()
+
+    def __enter__(self):
+        return self
+
+    def __exit__(self, excType, excValue, traceback):
+        self.flush()
+
+    def putItem(self, itemData):
+        self._addRequest({'PutRequest': {'Item': itemData}})
+
+    def deleteItem(self, key):
+        self._addRequest({'DeleteRequest': {'Key': key}})
+
+    def _addRequest(self, request):
+        batch = None
+        with self._lock:
+            self._requests.append(request)
+            if(len(self._requests) >= DYNAMODB_BATCH_SIZE):
+                batch = self._requests
+                self._requests = []
+        if(batch):
+            self._writeBatch(batch)
+
+    def flush(self):
+        with self._lock:
+            requests = self._requests
+            self._requests = []
+        for i in range(0, len(requests), DYNAMODB_BATCH_SIZE):
+            self._writeBatch(requests[i:i + DYNAMODB_BATCH_SIZE])
+
+    def _writeBatch(self, batch):
+        ddb = AwsHelper().getResource("dynamodb", self._awsRegion)
+        requestItems = {self._tableName: batch}
+        retries = 0
+        while(requestItems):
+            response = ddb.batch_write_item(RequestItems=requestItems)
+            requestItems = response.get('UnprocessedItems')
+            if(requestItems):
+                retries = retries + 1
+                if(retries > MAX_BATCH_WRITE_RETRIES):
+                    raise RuntimeError("Failed to write {} items to {} after {} retries".format(
+                        len(requestItems.get(self._tableName, [])), self._tableName, MAX_BATCH_WRITE_RETRIES))
+                delay = min(BATCH_WRITE_BACKOFF_MAX_SECONDS, BATCH_WRITE_BACKOFF_BASE_SECONDS * (2 ** retries))
+                time.sleep(random.uniform(delay / 2, delay))
+
+
+# HTTP connections kept open per client, sized for the concurrent output and Comprehend workers
+MAX_POOL_CONNECTIONS = 50
+
+# default botocore config options, requests can override them with their own config
+DEFAULT_CLIENT_CONFIG = {
+    'retries': {
+        'max_attempts': 30
+    },
+    'max_pool_connections': MAX_POOL_CONNECTIONS
+}
+
+class TokenBucket:
+    """
+    Rate limiter shared by threads calling the same API. Tokens are added at `rate`
+    per second up to `capacity`, and acquire() blocks until enough are available, so
+    callers never send more than the configured sustained rate plus a short burst.
+    """
+
+    def __init__(self, rate, capacity=None):
+        self._rate = float(rate)
+        self._capacity = float(capacity if capacity else rate)
+        self._tokens = self._capacity
+        self._updated = time.monotonic()
+        self._lock = threading.Lock()
+
+    @property
+    def rate(self):
+        return self._rate
+
+    def acquire(self, tokens=1):
+        while(True):
+            with self._lock:
+                now = time.monotonic()
+                self._tokens = min(self._capacity, self._tokens + (now - self._updated) * self._rate)
+                self._updated = now
+                if(self._tokens >= tokens):
+                    self._tokens = self._tokens - tokens
+                    return
+                wait = (tokens - self._tokens) / self._rate
+            time.sleep(wait)
+
+
+# creating clients and resources from the shared default session is not thread-safe
+_sessionLock = threading.Lock()
+
+# clients and resources are shared by the whole process, so the worker threads of the output
+# and Comprehend pools reuse them too. Resources are only used to create sub-resources, e.g.
+# Table or Object, whose actions go through the thread-safe client of the resource. Both live
+# at module level so warm Lambda invocations reuse them along with their open connections.
+_clients = {}
+_resources = {}
+# hits are counted without the lock, so the count is approximate under concurrency
+_poolStats = {'hits': 0, 'misses': 0}
 
 
 class AwsHelper:
-    def getClient(self, name, awsRegion=None):
-        config = Config(
-            retries=dict(
-                max_attempts=30
-            )
-        )
-        if(awsRegion):
-            return boto3.client(name, region_name=awsRegion, config=config)
-        else:
-            return boto3.client(name, config=config)
+    # config is a dict of botocore Config options merged over DEFAULT_CLIENT_CONFIG,
+    # clients and resources are pooled by (service, region, config)
+    def getClient(self, name, awsRegion=None, config=None):
+        return AwsHelper._getPooled(_clients, boto3.client, name, awsRegion, config)
 
-    def getResource(self, name, awsRegion=None):
-        config = Config(
-            retries=dict(
-                max_attempts=30
-            )
-        )
+    def getResource(self, name, awsRegion=None, config=None):
+        return AwsHelper._getPooled(_resources, boto3.resource, name, awsRegion, config)
 
-        if(awsRegion):
-            return boto3.resource(name, region_name=awsRegion, config=config)
-        else:
-            return boto3.resource(name, config=config)
+    @staticmethod
+    def getPoolStats():
+        stats = dict(_poolStats)
+        stats['clients'] = len(_clients)
+        stats['resources'] = len(_resources)
+        return stats
 
+    @staticmethod
+    def clearPool():
+        with _sessionLock:
+            _clients.clear()
+            _resources.clear()
+            _poolStats['hits'] = 0
+            _poolStats['misses'] = 0
+
+    @staticmethod
+    def _getPooled(pool, factory, name, awsRegion, config):
+        key, options = AwsHelper._poolKey(name, awsRegion, config)
+        pooled = pool.get(key)
+        if(pooled is None):
+            with _sessionLock:
+                pooled = pool.get(key)
+                if(pooled is None):
+                    pooled = factory(name, region_name=awsRegion, config=Config(**options))
+                    pool[key] = pooled
+                    _poolStats['misses'] = _poolStats['misses'] + 1
+                    return pooled
+        _poolStats['hits'] = _poolStats['hits'] + 1
+        return pooled
+
+    @staticmethod
+    def _poolKey(name, awsRegion, config):
+        options = dict(DEFAULT_CLIENT_CONFIG)
+        if(config):
+            options.update(config)
+        return (name, awsRegion, repr(sorted(options.items()))), options
+
+
+# objects up to this size are copied with a single CopyObject, larger ones with a
+# multipart copy of parts of this size (CopyObject is limited to 5 GB)
+COPY_PART_SIZE = 256 * 1024 * 1024
+COPY_CONCURRENCY = 8
 
 class S3Helper:
     @staticmethod
     def getS3BucketRegion(bucketName):
-        client = boto3.client('s3')
+        client = AwsHelper().getClient('s3')
         response = client.get_bucket_location(Bucket=bucketName)
         awsRegion = response['LocationConstraint']
         return awsRegion
@@ -144,6 +297,70 @@ class S3Helper:
         obj = s3.Object(bucketName, s3FileName)
         return obj.get()['Body'].read().decode('utf-8')
 
+    @staticmethod
+    def downloadFromS3(bucketName, s3FileName, fileName, awsRegion=None):
+        # the object is streamed to the file rather than read into memory
+        s3client = AwsHelper().getClient('s3', awsRegion)
+        s3client.download_file(bucketName, s3FileName, fileName)
+
+    @staticmethod
+    def getObjectSize(bucketName, s3FileName, awsRegion=None):
+        s3client = AwsHelper().getClient('s3', awsRegion)
+        return s3client.head_object(Bucket=bucketName, Key=s3FileName)['ContentLength']
+
+    @staticmethod
+    def readBytesFromS3(bucketName, s3FileName, start, length, awsRegion=None):
+        """
+        Reads length bytes of an object from start with a ranged GET, a negative start
+        reads the last -start bytes. Objects shorter than the range are read whole.
+        """
+        s3client = AwsHelper().getClient('s3', awsRegion)
+        if(start < 0):
+            byteRange = "bytes={}".format(start)
+        else:
+            byteRange = "bytes={}-{}".format(start, start + length - 1)
+        try:
+            response = s3client.get_object(Bucket=bucketName, Key=s3FileName, Range=byteRange)
+        except ClientError as e:
+            # the range of an empty object is not satisfiable
+            if e.response['Error']['Code'] == 'InvalidRange':
+                return b""
+            raise
+        return response['Body'].read()
+
+    @staticmethod
+    def copyObject(sourceBucketName, sourceFileName, bucketName, s3FileName, awsRegion=None, partSize=COPY_PART_SIZE):
+        """
+        Copies an object within S3 without downloading it, objects larger than partSize
+        are copied in parts concurrently. Returns the size of the object.
+        """
+        s3client = AwsHelper().getClient('s3', awsRegion)
+        source = {'Bucket': sourceBucketName, 'Key': sourceFileName}
+        size = S3Helper.getObjectSize(sourceBucketName, sourceFileName, awsRegion)
+
+        if(size <= partSize):
+            s3client.copy_object(CopySource=source, Bucket=bucketName, Key=s3FileName)
+            return size
+
+        uploadId = s3client.create_multipart_upload(Bucket=bucketName, Key=s3FileName)['UploadId']
+        def copyPart(partNumber):
+            start = (partNumber - 1) * partSize
+            end = min(start + partSize, size) - 1
+            response = s3client.upload_part_copy(Bucket=bucketName, Key=s3FileName, UploadId=uploadId,
+                                                 PartNumber=partNumber, CopySource=source,
+                                                 CopySourceRange="bytes={}-{}".format(start, end))
+            return {'PartNumber': partNumber, 'ETag': response['CopyPartResult']['ETag']}
+
+        try:
+            with ThreadPoolExecutor(max_workers=COPY_CONCURRENCY) as executor:
+                parts = list(executor.map(copyPart, range(1, (size + partSize - 1) // partSize + 1)))
+            s3client.complete_multipart_upload(Bucket=bucketName, Key=s3FileName, UploadId=uploadId,
+                                               MultipartUpload={'Parts': parts})
+        except Exception:
+            s3client.abort_multipart_upload(Bucket=bucketName, Key=s3FileName, UploadId=uploadId)
+            raise
+        return size
+
     @staticmethod
     def writeCSV(fieldNames, csvData, bucketName, s3FileName, awsRegion=None):
         csv_file = io.StringIO()
@@ -170,6 +387,75 @@ class S3Helper:
         S3Helper.writeToS3(csv_file.getvalue(), bucketName, s3FileName)
 
 
+# size of the parts of multipart uploads, S3 requires at least 5 MB for all parts but the last
+MULTIPART_PART_SIZE = 8 * 1024 * 1024
+
+
+class S3MultipartWriter:
+    """
+    File-like writer that uploads to S3 as it is written to. Content is buffered until a
+    part is full and each full part is sent with UploadPart, so only about one part is
+    held in memory. Content smaller than one part is sent with a single PutObject.
+    Use it as a context manager: the upload is completed on exit, or aborted if an
+    exception was raised.
+    """
+
+    def __init__(self, bucketName, s3FileName, awsRegion=None, partSize=MULTIPART_PART_SIZE):
+        self._bucketName = bucketName
+        self._s3FileName = s3FileName
+        self._awsRegion = awsRegion
+        self._partSize = partSize
+        self._buffer = io.BytesIO()
+        self._uploadId = None
+        self._parts = []
+
+    def __enter__(self):
+        return self
+
+    def __exit__(self, excType, excValue, traceback):
+        if(excType is None):
+            self.close()
+        else:
+            self.abort()
+
+    def write(self, content):
+        if(isinstance(content, str)):
+            content = content.encode('utf-8')
+        self._buffer.write(content)
+        if(self._buffer.tell() >= self._partSize):
+            self._uploadPart()
+
+    def _client(self):
+        return AwsHelper().getClient('s3', self._awsRegion)
+
+    def _uploadPart(self):
+        client = self._client()
+        if(self._uploadId is None):
+            response = client.create_multipart_upload(Bucket=self._bucketName, Key=self._s3FileName)
+            self._uploadId = response['UploadId']
+        partNumber = len(self._parts) + 1
+        response = client.upload_part(Bucket=self._bucketName, Key=self._s3FileName, UploadId=self._uploadId,
+                                      PartNumber=partNumber, Body=self._buffer.getvalue())
+        self._parts.append({'ETag': response['ETag'], 'PartNumber': partNumber})
+        self._buffer = io.BytesIO()
+
+    def close(self):
+        if(self._uploadId is None):
+            self._client().put_object(Bucket=self._bucketName, Key=self._s3FileName, Body=self._buffer.getvalue())
+        else:
+            if(self._buffer.tell() > 0):
+                self._uploadPart()
+            self._client().complete_multipart_upload(Bucket=self._bucketName, Key=self._s3FileName,
+                                                     UploadId=self._uploadId, MultipartUpload={'Parts': self._parts})
+        self._buffer = io.BytesIO()
+
+    def abort(self):
+        if(self._uploadId is not None):
+            self._client().abort_multipart_upload(Bucket=self._bucketName, Key=self._s3FileName, UploadId=self._uploadId)
+            self._uploadId = None
+        self._buffer = io.BytesIO()
+
+
 class FileHelper:
     @staticmethod
     def getFileNameAndExtension(filePath):
@@ -15,7 +15,7 @@ import boto3
 from botocore.exceptions import ClientError
 import json
 import os
-from helper import S3Helper
+from helper import AwsHelper, S3Helper
 
 
 # document in the bucket have prepending folder names, when spliting with '/'
@@ -137,7 +137,7 @@ class KendraHelper:
         if documentTitle != None:
             document['Title'] = documentTitle
         
-        kendraclient = client = boto3.client('kendra', region_name=os.environ['AWS_REGION'])
+        client = AwsHelper().getClient('kendra', os.environ['AWS_REGION'])
         
         response = client.batch_put_document(IndexId=kendraIndexId,
                                              RoleArn=kendraRoleArn,
@@ -156,7 +156,7 @@ class KendraHelper:
                         kendraIndexId,
                         documentId):
 
-        kendraclient = client = boto3.client('kendra', region_name=os.environ['AWS_REGION'])
+        client = AwsHelper().getClient('kendra', os.environ['AWS_REGION'])
 
         response = client.batch_delete_document(IndexId=kendraIndexId,
                                                 DocumentIdList=[documentId])
@@ -183,7 +183,7 @@ class KendraHelper:
 
         search = json.loads(requestBody)
 
-        client = client = boto3.client('kendra', region_name=os.environ['AWS_REGION'])
+        client = AwsHelper().getClient('kendra', os.environ['AWS_REGION'])
 
         if 'tag' in search and search['tag'] != None:
             response = client.query(
@@ -235,7 +235,7 @@ class KendraHelper:
 
         feedback = json.loads(requestBody)
 
-        client = client = boto3.client('kendra', region_name=os.environ['AWS_REGION'])
+        client = AwsHelper().getClient('kendra', os.environ['AWS_REGION'])
 
         relevance = 'RELEVANT'
 
@@ -0,0 +1,72 @@
+######################################################################################################################
+#  Copyright 2020 Amazon.com, Inc. or its affiliates. All Rights Reserved.                                           #
+#                                                                                                                    #
+#  Licensed under the Apache License, Version 2.0 (the License). You may not use this file except in compliance    #
+#  with the License. A copy of the License is located at                                                             #
+#                                                                                                                    #
+#      http://www.apache.org/licenses/LICENSE-2.0                                                                    #
+#                                                                                                                    #
+#  or in the 'license' file accompanying this file. This file is distributed on an 'AS IS' BASIS, WITHOUT WARRANTIES #
+#  OR CONDITIONS OF ANY KIND, express or implied. See the License for the specific language governing permissions    #
+#  and limitations under the License.                                                                                #
+#####################################################################################################################
+
+import os
+import re
+
+SYNC_ROUTING_PATH = "sync"
+ASYNC_ROUTING_PATH = "async"
+
+# documents sent to the synchronous APIs, which accept single page PDFs and images of up to 10 MB
+DEFAULT_SYNC_MAX_PDF_PAGES = 1
+DEFAULT_SYNC_MAX_PDF_BYTES = 10 * 1024 * 1024
+DEFAULT_SYNC_MAX_IMAGE_BYTES = 5 * 1024 * 1024
+
+# the page tree root is looked for in the end of PDFs that are not linearized
+PDF_TAIL_BYTES = 64 * 1024
+PDF_LINEARIZED_PAGES = re.compile(rb'<<[^>]*/Linearized[^>]*/N\s+(\d+)')
+PDF_OBJECT = re.compile(rb'\d+\s+\d+\s+obj\b(.*?)\bendobj', re.DOTALL)
+PDF_PAGES_TYPE = re.compile(rb'/Type\s*/Pages(?![A-Za-z])')
+PDF_PAGE_COUNT = re.compile(rb'/Count\s+(\d+)')
+
+
+class RoutingHelper:
+
+    @staticmethod
+    def getPdfPageCount(head, tail):
+        """
+        Reads the page count of a PDF from its first and last bytes: from the linearization
+        dictionary at the start of the file, else from the root page tree node if it is in
+        one of them. Returns None if the count was not found, e.g. when the page tree is in
+        a compressed object stream.
+        """
+        match = PDF_LINEARIZED_PAGES.search(head)
+        if(match):
+            return int(match.group(1))
+
+        counts = []
+        for data in (head, tail):
+            for body in PDF_OBJECT.findall(data):
+                # only the root node of the page tree has no parent, other nodes count part of the pages
+                if(PDF_PAGES_TYPE.search(body) and b'/Parent' not in body):
+                    count = PDF_PAGE_COUNT.search(body)
+                    if(count):
+                        counts.append(int(count.group(1)))
+        # incremental updates append new versions of the root node, the last one is current
+        return counts[-1] if counts else None
+
+    @staticmethod
+    def getRoutingPath(mimeType, objectSize, pageCount=None):
+        """
+        Sends single page PDFs and small images to the synchronous Textract APIs, and
+        everything else, including PDFs of unknown page count, to the asynchronous ones.
+        """
+        if(mimeType in ['image/png', 'image/jpeg']):
+            if(objectSize <= int(os.environ.get('SYNC_MAX_IMAGE_BYTES', DEFAULT_SYNC_MAX_IMAGE_BYTES))):
+                return SYNC_ROUTING_PATH
+        elif(mimeType in ['application/pdf']):
+            if(objectSize <= int(os.environ.get('SYNC_MAX_PDF_BYTES', DEFAULT_SYNC_MAX_PDF_BYTES))
+                    and pageCount is not None
+                    and pageCount <= int(os.environ.get('SYNC_MAX_PDF_PAGES', DEFAULT_SYNC_MAX_PDF_PAGES))):
+                return SYNC_ROUTING_PATH
+        return ASYNC_ROUTING_PATH
@@ -16,12 +16,40 @@ import json
 import os
 import boto3
 import time
+import random
+import queue
+import threading
 from helper import AwsHelper
-from og import OutputGenerator, KVPAIRS, DOCTEXT ,SERVICE_OUTPUT_PATH_S3_PREFIX,COMPREHEND_PATH_S3_PREFIX,TEXTRACT_PATH_S3_PREFIX,PUBLIC_PATH_S3_PREFIX
+from og import OutputGenerator, flushIndex, KVPAIRS, DOCTEXT, PAGELINES ,SERVICE_OUTPUT_PATH_S3_PREFIX,COMPREHEND_PATH_S3_PREFIX,TEXTRACT_PATH_S3_PREFIX,PUBLIC_PATH_S3_PREFIX
 import datastore
 from comprehendHelper import ComprehendHelper
 from kendraHelper import KendraHelper
 
+# Get API that returns the results of each Start API
+JOB_RESULTS_APIS = {
+    "StartDocumentTextDetection": "get_document_text_detection",
+    "StartDocumentAnalysis": "get_document_analysis"
+}
+
+# errors after which a Get call is retried, throttling is retried here rather than by
+# botocore so that the delay adapts across the calls of a job
+JOB_RESULTS_RETRYABLE_ERRORS = frozenset([
+    'ProvisionedThroughputExceededException',
+    'ThrottlingException',
+    'LimitExceededException',
+    'InternalServerError',
+    'EndpointConnectionError',
+    'ConnectionClosedError',
+    'ReadTimeoutError'
+])
+TEXTRACT_CLIENT_CONFIG = {'retries': {'max_attempts': 0}}
+JOB_RESULTS_RETRY_BUDGET = 20
+JOB_RESULTS_BASE_DELAY = 0.5
+JOB_RESULTS_MAX_DELAY = 20
+
+# number of result pages fetched ahead of the page being parsed
+JOB_RESULTS_PREFETCH = 4
+
 def generatePdf(documentId, bucketName, objectName, responseBucketName,outputPath):
     
     responseDocumentName = "{}{}response.json".format(outputPath,TEXTRACT_PATH_S3_PREFIX)
@@ -36,7 +64,7 @@ def generatePdf(documentId, bucketName, objectName, responseBucketName,outputPat
     data["outputBucketName"] = responseBucketName
     data["outputDocumentName"] = outputDocumentName
 
-    client = boto3.client('lambda')
+    client = AwsHelper().getClient('lambda')
 
     response = client.invoke(
     FunctionName=os.environ['PDF_LAMBDA'],
@@ -46,42 +74,93 @@ def generatePdf(documentId, bucketName, objectName, responseBucketName,outputPat
     )
     
     
-def getJobResults(api, jobId):
-
-    pages = []
-
-    client = AwsHelper().getClient('textract')
-    response = client.get_document_analysis(JobId=jobId)
-    pages.append(response)
-    print("Resultset page recieved: {}".format(len(pages)))
-    nextToken = None
-    if('NextToken' in response):
-        nextToken = response['NextToken']
-        print("Next token: {}".format(nextToken))
-
-    while(nextToken):
+def getErrorCode(e):
+    # modeled errors carry the code in their class name, unmodeled ones only in the response
+    if(hasattr(e, 'response') and 'Error' in e.response):
+        return e.response['Error'].get('Code', e.__class__.__name__)
+    return e.__class__.__name__
+
+class JobResultBackoff:
+    """
+    Exponential backoff with full jitter for the Get API calls of one job. The delay
+    doubles on every throttle and halves on every successful call, and a job gets a
+    fixed number of retries in total.
+    """
+
+    def __init__(self):
+        self.delay = JOB_RESULTS_BASE_DELAY
+        self.budget = JOB_RESULTS_RETRY_BUDGET
+
+    def succeeded(self):
+        self.delay = max(JOB_RESULTS_BASE_DELAY, self.delay / 2)
+
+    def failed(self, e):
+        code = getErrorCode(e)
+        if(code not in JOB_RESULTS_RETRYABLE_ERRORS or self.budget <= 0):
+            raise e
+        self.budget = self.budget - 1
+        wait = random.uniform(0, self.delay)
+        print("{}, retrying in {:.2f} seconds ({} retries left)".format(code, wait, self.budget))
+        time.sleep(wait)
+        self.delay = min(JOB_RESULTS_MAX_DELAY, self.delay * 2)
+
+def fetchJobResults(api, jobId, results, stop):
+    # producer: follows NextToken and puts every result page on the queue, then None once
+    # all pages are fetched, or the exception that ended the fetch
+    try:
+        client = AwsHelper().getClient('textract', config=TEXTRACT_CLIENT_CONFIG)
+        getResults = getattr(client, JOB_RESULTS_APIS.get(api, 'get_document_analysis'))
+        backoff = JobResultBackoff()
+        args = {'JobId': jobId}
+        while(not stop.is_set()):
+            try:
+                response = getResults(**args)
+            except Exception as e:
+                backoff.failed(e)
+                continue
+            backoff.succeeded()
+            putJobResult(results, response, stop)
+            if('NextToken' not in response):
+                break
+            args['NextToken'] = response['NextToken']
+        putJobResult(results, None, stop)
+    except Exception as e:
+        putJobResult(results, e, stop)
+
+def putJobResult(results, item, stop):
+    while(not stop.is_set()):
         try:
-            if(api == "StartDocumentTextDetection"):
-                response = client.get_document_text_detection(JobId=jobId, NextToken=nextToken)
-            else:
-                response = client.get_document_analysis(JobId=jobId, NextToken=nextToken)
-
-            pages.append(response)
-            print("Resultset page recieved: {}".format(len(pages)))
-            nextToken = None
-            if('NextToken' in response):
-                nextToken = response['NextToken']
-                print("Next token: {}".format(nextToken))
-
-        except Exception as e:
-            if(e.__class__.__name__ == 'ProvisionedThroughputExceededException'):
-                print("ProvisionedThroughputExceededException.")
-                print("Waiting for few seconds...")
-                time.sleep(5)
-                print("Waking up...")
-
+            results.put(item, timeout=1)
+            return
+        except queue.Full:
+            pass
 
-    return pages
+def getJobResults(api, jobId):
+    """
+    Yields the result pages of a Textract job as they are fetched. The next pages are
+    fetched in the background while the current one is parsed, up to
+    JOB_RESULTS_PREFETCH pages ahead.
+    """
+    results = queue.Queue(maxsize=JOB_RESULTS_PREFETCH)
+    stop = threading.Event()
+    producer = threading.Thread(target=fetchJobResults, args=(api, jobId, results, stop), daemon=True)
+    producer.start()
+
+    count = 0
+    try:
+        while(True):
+            item = results.get()
+            if(item is None):
+                break
+            if(isinstance(item, Exception)):
+                raise item
+            count = count + 1
+            print("Resultset page recieved: {}".format(count))
+            yield item
+    finally:
+        # the consumer may stop early, e.g. on a parsing error, the producer must not wait on a full queue
+        stop.set()
+        producer.join()
 
 def processRequest(request):
 
@@ -100,10 +179,9 @@ def processRequest(request):
     documentsTable = request["documentsTable"]
     elasticsearchDomain = request["elasticsearchDomain"]
 
+    # result pages are parsed as they are fetched
     pages = getJobResults(jobAPI, jobId)
 
-    print("Result pages recieved: {}".format(len(pages)))
-
     dynamodb = AwsHelper().getResource("dynamodb")
     ddb = dynamodb.Table(outputTable)
 
@@ -119,8 +197,11 @@ def processRequest(request):
     outputPath = '{}{}/{}'.format(PUBLIC_PATH_S3_PREFIX,documentId,SERVICE_OUTPUT_PATH_S3_PREFIX)
     print("Generating output for DocumentId: {} and storing in {}".format(documentId,outputPath))
 
-    opg = OutputGenerator(documentId, pages, outputBucketName, objectName, detectForms, detectTables, ddb,outputPath, elasticsearchDomain)
+    # large multi-page jobs are parsed page by page as the result pages are fetched, each result
+    # page is released once parsed and written to response.json
+    opg = OutputGenerator(documentId, pages, outputBucketName, objectName, detectForms, detectTables, ddb,outputPath, elasticsearchDomain, stream=True)
     opg_output = opg.run()
+    print("Result pages recieved: {}".format(opg.responseCount))
 
     generatePdf(documentId, bucketName, objectName, outputBucketName,outputPath)
 
@@ -130,7 +211,8 @@ def processRequest(request):
     maxPages = 100
     comprehendClient = ComprehendHelper()
     responseDocumentName = "{}{}response.json".format(outputPath,TEXTRACT_PATH_S3_PREFIX)
-    comprehendAndMedicalEntities = comprehendClient.processComprehend(outputBucketName, responseDocumentName, comprehendOutputPath, maxPages)
+    pageEntities = []
+    comprehendAndMedicalEntities = comprehendClient.processComprehend(outputBucketName, responseDocumentName, comprehendOutputPath, maxPages, pageLines=opg_output[PAGELINES], pageEntities=pageEntities)
 
     # if Kendra is available then let it index the document
     if 'KENDRA_INDEX_ID' in os.environ:
@@ -154,7 +236,7 @@ def processRequest(request):
             comprehendAndMedicalEntities[key] = val
         else:
             comprehendAndMedicalEntities[key].add(val)
-    opg.indexDocument(opg_output[DOCTEXT], comprehendAndMedicalEntities)
+    opg.indexDocument(opg_output[DOCTEXT], comprehendAndMedicalEntities, opg_output[PAGELINES], pageEntities)
 
     ds = datastore.DocumentStore(documentsTable, outputTable)
     ds.markDocumentComplete(documentId)
@@ -171,26 +253,44 @@ def lambda_handler(event, context):
 
     print("event: {}".format(event))
 
-    body = json.loads(event['Records'][0]['body'])
-    message = json.loads(body['Message'])
-
-    print("Message: {}".format(message))
-
-    request = {}
+    # the documents of a batch are indexed with one bulk request, failed records are
+    # reported so that only they are received again
+    batchItemFailures = []
+    try:
+        for record in event['Records']:
+            try:
+                body = json.loads(record['body'])
+                message = json.loads(body['Message'])
+
+                print("Message: {}".format(message))
+
+                request = {}
+
+                request["jobId"] = message['JobId']
+                request["jobTag"] = message['JobTag']
+                request["jobStatus"] = message['Status']
+                request["jobAPI"] = message['API']
+                request["bucketName"] = message['DocumentLocation']['S3Bucket']
+                request["objectName"] = message['DocumentLocation']['S3ObjectName']
+                request["outputBucketName"] = os.environ['OUTPUT_BUCKET']
+                request["elasticsearchDomain"] = os.environ['ES_DOMAIN']
+                request["outputTable"] = os.environ['OUTPUT_TABLE']
+                request["documentsTable"] = os.environ['DOCUMENTS_TABLE']
+
+                processRequest(request)
+            except Exception as e:
+                print("Failed to process record {}. Exception: {}".format(record['messageId'], e))
+                batchItemFailures.append({"itemIdentifier": record['messageId']})
+    finally:
+        flushIndex(os.environ['ES_DOMAIN'])
 
-    request["jobId"] = message['JobId']
-    request["jobTag"] = message['JobTag']
-    request["jobStatus"] = message['Status']
-    request["jobAPI"] = message['API']
-    request["bucketName"] = message['DocumentLocation']['S3Bucket']
-    request["objectName"] = message['DocumentLocation']['S3ObjectName']
-    request["outputBucketName"] = os.environ['OUTPUT_BUCKET']
-    request["elasticsearchDomain"] = os.environ['ES_DOMAIN']
-    request["outputTable"] = os.environ['OUTPUT_TABLE']
-    request["documentsTable"] = os.environ['DOCUMENTS_TABLE']
-
-    return processRequest(request)
+    return {
+        "batchItemFailures": batchItemFailures
+    }
 
 def lambda_handler_local(event, context):
     print("Event: {}".format(event))
-    return processRequest(event)
+    try:
+        return processRequest(event)
+    finally:
+        flushIndex(event["elasticsearchDomain"])
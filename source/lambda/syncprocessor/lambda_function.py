@@ -17,7 +17,7 @@ from decimal import Decimal
 import json
 import os
 from helper import AwsHelper, S3Helper, DynamoDBHelper
-from og import OutputGenerator, KVPAIRS, DOCTEXT ,SERVICE_OUTPUT_PATH_S3_PREFIX,COMPREHEND_PATH_S3_PREFIX,TEXTRACT_PATH_S3_PREFIX,PUBLIC_PATH_S3_PREFIX
+from og import OutputGenerator, flushIndex, KVPAIRS, DOCTEXT, PAGELINES ,SERVICE_OUTPUT_PATH_S3_PREFIX,COMPREHEND_PATH_S3_PREFIX,TEXTRACT_PATH_S3_PREFIX,PUBLIC_PATH_S3_PREFIX
 import datastore
 from comprehendHelper import ComprehendHelper
 from kendraHelper import KendraHelper
@@ -36,7 +36,7 @@ def generatePdf(documentId, bucketName, objectName, responseBucketName, outputPa
     data["outputBucketName"] = responseBucketName
     data["outputDocumentName"] = outputDocumentName
 
-    client = boto3.client('lambda')
+    client = AwsHelper().getClient('lambda')
 
     response = client.invoke(
         FunctionName=os.environ['PDF_LAMBDA'],
@@ -106,7 +106,8 @@ def processImage(documentId, features, bucketName, outputBucketName, objectName,
     maxPages = 100
     comprehendClient = ComprehendHelper()
     responseDocumentName = "{}{}response.json".format(outputPath,TEXTRACT_PATH_S3_PREFIX)
-    comprehendAndMedicalEntities = comprehendClient.processComprehend(outputBucketName, responseDocumentName, comprehendOutputPath, maxPages)
+    pageEntities = []
+    comprehendAndMedicalEntities = comprehendClient.processComprehend(outputBucketName, responseDocumentName, comprehendOutputPath, maxPages, pageLines=opg_output[PAGELINES], pageEntities=pageEntities)
 
     # if Kendra is available then let it index the document
     # index the searchable pdf in Kendra
@@ -129,7 +130,7 @@ def processImage(documentId, features, bucketName, outputBucketName, objectName,
             comprehendAndMedicalEntities[key] = val
         else:
             comprehendAndMedicalEntities[key].add(val)
-    opg.indexDocument(opg_output[DOCTEXT], comprehendAndMedicalEntities)
+    opg.indexDocument(opg_output[DOCTEXT], comprehendAndMedicalEntities, opg_output[PAGELINES], pageEntities)
 
     ds = datastore.DocumentStore(documentsTableName, outputTableName)
     ds.markDocumentComplete(documentId)
@@ -157,6 +158,15 @@ def processRequest(request):
         print("DocumentId: {}, features: {}, Object: {}/{}".format(documentId,
                                                                    features, bucketName, objectName))
 
+        # the document processor can send a document again if it was retried after sending
+        document = datastore.DocumentStore(documentsTable, outputTable).getDocument(documentId)
+        if(document and document["documentStatus"] == "SUCCEEDED"):
+            print("Document {} is already processed, skipping".format(documentId))
+            return {
+                'statusCode': 200,
+                'body': "Document: {} already processed.".format(documentId)
+            }
+
         processImage(documentId, features, bucketName, outputBucketName,
                      objectName, outputTable, documentsTable, elasticsearchDomain)
 
@@ -172,16 +182,32 @@ def processRequest(request):
 def lambda_handler(event, context):
 
     print("Event: {}".format(event))
-    message = json.loads(event['Records'][0]['body'])
-    print("Message: {}".format(message))
-
-    request = {}
-    request["documentId"] = message['documentId']
-    request["bucketName"] = message['bucketName']
-    request["objectName"] = message['objectName']
-    request["features"] = message['features']
-    request["outputBucketName"] = os.environ['OUTPUT_BUCKET']
-    request["outputTable"] = os.environ['OUTPUT_TABLE']
-    request["documentsTable"] = os.environ['DOCUMENTS_TABLE']
-    request["elasticsearchDomain"] = os.environ['ES_DOMAIN']
-    return processRequest(request)
+
+    # the documents of a batch are indexed with one bulk request, failed records are
+    # reported so that only they are received again
+    batchItemFailures = []
+    try:
+        for record in event['Records']:
+            try:
+                message = json.loads(record['body'])
+                print("Message: {}".format(message))
+
+                request = {}
+                request["documentId"] = message['documentId']
+                request["bucketName"] = message['bucketName']
+                request["objectName"] = message['objectName']
+                request["features"] = message['features']
+                request["outputBucketName"] = os.environ['OUTPUT_BUCKET']
+                request["outputTable"] = os.environ['OUTPUT_TABLE']
+                request["documentsTable"] = os.environ['DOCUMENTS_TABLE']
+                request["elasticsearchDomain"] = os.environ['ES_DOMAIN']
+                processRequest(request)
+            except Exception as e:
+                print("Failed to process record {}. Exception: {}".format(record['messageId'], e))
+                batchItemFailures.append({"itemIdentifier": record['messageId']})
+    finally:
+        flushIndex(os.environ['ES_DOMAIN'])
+
+    return {
+        "batchItemFailures": batchItemFailures
+    }
@@ -13,21 +13,77 @@
  #####################################################################################################################
 
 import json
-from helper import FileHelper, S3Helper
+import csv
+import io
+from helper import FileHelper, S3Helper, S3MultipartWriter, DynamoDBBatchWriter
 from trp import *
-from elasticsearch import Elasticsearch, RequestsHttpConnection, client
-from requests_aws4auth import AWS4Auth
-import boto3
+from elasticsearchHelper import ElasticsearchHelper
 import datetime
+import calendar
+import functools
+import re
+import itertools
+import collections
+import os
+from concurrent.futures import ThreadPoolExecutor
 
 UNSUPPORTED_DATE_FORMAT = "UNSUPPORTED_DATE_FORMAT"
 DOCTEXT = "docText"
 KVPAIRS = "KVPairs"
+PAGELINES = "pageLines"
 PUBLIC_PATH_S3_PREFIX= "public/"
 SERVICE_OUTPUT_PATH_S3_PREFIX = "output/"
 TEXTRACT_PATH_S3_PREFIX = "textract/"
 COMPREHEND_PATH_S3_PREFIX = "comprehend/"
 
+# Elasticsearch index of the documents and the settings it is created with
+ES_INDEX = "textract"
+ES_INDEX_BODY = {
+    "settings": {
+        "index": {
+            "number_of_shards": 2
+        }
+    },
+    "mappings": {
+        "properties": {
+            "date": {
+                "type": "date",
+                "format": "M'/'dd'/'yyyy||date||year||year_month||dd MMM yyyy||dd'/'MM'/'yyyy||yyyy'/'MM'/'dd||dd'/'MM'/'YY||year_month_day||MM'/'dd'/'yy||dd MMM||MM'/'yyyy||M-dd-yyyy||MM'/'dd'/'yyyy||M||d'/'MM'/'yyyy||MM'/'dd'/'yy"
+            }
+        }
+    }
+}
+
+# per page documents, indexed alongside the documents of ES_INDEX when the ES_INDEX_PAGES
+# environment variable is "true". The api processor has to be given the same setting, its
+# search then runs against the pages and documents indexed in the other mode are not found.
+ES_PAGES_INDEX = "textract-pages"
+ES_PAGES_INDEX_BODY = {
+    "settings": ES_INDEX_BODY["settings"],
+    "mappings": {
+        "properties": {
+            "documentId": {
+                "type": "keyword"
+            },
+            "page": {
+                "type": "integer"
+            },
+            "date": ES_INDEX_BODY["mappings"]["properties"]["date"]
+        }
+    }
+}
+DEFAULT_ES_INDEX_PAGES = "false"
+
+# number of pages whose forms and tables are rendered and uploaded at the same time,
+# can be overridden with the OUTPUT_CONCURRENCY environment variable
+DEFAULT_OUTPUT_CONCURRENCY = 8
+
+# "true" to also write the response in the binary layout of trp.writeBinaryDocument, which
+# the api processor uses to serve single pages. The whole response is then kept in memory
+# until it is written, can be overridden with the TEXTRACT_BINARY_OUTPUT environment variable
+DEFAULT_BINARY_OUTPUT = "false"
+BINARY_RESPONSE_OUTPUT_TYPE = "{}ResponseBinary".format(TEXTRACT_PATH_S3_PREFIX)
+
 
 def round_floats(o):
     if isinstance(o, float):
@@ -52,19 +108,139 @@ def prune_blocks(o):
 
     return o
 
+#
+# writes the Textract response as compact json, without the block polygons and with floats
+# rounded to 4 digits, i.e. json.dumps(round_floats(prune_blocks(o)), separators=(',', ':')).
+# Blocks are serialized one at a time as they are written, the response is not modified.
+#
+def write_pruned_page(page, writer):
+    writer.write("{")
+    for j, (key, value) in enumerate(page.items()):
+        if(j > 0):
+            writer.write(",")
+        writer.write(json.dumps(key))
+        writer.write(":")
+        if(key == 'Blocks'):
+            writer.write("[")
+            for k, block in enumerate(value):
+                if(k > 0):
+                    writer.write(",")
+                if 'Geometry' in block:
+                    block = dict(block)
+                    block['Geometry'] = {name: geometry for name, geometry in block['Geometry'].items() if name != 'Polygon'}
+                writer.write(json.dumps(round_floats(block), separators=(',', ':')))
+            writer.write("]")
+        else:
+            writer.write(json.dumps(round_floats(value), separators=(',', ':')))
+    writer.write("}")
+
+def write_pruned_response(o, writer):
+    if(not isinstance(o, list)):
+        o = [o]
+
+    writer.write("[")
+    for i, page in enumerate(o):
+        if(i > 0):
+            writer.write(",")
+        write_pruned_page(page, writer)
+    writer.write("]")
+
 # This function will convert all the dates to a given format so as to enable search in an easy way for the users
+# dates are classified by shape with one regular expression, each named group being one of the
+# formats format_date used to try in turn with strptime. Shapes matching several formats list
+# them in the order they were tried in.
+DATE_FORMATS = re.compile(r"""
+    (?P<slashYear>(?P<slashYearMonth>\d{1,2})/(?P<slashYearDay>\d{1,2})/(?P<slashYearYear>\d{4}))          # %m/%d/%Y
+    |(?P<dash>(?P<dashFirst>\d{1,2})-(?P<dashSecond>\d{1,2})-(?P<dashYear>\d{4}))                        # %m-%d-%Y, %d-%m-%Y
+    |(?P<monthYear>(?P<monthYearMonth>[^\W\d_]+)\s+(?P<monthYearYear>\d{4}))                             # %B %Y, %b %Y
+    |(?P<slashShortYear>(?P<slashShortMonth>\d{1,2})/(?P<slashShortDay>\d{1,2})/(?P<slashShortYearYear>\d{2}))  # %m/%d/%y
+    |(?P<monthCommaYear>(?P<monthCommaMonth>[^\W\d_]+),\s+(?P<monthCommaYearYear>\d{4}))                # %B, %Y
+    |(?P<year>(?P<yearYear>\d{4})\.?)                                                                      # %Y, %Y.
+    |(?P<monthDayYear>(?P<monthDayMonth>[^\W\d_]+)\s+(?P<monthDayDay>\d{1,2}),\s+(?P<monthDayYearYear>\d{4}))  # %B %d, %Y, %b %d, %Y
+""", re.VERBOSE)
+
+MONTH_NAMES = {name.lower(): number for number, name in enumerate(calendar.month_name) if name}
+MONTH_ABBREVIATIONS = {name.lower(): number for number, name in enumerate(calendar.month_abbr) if name}
+
+
+def _date(year, month, day=1):
+    year = int(year)
+    month = int(month)
+    day = int(day)
+    if(datetime.MINYEAR <= year and 1 <= month <= 12 and 1 <= day <= calendar.monthrange(year, month)[1]):
+        return datetime.datetime(year, month, day)
+    return None
+
+
+def _monthDate(name, year, day=1, abbreviations=True):
+    name = name.lower()
+    month = MONTH_NAMES.get(name)
+    if(month is None and abbreviations):
+        month = MONTH_ABBREVIATIONS.get(name)
+    if(month is None):
+        return None
+    return _date(year, month, day)
+
+
+def _shortYear(year):
+    # same pivot as strptime, 69-99 are in the 1900s and 00-68 in the 2000s
+    year = int(year)
+    return year + 1900 if year >= 69 else year + 2000
+
+
+@functools.lru_cache(maxsize=4096)
 def format_date(date):
-    date_patterns = ["%m/%d/%Y", "%m-%d-%Y", "%B %Y", "%b %Y", "%m/%d/%y", "%B, %Y", "%Y", "%d-%m-%Y", "%B %d, %Y", "%b %d, %Y", "%Y."]
-    for pattern in date_patterns:
+    match = DATE_FORMATS.fullmatch(date)
+    parsed = None
+    if(match):
+        # the outer group of the matched format closes last
+        group = match.lastgroup
+        if(group == "slashYear"):
+            parsed = _date(match.group("slashYearYear"), match.group("slashYearMonth"), match.group("slashYearDay"))
+        elif(group == "dash"):
+            parsed = _date(match.group("dashYear"), match.group("dashFirst"), match.group("dashSecond"))
+            if(parsed is None):
+                parsed = _date(match.group("dashYear"), match.group("dashSecond"), match.group("dashFirst"))
+        elif(group == "monthYear"):
+            parsed = _monthDate(match.group("monthYearMonth"), match.group("monthYearYear"))
+        elif(group == "slashShortYear"):
+            parsed = _date(_shortYear(match.group("slashShortYearYear")), match.group("slashShortMonth"), match.group("slashShortDay"))
+        elif(group == "monthCommaYear"):
+            parsed = _monthDate(match.group("monthCommaMonth"), match.group("monthCommaYearYear"), abbreviations=False)
+        elif(group == "year"):
+            parsed = _date(match.group("yearYear"), 1)
+        elif(group == "monthDayYear"):
+            parsed = _monthDate(match.group("monthDayMonth"), match.group("monthDayYearYear"), match.group("monthDayDay"))
+    if(parsed is None):
+        return UNSUPPORTED_DATE_FORMAT
+    return parsed
+
+
+#
+# converts a list of dates, as found by Comprehend, to "%Y-%m-%d" strings. Dates that do not
+# match any of the supported formats are left out.
+#
+def normalizeDates(dates):
+    normalized = []
+    for date in dates:
+        date_object = format_date(date)
+        if(date_object != UNSUPPORTED_DATE_FORMAT):
+            normalized.append(date_object.strftime("%Y-%m-%d"))
+    return normalized
+
+def flushIndex(elasticsearchDomain):
+    # documents indexed by OutputGenerator.indexDocument are buffered across documents,
+    # handlers flush once before returning
+    if(elasticsearchDomain):
         try:
-            return datetime.datetime.strptime(date,pattern)
-        except:
-            pass
-    print("Date format not matched {}".format(date))
-    return UNSUPPORTED_DATE_FORMAT
+            failed = ElasticsearchHelper.getBulkIndexer(elasticsearchDomain).flush()
+            if(failed):
+                print("{} documents could not be indexed".format(len(failed)))
+        except Exception as E:
+            print("Failed to index documents {}".format(E))
 
 class OutputGenerator:
-    def __init__(self, documentId, response, bucketName, objectName, forms, tables, ddb,outputPath, elasticsearchDomain=None):
+    def __init__(self, documentId, response, bucketName, objectName, forms, tables, ddb,outputPath, elasticsearchDomain=None, stream=False, concurrency=None, binaryOutput=None):
         self.documentId = documentId
         self.response = response
         self.bucketName = bucketName
@@ -76,7 +252,46 @@ class OutputGenerator:
 
         self.outputPath = outputPath
 
-        self.document = Document(self.response)
+        # in stream mode pages are parsed one at a time while the output is generated
+        # instead of building the whole document up front
+        self.stream = stream
+        self.document = None
+        self._responsePages = response
+        self.responseCount = len(response) if isinstance(response, list) else 1
+        if(self.stream and not isinstance(response, (list, dict))):
+            # responses from a generator, e.g. result pages still being fetched, are parsed and
+            # written to response.json as they arrive, then released. Only the binary output
+            # keeps them until the end of run.
+            self.response = []
+            self.responseCount = 0
+        if(not self.stream):
+            self.document = Document(self.response)
+
+        if(concurrency is None):
+            concurrency = int(os.environ.get('OUTPUT_CONCURRENCY', DEFAULT_OUTPUT_CONCURRENCY))
+        self.concurrency = max(1, concurrency)
+        if(binaryOutput is None):
+            binaryOutput = os.environ.get('TEXTRACT_BINARY_OUTPUT', DEFAULT_BINARY_OUTPUT).lower() == "true"
+        self.binaryOutput = binaryOutput
+        # output records are buffered and written in batches, see flushItems
+        self._outputWriter = DynamoDBBatchWriter(self.ddb.name)
+
+    def _writeResponses(self, writer):
+        responsePages = self._responsePages
+        if(isinstance(responsePages, dict)):
+            responsePages = [responsePages]
+        keep = self.binaryOutput and not isinstance(self._responsePages, (list, dict))
+
+        writer.write("[")
+        for i, response in enumerate(responsePages):
+            if(i > 0):
+                writer.write(",")
+            write_pruned_page(response, writer)
+            if(keep):
+                self.response.append(response)
+            self.responseCount = i + 1
+            yield response
+        writer.write("]")
 
     def saveItem(self, pk, sk, output):
 
@@ -85,7 +300,10 @@ class OutputGenerator:
         jsonItem['outputType'] = sk
         jsonItem['outputPath'] = output
 
-        ddbResponse = self.ddb.put_item(Item=jsonItem)
+        self._outputWriter.putItem(jsonItem)
+
+    def flushItems(self):
+        self._outputWriter.flush()
 
     def _outputText(self, page, p):
         text = page.text
@@ -126,124 +344,155 @@ class OutputGenerator:
 
     def _outputTable(self, page, p):
 
-        csvData = []
+        csv_file = io.StringIO()
+        writer = csv.writer(csv_file)
         for table in page.tables:
-            csvRow = []
-            csvRow.append("Table")
-            csvData.append(csvRow)
-            for row in table.rows:
-                csvRow = []
-                for cell in row.cells:
-                    csvRow.append(cell.text)
-                csvData.append(csvRow)
-            csvData.append([])
-            csvData.append([])
+            writer.writerow(["Table"])
+            table.writeCSV(writer)
+            writer.writerow([])
+            writer.writerow([])
 
         opath = "{}{}page-{}-tables.csv".format(self.outputPath,TEXTRACT_PATH_S3_PREFIX, p)
-        S3Helper.writeCSVRaw(csvData, self.bucketName, opath)
+        S3Helper.writeToS3(csv_file.getvalue(), self.bucketName, opath)
         self.saveItem(self.documentId, "{}page-{}-Tables".format(TEXTRACT_PATH_S3_PREFIX, p), opath)
 
-    def indexDocument(self, text, entitiesToIndex):
+    def _outputPage(self, page, p):
+        key_val_pairs = {}
+        if(self.forms):
+            key_val_pairs = self._outputForm(page, p)
+
+        if(self.tables):
+            self._outputTable(page, p)
+
+        return key_val_pairs
+
+    def _addEntities(self, document, entitiesToIndex):
+        for key, val in entitiesToIndex.items():
+            key = key.lower()
+            if(key == "date"):
+                dates = normalizeDates(val)
+                if(dates):
+                    document[key] = dates
+            else:
+                document[key] = val
+
+    #
+    # indexes the document in ES_INDEX. When page indexing is enabled, the text of every page
+    # is indexed as its own document in ES_PAGES_INDEX instead, with the entities of the page,
+    # and the parent document only keeps the entities of the whole document.
+    #
+    #   pageLines:      line texts of each page, i.e. the PAGELINES output of run()
+    #   pageEntities:   entities of each page, as filled by ComprehendHelper.processComprehend
+    #
+    def indexDocument(self, text, entitiesToIndex, pageLines=None, pageEntities=None):
         
         if(self.elasticsearchDomain):
 
             host = self.elasticsearchDomain
 
             if(text):
-                service = 'es'
-                ss = boto3.Session()
-                credentials = ss.get_credentials()
-                region = ss.region_name
-
-                awsauth = AWS4Auth(credentials.access_key, credentials.secret_key,
-                                region, service, session_token=credentials.token)
-
-                es = Elasticsearch(
-                    hosts=[{'host': host, 'port': 443}],
-                    http_auth=awsauth,
-                    use_ssl=True,
-                    verify_certs=True,
-                    connection_class=RequestsHttpConnection
-                )
-
-                es_index_client = client.IndicesClient(es)
+                indexPages = pageLines is not None and os.environ.get('ES_INDEX_PAGES', DEFAULT_ES_INDEX_PAGES).lower() == "true"
 
                 document = {
                     "documentId": "{}".format(self.documentId),
                     "name": "{}".format(self.objectName),
-                    "bucket": "{}".format(self.bucketName),
-                    "content": text
+                    "bucket": "{}".format(self.bucketName)
                 }
+                # with page indexing the text is only held by the page documents, which are
+                # the ones searched and highlighted
+                if(not indexPages):
+                    document["content"] = text
 
                 # add comprehend entities while indexing the document
                 if entitiesToIndex:
-                    for key, val in entitiesToIndex.items():
-                        key = key.lower()
-                        if(key == "date"):
-                            for date in val:
-                                date_object = format_date(date)
-                                if(date_object!= UNSUPPORTED_DATE_FORMAT):
-                                    if(key not in document):
-                                        document[key] = []
-                                    document[key].append(date_object.strftime("%Y-%m-%d"))
-                            print("Document with Converted dates: {}".format(document))
-                        else:
-                            document[key] = val
-                    
+                    self._addEntities(document, entitiesToIndex)
+                    print("Document with {} converted dates".format(len(document.get("date", []))))
+
                 try:
-                    if not es_index_client.exists(index='textract'):
-                        print("Index 'textract' does not exist, creating...")
-                        es_index_client.create(
-                            index="textract",
-                            body={
-                                "settings": {
-                                    "index": {
-                                        "number_of_shards": 2
-                                    }
-                                },
-                                "mappings":{
-                                    "properties":{
-                                    "date":{
-                                        "type": "date",
-                                        "format": "M'/'dd'/'yyyy||date||year||year_month||dd MMM yyyy||dd'/'MM'/'yyyy||yyyy'/'MM'/'dd||dd'/'MM'/'YY||year_month_day||MM'/'dd'/'yy||dd MMM||MM'/'yyyy||M-dd-yyyy||MM'/'dd'/'yyyy||M||d'/'MM'/'yyyy||MM'/'dd'/'yy"
-                                    }
-                                }
+                    ElasticsearchHelper.ensureIndex(host, ES_INDEX, ES_INDEX_BODY)
+
+                    # sent with the next bulk request, at the latest on flushIndex()
+                    indexer = ElasticsearchHelper.getBulkIndexer(host)
+                    indexer.index(ES_INDEX, self.documentId, document)
+
+                    if(indexPages):
+                        ElasticsearchHelper.ensureIndex(host, ES_PAGES_INDEX, ES_PAGES_INDEX_BODY)
+                        for p, lines in enumerate(pageLines):
+                            pageDocument = {
+                                "documentId": document["documentId"],
+                                "name": document["name"],
+                                "bucket": document["bucket"],
+                                "page": p + 1,
+                                "content": "\n".join(lines)
                             }
-                        }
-                    )
+                            if(pageEntities and p < len(pageEntities)):
+                                self._addEntities(pageDocument, pageEntities[p])
+                            indexer.index(ES_PAGES_INDEX, "{}-{}".format(self.documentId, p + 1), pageDocument)
 
-                    es.index(index="textract", id=self.documentId, body=document)
-
-                    print("Indexed document: {}".format(self.objectName))
+                    print("Queued document for indexing: {}".format(self.objectName))
                 except Exception as E:
                     print("Failed to create index with desired mapping {}".format(E))
         else:
             print("Document not indexed {}".format(self.elasticsearchDomain))
 
-    def run(self):
+    def flushIndex(self):
+        flushIndex(self.elasticsearchDomain)
 
-        if(not self.document.pages):
-            return
+    def run(self):
 
         opath = "{}{}response.json".format(self.outputPath,TEXTRACT_PATH_S3_PREFIX)
-        S3Helper.writeToS3(json.dumps(round_floats(prune_blocks(
-            self.response)), separators=(',', ':')), self.bucketName, opath)
+        if(self.stream):
+            # in stream mode the response is written to response.json while it is parsed,
+            # so that only the page being parsed is held in memory
+            with S3MultipartWriter(self.bucketName, opath) as writer:
+                source = PageStream(self._writeResponses(writer))
+                output = self._outputPages(source)
+        else:
+            source = self.document
+            output = self._outputPages(source)
+            if(output is None):
+                return
+            # the response is serialized block by block straight into the upload
+            with S3MultipartWriter(self.bucketName, opath) as writer:
+                write_pruned_response(self.response, writer)
+        if(output is None):
+            return
+        key_val_pairs, page_lines = output
         self.saveItem(self.documentId, '{}Response'.format(TEXTRACT_PATH_S3_PREFIX), opath)
 
-        print("Total Pages in Document: {}".format(len(self.document.pages)))
-
-        docText = ""
-
+        if(self.binaryOutput):
+            # compact copy of the response that trp.BinaryDocument loads page by page
+            opath = "{}{}response.bin".format(self.outputPath,TEXTRACT_PATH_S3_PREFIX)
+            with S3MultipartWriter(self.bucketName, opath) as writer:
+                writeBinaryDocument(self.response, writer)
+            self.saveItem(self.documentId, BINARY_RESPONSE_OUTPUT_TYPE, opath)
+        self.flushItems()
+
+        return {DOCTEXT: source.text, KVPAIRS: key_val_pairs, PAGELINES: page_lines}
+
+    def _outputPages(self, source):
+        pages = iter(source.pages)
+        firstPage = next(pages, None)
+        if(firstPage is None):
+            return None
+
+        # pages are submitted in order and collected first in first out, so the key
+        # value pairs of later pages win no matter which upload finishes first. The
+        # number of pages in flight is bounded to keep streamed pages from piling up.
+        key_val_pairs = {}
+        page_lines = []
+        inFlight = collections.deque()
         p = 1
-        for page in self.document.pages:
-            docText = docText + page.text + "\n"
-
-            if(self.forms):
-                key_val_pairs = self._outputForm(page, p)
-
-            if(self.tables):
-                self._outputTable(page, p)
-
-            p = p + 1
-        
-        return {DOCTEXT: docText, KVPAIRS: key_val_pairs}
+        with ThreadPoolExecutor(max_workers=self.concurrency) as executor:
+            for page in itertools.chain([firstPage], pages):
+                if(len(inFlight) >= 2 * self.concurrency):
+                    key_val_pairs.update(inFlight.popleft().result())
+                # line texts are kept so Comprehend does not have to read the response back from S3
+                page_lines.append([line.text for line in page.lines])
+                inFlight.append(executor.submit(self._outputPage, page, p))
+                p = p + 1
+            while(inFlight):
+                key_val_pairs.update(inFlight.popleft().result())
+
+        print("Total Pages in Document: {}".format(p - 1))
+        return key_val_pairs, page_lines
@@ -13,78 +13,242 @@
  #####################################################################################################################
 
 import json
+import bisect
+import itertools
+import mmap
+import struct
+import sys
+from array import array
+
+# number of blocks read past the start of the next page before a streamed page is
+# built, so that children emitted slightly out of order can still be resolved
+DEFAULT_LOOKAHEAD_BLOCKS = 1000
+
+# length of the form key fragments indexed for substring search
+KEY_NGRAM_SIZE = 3
+
+# binary layout written by writeBinaryDocument: magic, version, reserved, then the number of
+# blocks, strings, pages, polygon points, relationships and relationship ids, and the index
+# of the response metadata in the string table
+BINARY_MAGIC = b"TRPB"
+BINARY_VERSION = 1
+BINARY_HEADER = struct.Struct("<4sHHIIIIIII")
 
 class BoundingBox:
+    __slots__ = ('_values', '_offset')
+
     def __init__(self, width, height, left, top):
-        self._width = width
-        self._height = height
-        self._left = left
-        self._top = top
+        self._values = (width, height, left, top)
+        self._offset = 0
+
+    @classmethod
+    def _view(cls, values, offset):
+        bb = cls.__new__(cls)
+        bb._values = values
+        bb._offset = offset
+        return bb
 
     def __str__(self):
-        return "width: {}, height: {}, left: {}, top: {}".format(self._width, self._height, self._left, self._top)
+        return "width: {}, height: {}, left: {}, top: {}".format(self.width, self.height, self.left, self.top)
 
     @property
     def width(self):
-        return self._width
+        return self._values[self._offset]
 
     @property
     def height(self):
-        return self._height
+        return self._values[self._offset + 1]
 
     @property
     def left(self):
-        return self._left
+        return self._values[self._offset + 2]
 
     @property
     def top(self):
-        return self._top
+        return self._values[self._offset + 3]
 
 class Polygon:
+    __slots__ = ('_values', '_offset')
+
     def __init__(self, x, y):
-        self._x = x
-        self._y = y
+        self._values = (x, y)
+        self._offset = 0
+
+    @classmethod
+    def _view(cls, values, offset):
+        pg = cls.__new__(cls)
+        pg._values = values
+        pg._offset = offset
+        return pg
 
     def __str__(self):
-        return "x: {}, y: {}".format(self._x, self._y)
+        return "x: {}, y: {}".format(self.x, self.y)
 
     @property
     def x(self):
-        return self._x
+        return self._values[self._offset]
 
     @property
     def y(self):
-        return self._y
+        return self._values[self._offset + 1]
 
-class Geometry:
-    def __init__(self, geometry):
+class GeometryStore:
+    """
+    Columnar float32 storage for the geometry of every block of a document.
+
+    Blocks are addressed by the ordinal returned from add(); BoundingBox and Polygon
+    objects handed out for an ordinal are views over the shared arrays, so a parsed
+    page does not keep thousands of small geometry objects alive.
+
+    Coordinates are stored as float32, about 7 significant digits, so they can differ
+    from the response after the 7th digit. Textract coordinates are ratios of the page
+    size, for which this is well below a pixel.
+    """
+
+    def __init__(self):
+        # width, height, left, top for each ordinal
+        self._boxes = array('f')
+        # x, y pairs of all polygons, ordinal n owns points[starts[n]:starts[n + 1]]
+        self._points = array('f')
+        self._polygonStarts = array('I', [0])
+
+    def __len__(self):
+        return len(self._polygonStarts) - 1
+
+    def add(self, geometry):
         boundingBox = geometry["BoundingBox"]
-        polygon = geometry["Polygon"]
-        bb = BoundingBox(boundingBox["Width"], boundingBox["Height"], boundingBox["Left"], boundingBox["Top"])
-        pgs = []
-        for pg in polygon:
-            pgs.append(Polygon(pg["X"], pg["Y"]))
+        self._boxes.extend((boundingBox["Width"], boundingBox["Height"], boundingBox["Left"], boundingBox["Top"]))
+        # the polygon may already have been pruned from the response
+        for pg in geometry.get("Polygon", ()):
+            self._points.append(pg["X"])
+            self._points.append(pg["Y"])
+        self._polygonStarts.append(len(self._points))
+        return len(self._polygonStarts) - 2
+
+    def boundingBox(self, ordinal):
+        return BoundingBox._view(self._boxes, ordinal * 4)
 
-        self._boundingBox = bb
-        self._polygon = pgs
+    def polygon(self, ordinal):
+        return [Polygon._view(self._points, offset)
+                for offset in range(self._polygonStarts[ordinal], self._polygonStarts[ordinal + 1], 2)]
+
+class Geometry:
+    __slots__ = ('_store', '_ordinal', '_boundingBox', '_polygon')
+
+    def __init__(self, geometry, store=None):
+        self._store = store
+        if(store is None):
+            # a standalone geometry, e.g. of a Page built from a plain dict of blocks, keeps
+            # plain objects at full precision rather than a store of its own
+            boundingBox = geometry["BoundingBox"]
+            self._boundingBox = BoundingBox(boundingBox["Width"], boundingBox["Height"], boundingBox["Left"], boundingBox["Top"])
+            self._polygon = [Polygon(pg["X"], pg["Y"]) for pg in geometry.get("Polygon", ())]
+        else:
+            self._ordinal = store.add(geometry)
 
     def __str__(self):
-        s = "BoundingBox: {}\n".format(str(self._boundingBox))
+        s = "BoundingBox: {}\n".format(str(self.boundingBox))
         return s
 
     @property
     def boundingBox(self):
-        return self._boundingBox
+        if(self._store is None):
+            return self._boundingBox
+        return self._store.boundingBox(self._ordinal)
 
     @property
     def polygon(self):
-        return self._polygon
+        if(self._store is None):
+            return self._polygon
+        return self._store.polygon(self._ordinal)
+
+class BlockMap(dict):
+    """
+    Maps block ids to Textract blocks and holds the state shared by all the objects
+    parsed from them, such as the geometry store.
+    """
+
+    def __init__(self, *args, **kwargs):
+        super().__init__(*args, **kwargs)
+        self.geometryStore = GeometryStore()
+        self._wrappers = {}
+
+    def wrap(self, blockId, cls):
+        """
+        Returns the single cls instance built for blockId, so that a block referenced
+        by several parents is only parsed once.
+        """
+        obj = self._wrappers.get(blockId)
+        if(obj is None):
+            obj = cls(self[blockId], self)
+            self._wrappers[blockId] = obj
+        return obj
+
+def _geometry(block, blockMap):
+    return Geometry(block['Geometry'], getattr(blockMap, 'geometryStore', None))
+
+def _wrap(blockMap, blockId, cls):
+    if(isinstance(blockMap, BlockMap)):
+        return blockMap.wrap(blockId, cls)
+    return cls(blockMap[blockId], blockMap)
+
+def _childIds(block):
+    ids = []
+    if('Relationships' in block and block['Relationships']):
+        for rs in block['Relationships']:
+            if(rs['Type'] == 'CHILD'):
+                ids.extend(rs['Ids'])
+    return ids
+
+def _wrapContent(childIds, blockMap, blockTypes):
+    content = []
+    for cid in childIds:
+        blockType = blockMap[cid]['BlockType']
+        if(blockType == "WORD" and "WORD" in blockTypes):
+            content.append(_wrap(blockMap, cid, Word))
+        elif(blockType == "SELECTION_ELEMENT" and "SELECTION_ELEMENT" in blockTypes):
+            content.append(_wrap(blockMap, cid, SelectionElement))
+    return content
+
+class TextBuffer:
+    """
+    Collects text fragments and joins them only when the text is read, instead of
+    copying the text gathered so far on every concatenation. The joined text is
+    cached until more fragments are appended.
+    """
+
+    def __init__(self):
+        self._parts = []
+        self._text = None
+
+    def append(self, text):
+        self._parts.append(text)
+        self._text = None
+
+    def extend(self, texts):
+        self._parts.extend(texts)
+        self._text = None
+
+    def __str__(self):
+        return self.text
+
+    def __len__(self):
+        return len(self.text)
+
+    @property
+    def text(self):
+        if(self._text is None):
+            self._text = ''.join(self._parts)
+            self._parts = [self._text]
+        return self._text
 
 class Word:
+    __slots__ = ('_block', '_confidence', '_geometry', '_id', '_text')
+
     def __init__(self, block, blockMap):
         self._block = block
         self._confidence = block['Confidence']
-        self._geometry = Geometry(block['Geometry'])
+        self._geometry = _geometry(block, blockMap)
         self._id = block['Id']
         self._text = ""
         if(block['Text']):
@@ -118,27 +282,21 @@ class Line:
 
         self._block = block
         self._confidence = block['Confidence']
-        self._geometry = Geometry(block['Geometry'])
+        self._geometry = _geometry(block, blockMap)
         self._id = block['Id']
 
         self._text = ""
         if(block['Text']):
             self._text = block['Text']
 
-        self._words = []
-        if('Relationships' in block and block['Relationships']):
-            for rs in block['Relationships']:
-                if(rs['Type'] == 'CHILD'):
-                    for cid in rs['Ids']:
-                        if(blockMap[cid]["BlockType"] == "WORD"):
-                            self._words.append(Word(blockMap[cid], blockMap))
+        # words are only wrapped when first accessed
+        self._blockMap = blockMap
+        self._words = None
+
     def __str__(self):
-        s = "Line\n==========\n"
-        s = s + self._text + "\n"
-        s = s + "Words\n----------\n"
-        for word in self._words:
-            s = s + "[{}]".format(str(word))
-        return s
+        s = ["Line\n==========\n", self._text, "\n", "Words\n----------\n"]
+        s.extend("[{}]".format(str(word)) for word in self.words)
+        return ''.join(s)
 
     @property
     def confidence(self):
@@ -154,6 +312,8 @@ class Line:
 
     @property
     def words(self):
+        if(self._words is None):
+            self._words = _wrapContent(_childIds(self._block), self._blockMap, ("WORD",))
         return self._words
 
     @property
@@ -165,9 +325,11 @@ class Line:
         return self._block
 
 class SelectionElement:
+    __slots__ = ('_confidence', '_geometry', '_id', '_selectionStatus')
+
     def __init__(self, block, blockMap):
         self._confidence = block['Confidence']
-        self._geometry = Geometry(block['Geometry'])
+        self._geometry = _geometry(block, blockMap)
         self._id = block['Id']
         self._selectionStatus = block['SelectionStatus']
 
@@ -191,19 +353,19 @@ class FieldKey:
     def __init__(self, block, children, blockMap):
         self._block = block
         self._confidence = block['Confidence']
-        self._geometry = Geometry(block['Geometry'])
+        self._geometry = _geometry(block, blockMap)
         self._id = block['Id']
         self._text = ""
-        self._content = []
+        self._children = children
+        self._blockMap = blockMap
+        self._content = None
 
         t = []
 
         for eid in children:
             wb = blockMap[eid]
             if(wb['BlockType'] == "WORD"):
-                w = Word(wb, blockMap)
-                self._content.append(w)
-                t.append(w.text)
+                t.append(wb['Text'] or "")
 
         if(t):
             self._text = ' '.join(t)
@@ -225,6 +387,8 @@ class FieldKey:
 
     @property
     def content(self):
+        if(self._content is None):
+            self._content = _wrapContent(self._children, self._blockMap, ("WORD",))
         return self._content
 
     @property
@@ -239,23 +403,21 @@ class FieldValue:
     def __init__(self, block, children, blockMap):
         self._block = block
         self._confidence = block['Confidence']
-        self._geometry = Geometry(block['Geometry'])
+        self._geometry = _geometry(block, blockMap)
         self._id = block['Id']
         self._text = ""
-        self._content = []
+        self._children = children
+        self._blockMap = blockMap
+        self._content = None
 
         t = []
 
         for eid in children:
             wb = blockMap[eid]
             if(wb['BlockType'] == "WORD"):
-                w = Word(wb, blockMap)
-                self._content.append(w)
-                t.append(w.text)
+                t.append(wb['Text'] or "")
             elif(wb['BlockType'] == "SELECTION_ELEMENT"):
-                se = SelectionElement(wb, blockMap)
-                self._content.append(se)
-                self._text = se.selectionStatus
+                self._text = wb['SelectionStatus']
 
         if(t):
             self._text = ' '.join(t)
@@ -277,6 +439,8 @@ class FieldValue:
 
     @property
     def content(self):
+        if(self._content is None):
+            self._content = _wrapContent(self._children, self._blockMap, ("WORD", "SELECTION_ELEMENT"))
         return self._content
 
     @property
@@ -322,20 +486,40 @@ class Field:
     def value(self):
         return self._value
 
+def _normalizeKey(key):
+    return ' '.join(key.lower().split())
+
 class Form:
+    """
+    Key/value fields of a page, indexed by key.
+
+    Besides the exact key map, keys are indexed case-insensitively with one bucket
+    per normalized key, by their character trigrams for substring search and in
+    sorted order for prefix search, so lookups do not scan every field.
+    """
+
     def __init__(self):
         self._fields = []
         self._fieldsMap = {}
+        self._keys = []
+        self._normalizedKeysMap = {}
+        self._ngramsMap = {}
+        self._sortedKeys = None
 
     def addField(self, field):
+        position = len(self._fields)
         self._fields.append(field)
         self._fieldsMap[field.key.text] = field
 
+        key = field.key.text.lower()
+        self._keys.append(key)
+        self._normalizedKeysMap.setdefault(_normalizeKey(key), []).append(field)
+        for i in range(len(key) - KEY_NGRAM_SIZE + 1):
+            self._ngramsMap.setdefault(key[i:i + KEY_NGRAM_SIZE], set()).add(position)
+        self._sortedKeys = None
+
     def __str__(self):
-        s = ""
-        for field in self._fields:
-            s = s + str(field) + "\n"
-        return s
+        return ''.join(str(field) + "\n" for field in self._fields)
 
     @property
     def fields(self):
@@ -346,14 +530,40 @@ class Form:
         if(key in self._fieldsMap):
             field = self._fieldsMap[key]
         return field
-    
+
+    def getFieldsByKey(self, key):
+        """
+        Returns every field whose key matches, ignoring case and extra whitespace.
+        """
+        return list(self._normalizedKeysMap.get(_normalizeKey(key), []))
+
     def searchFieldsByKey(self, key):
         searchKey = key.lower()
-        results = []
-        for field in self._fields:
-            if(field.key and searchKey in field.key.text.lower()):
-                results.append(field)
-        return results
+        if(len(searchKey) < KEY_NGRAM_SIZE):
+            positions = range(len(self._fields))
+        else:
+            positions = None
+            for i in range(len(searchKey) - KEY_NGRAM_SIZE + 1):
+                candidates = self._ngramsMap.get(searchKey[i:i + KEY_NGRAM_SIZE])
+                if(not candidates):
+                    return []
+                positions = set(candidates) if positions is None else positions & candidates
+                if(not positions):
+                    return []
+            positions = sorted(positions)
+        return [self._fields[p] for p in positions if searchKey in self._keys[p]]
+
+    def searchFieldsByKeyPrefix(self, prefix):
+        if(self._sortedKeys is None):
+            self._sortedKeys = sorted((key, position) for position, key in enumerate(self._keys))
+        searchKey = prefix.lower()
+        positions = []
+        for i in range(bisect.bisect_left(self._sortedKeys, (searchKey,)), len(self._sortedKeys)):
+            key, position = self._sortedKeys[i]
+            if(not key.startswith(searchKey)):
+                break
+            positions.append(position)
+        return [self._fields[p] for p in sorted(positions)]
 
 class Cell:
 
@@ -364,23 +574,18 @@ class Cell:
         self._columnIndex = block['ColumnIndex']
         self._rowSpan = block['RowSpan']
         self._columnSpan = block['ColumnSpan']
-        self._geometry = Geometry(block['Geometry'])
+        self._geometry = _geometry(block, blockMap)
         self._id = block['Id']
-        self._content = []
-        self._text = ""
-        if('Relationships' in block and block['Relationships']):
-            for rs in block['Relationships']:
-                if(rs['Type'] == 'CHILD'):
-                    for cid in rs['Ids']:
-                        blockType = blockMap[cid]["BlockType"]
-                        if(blockType == "WORD"):
-                            w = Word(blockMap[cid], blockMap)
-                            self._content.append(w)
-                            self._text = self._text + w.text + ' '
-                        elif(blockType == "SELECTION_ELEMENT"):
-                            se = SelectionElement(blockMap[cid], blockMap)
-                            self._content.append(se)
-                            self._text = self._text + se.selectionStatus + ', '
+        self._blockMap = blockMap
+        self._content = None
+        t = []
+        for cid in _childIds(block):
+            cb = blockMap[cid]
+            if(cb["BlockType"] == "WORD"):
+                t.append((cb['Text'] or "") + ' ')
+            elif(cb["BlockType"] == "SELECTION_ELEMENT"):
+                t.append(cb['SelectionStatus'] + ', ')
+        self._text = ''.join(t)
 
     def __str__(self):
         return self._text
@@ -415,6 +620,8 @@ class Cell:
 
     @property
     def content(self):
+        if(self._content is None):
+            self._content = _wrapContent(_childIds(self._block), self._blockMap, ("WORD", "SELECTION_ELEMENT"))
         return self._content
 
     @property
@@ -425,15 +632,26 @@ class Cell:
     def block(self):
         return self._block
 
+class MergedCell(Cell):
+    """
+    A MERGED_CELL block, covering the cells it lists as children.
+    """
+
+    def __init__(self, block, blockMap, cells):
+        super().__init__(block, blockMap)
+        self._cells = cells
+        self._text = ''.join(cell.text for cell in cells)
+
+    @property
+    def cells(self):
+        return self._cells
+
 class Row:
     def __init__(self):
         self._cells = []
 
     def __str__(self):
-        s = ""
-        for cell in self._cells:
-            s = s + "[{}]".format(str(cell))
-        return s
+        return ''.join("[{}]".format(str(cell)) for cell in self._cells)
 
     @property
     def cells(self):
@@ -446,11 +664,13 @@ class Table:
         self._block = block
 
         self._confidence = block['Confidence']
-        self._geometry = Geometry(block['Geometry'])
+        self._geometry = _geometry(block, blockMap)
 
         self._id = block['Id']
         self._rows = []
 
+        cells = []
+        mergedCellIds = []
         ri = 1
         row = Row()
         cell = None
@@ -459,6 +679,7 @@ class Table:
                 if(rs['Type'] == 'CHILD'):
                     for cid in rs['Ids']:
                         cell = Cell(blockMap[cid], blockMap)
+                        cells.append(cell)
                         if(cell.rowIndex > ri):
                             self._rows.append(row)
                             row = Row()
@@ -466,13 +687,45 @@ class Table:
                         row.cells.append(cell)
                     if(row and row.cells):
                         self._rows.append(row)
+                elif(rs['Type'] == 'MERGED_CELL'):
+                    mergedCellIds.extend(rs['Ids'])
+
+        self._mergedCells = []
+        if(mergedCellIds):
+            cellsById = {cell.id: cell for cell in cells}
+            for mid in mergedCellIds:
+                mergedBlock = blockMap[mid]
+                self._mergedCells.append(MergedCell(mergedBlock, blockMap,
+                                                    [cellsById[cid] for cid in _childIds(mergedBlock) if cid in cellsById]))
+
+        self._buildGrid(cells)
+
+    def _buildGrid(self, cells):
+        # dense row-major grid where every position covered by a span points to the
+        # spanning cell, and the matching texts with the text at the span origin only
+        self._rowCount = 0
+        self._columnCount = 0
+        for cell in itertools.chain(cells, self._mergedCells):
+            self._rowCount = max(self._rowCount, cell.rowIndex + cell.rowSpan - 1)
+            self._columnCount = max(self._columnCount, cell.columnIndex + cell.columnSpan - 1)
+
+        self._grid = [None] * (self._rowCount * self._columnCount)
+        self._texts = [""] * (self._rowCount * self._columnCount)
+        # merged cells are laid over the cells they cover
+        for cell in itertools.chain(cells, self._mergedCells):
+            for r in range(cell.rowIndex - 1, cell.rowIndex - 1 + cell.rowSpan):
+                start = r * self._columnCount + cell.columnIndex - 1
+                end = start + cell.columnSpan
+                self._grid[start:end] = [cell] * cell.columnSpan
+                self._texts[start:end] = [""] * cell.columnSpan
+            self._texts[(cell.rowIndex - 1) * self._columnCount + cell.columnIndex - 1] = cell.text
 
     def __str__(self):
-        s = "Table\n==========\n"
+        s = ["Table\n==========\n"]
         for row in self._rows:
-            s = s + "Row\n==========\n"
-            s = s + str(row) + "\n"
-        return s
+            s.append("Row\n==========\n")
+            s.append(str(row) + "\n")
+        return ''.join(s)
 
     @property
     def confidence(self):
@@ -494,11 +747,92 @@ class Table:
     def block(self):
         return self._block
 
+    @property
+    def mergedCells(self):
+        return self._mergedCells
+
+    @property
+    def rowCount(self):
+        return self._rowCount
+
+    @property
+    def columnCount(self):
+        return self._columnCount
+
+    def cell(self, rowIndex, columnIndex):
+        """
+        Returns the cell covering the 1-based (rowIndex, columnIndex) position, which
+        is the merged or spanning cell when the position is part of a span.
+        """
+        if(0 < rowIndex <= self._rowCount and 0 < columnIndex <= self._columnCount):
+            return self._grid[(rowIndex - 1) * self._columnCount + columnIndex - 1]
+        return None
+
+    def column(self, columnIndex):
+        if(0 < columnIndex <= self._columnCount):
+            return self._grid[columnIndex - 1::self._columnCount]
+        return []
+
+    @property
+    def columns(self):
+        for c in range(1, self._columnCount + 1):
+            yield self.column(c)
+
+    def toArray(self):
+        """
+        Returns the cell texts as one list per row, padded to the column count, with
+        spanned positions left empty.
+        """
+        return [self._texts[r * self._columnCount:(r + 1) * self._columnCount] for r in range(self._rowCount)]
+
+    def writeCSV(self, writer):
+        writer.writerows(self._texts[r * self._columnCount:(r + 1) * self._columnCount] for r in range(self._rowCount))
+
+def sortLinesInReadingOrder(lines):
+    """
+    Groups lines into columns and returns them column by column, left to right,
+    each column read top to bottom.
+
+    A line belongs to a column when its centre falls inside the column, or the
+    column centre falls inside the line, the column being the extent of the first
+    line that opened it. Lines are swept by their left edge, so each line is only
+    checked against the few columns still overlapping the sweep position and the
+    cost is dominated by the O(n log n) sorts.
+    """
+    spans = []
+    for index, line in enumerate(lines):
+        boundingBox = line.geometry.boundingBox
+        left = boundingBox.left
+        spans.append((left, left + boundingBox.width, boundingBox.top, index))
+    spans.sort()
+
+    # each column is [left, right, centre, [(top, index), ...]], in the order opened
+    columns = []
+    active = []
+    for left, right, top, index in spans:
+        # columns ending before the sweep position can no longer match any line
+        active = [column for column in active if column[1] > left]
+        centre = (left + right) / 2
+        for column in active:
+            if(centre < column[1] or column[2] > left):
+                column[3].append((top, index))
+                break
+        else:
+            column = [left, right, centre, [(top, index)]]
+            columns.append(column)
+            active.append(column)
+
+    ordered = []
+    for column in columns:
+        column[3].sort()
+        ordered.extend(lines[index] for top, index in column[3])
+    return ordered
+
 class Page:
 
     def __init__(self, blocks, blockMap):
         self._blocks = blocks
-        self._text = ""
+        self._text = TextBuffer()
         self._lines = []
         self._form = Form()
         self._tables = []
@@ -507,21 +841,20 @@ class Page:
         self._parse(blockMap)
 
     def __str__(self):
-        s = "Page\n==========\n"
-        for item in self._content:
-            s = s + str(item) + "\n"
-        return s
+        s = ["Page\n==========\n"]
+        s.extend(str(item) + "\n" for item in self._content)
+        return ''.join(s)
 
     def _parse(self, blockMap):
         for item in self._blocks:
             if item["BlockType"] == "PAGE":
-                self._geometry = Geometry(item['Geometry'])
+                self._geometry = _geometry(item, blockMap)
                 self._id = item['Id']
             elif item["BlockType"] == "LINE":
                 l = Line(item, blockMap)
                 self._lines.append(l)
                 self._content.append(l)
-                self._text = self._text + l.text + '\n'
+                self._text.append(l.text + '\n')
             elif item["BlockType"] == "TABLE":
                 t = Table(item, blockMap)
                 self._tables.append(t)
@@ -536,33 +869,11 @@ class Page:
                         print("WARNING: Detected K/V where key does not have content. Excluding key from output.")
                         
     def getLinesInReadingOrder(self):
-        columns = []
-        lines = []
-        for item in self._lines:
-                column_found=False
-                for index, column in enumerate(columns):
-                    bbox_left = item.geometry.boundingBox.left
-                    bbox_right = item.geometry.boundingBox.left + item.geometry.boundingBox.width
-                    bbox_centre = item.geometry.boundingBox.left + item.geometry.boundingBox.width/2
-                    column_centre = column['left'] + column['right']/2
-                    if (bbox_centre > column['left'] and bbox_centre < column['right']) or (column_centre > bbox_left and column_centre < bbox_right):
-                        #Bbox appears inside the column
-                        lines.append([index, item.text])
-                        column_found=True
-                        break
-                if not column_found:
-                    columns.append({'left':item.geometry.boundingBox.left, 'right':item.geometry.boundingBox.left + item.geometry.boundingBox.width})
-                    lines.append([len(columns)-1, item.text])
-
-        lines.sort(key=lambda x: x[0])
-        return lines
+        return sortLinesInReadingOrder(self._lines)
 
     def getTextInReadingOrder(self):
         lines = self.getLinesInReadingOrder()
-        text = ""
-        for line in lines:
-            text = text + line[1] + '\n'
-        return text
+        return ''.join(line.text + '\n' for line in lines)
 
     @property
     def blocks(self):
@@ -570,7 +881,7 @@ class Page:
 
     @property
     def text(self):
-        return self._text
+        return self._text.text
 
     @property
     def lines(self):
@@ -607,18 +918,18 @@ class Document:
 
         self._responsePages = responsePages
         self._pages = []
+        self._text = TextBuffer()
 
         self._parse()
 
     def __str__(self):
-        s = "\nDocument\n==========\n"
-        for p in self._pages:
-            s = s + str(p) + "\n\n"
-        return s
+        s = ["\nDocument\n==========\n"]
+        s.extend(str(p) + "\n\n" for p in self._pages)
+        return ''.join(s)
 
     def _parseDocumentPagesAndBlockMap(self):
 
-        blockMap = {}
+        blockMap = BlockMap()
 
         documentPages = []
         documentPage = None
@@ -644,6 +955,7 @@ class Document:
         for documentPage in self._responseDocumentPages:
             page = Page(documentPage["Blocks"], self._blockMap)
             self._pages.append(page)
+            self._text.append(page.text + "\n")
 
     @property
     def blocks(self):
@@ -657,9 +969,444 @@ class Document:
     def pages(self):
         return self._pages
 
+    @property
+    def text(self):
+        return self._text.text
+
     def getBlockById(self, blockId):
         block = None
         if(self._blockMap and blockId in self._blockMap):
             block = self._blockMap[blockId]
         return block
 
+class PageStream:
+    """
+    Builds Page objects one at a time from an iterable of Textract responses.
+
+    Unlike Document, no document-wide block map is kept: child blocks are resolved
+    from the blocks of the current page plus a bounded lookahead into the next one,
+    so memory grows with the size of a page rather than the size of the document.
+    responsePages can be a generator, e.g. pages fetched from GetDocumentAnalysis.
+    """
+
+    def __init__(self, responsePages, lookahead=DEFAULT_LOOKAHEAD_BLOCKS):
+
+        if(isinstance(responsePages, dict)):
+            responsePages = [responsePages]
+
+        self._responsePages = responsePages
+        self._lookahead = lookahead
+        self._text = TextBuffer()
+
+    def __iter__(self):
+        pageBlocks = None
+        blockMap = BlockMap()
+        nextPageBlocks = None
+        nextBlockMap = BlockMap()
+
+        for response in self._responsePages:
+            for block in response['Blocks']:
+                if(block['BlockType'] == 'PAGE'):
+                    if(nextPageBlocks is not None):
+                        # a third page started before the lookahead ran out
+                        yield self._page(pageBlocks, blockMap)
+                        pageBlocks, blockMap = nextPageBlocks, nextBlockMap
+                        nextPageBlocks, nextBlockMap = None, BlockMap()
+                    if(pageBlocks is None):
+                        pageBlocks = [block]
+                    else:
+                        nextPageBlocks = [block]
+                    self._mapBlock(block, blockMap, nextBlockMap, nextPageBlocks)
+                elif(nextPageBlocks is not None):
+                    nextPageBlocks.append(block)
+                    self._mapBlock(block, blockMap, nextBlockMap, nextPageBlocks)
+                    if(len(nextPageBlocks) >= self._lookahead):
+                        yield self._page(pageBlocks, blockMap)
+                        pageBlocks, blockMap = nextPageBlocks, nextBlockMap
+                        nextPageBlocks, nextBlockMap = None, BlockMap()
+                elif(pageBlocks is not None):
+                    pageBlocks.append(block)
+                    self._mapBlock(block, blockMap, nextBlockMap, nextPageBlocks)
+
+        if(pageBlocks):
+            yield self._page(pageBlocks, blockMap)
+        if(nextPageBlocks):
+            yield self._page(nextPageBlocks, nextBlockMap)
+
+    def _page(self, blocks, blockMap):
+        page = Page(blocks, blockMap)
+        self._text.append(page.text + "\n")
+        return page
+
+    @property
+    def pages(self):
+        return iter(self)
+
+    @property
+    def text(self):
+        """
+        Text of the pages streamed so far.
+        """
+        return self._text.text
+
+    @staticmethod
+    def _mapBlock(block, blockMap, nextBlockMap, nextPageBlocks):
+        if('BlockType' in block and 'Id' in block):
+            blockMap[block['Id']] = block
+            # blocks in the lookahead belong to the next page but stay visible
+            # to the current one until it is built
+            if(nextPageBlocks is not None):
+                nextBlockMap[block['Id']] = block
+
+
+class _BinaryColumns:
+    """
+    Column arrays of the binary layout, in the order they are stored after the header.
+    """
+
+    # name, array typecode, number of items per block or per count of the header
+    LAYOUT = (
+        ('stringStarts', 'I'),
+        ('ids', 'I'),
+        ('types', 'I'),
+        ('texts', 'i'),
+        ('extras', 'i'),
+        ('pageNumbers', 'I'),
+        ('confidences', 'f'),
+        ('cells', 'H'),
+        ('boxes', 'f'),
+        ('pointStarts', 'I'),
+        ('points', 'f'),
+        ('groupStarts', 'I'),
+        ('groupTypes', 'I'),
+        ('idStarts', 'I'),
+        ('groupIds', 'I'),
+        ('pageStarts', 'I'),
+    )
+
+    @staticmethod
+    def lengths(blockCount, stringCount, pageCount, pointCount, groupCount, idCount):
+        return {
+            'stringStarts': stringCount + 1,
+            'ids': blockCount,
+            'types': blockCount,
+            'texts': blockCount,
+            'extras': blockCount,
+            'pageNumbers': blockCount,
+            'confidences': blockCount,
+            'cells': 4 * blockCount,
+            'boxes': 4 * blockCount,
+            'pointStarts': blockCount + 1,
+            'points': 2 * pointCount,
+            'groupStarts': blockCount + 1,
+            'groupTypes': groupCount,
+            'idStarts': groupCount + 1,
+            'groupIds': idCount,
+            'pageStarts': pageCount + 1,
+        }
+
+# block fields stored in their own columns, the other fields of a block are stored as json
+_BINARY_BLOCK_FIELDS = frozenset(('BlockType', 'Confidence', 'Text', 'RowIndex', 'ColumnIndex', 'RowSpan',
+                                  'ColumnSpan', 'Geometry', 'Id', 'Relationships', 'Page'))
+
+def writeBinaryDocument(responsePages, writer):
+    """
+    Writes the blocks of Textract responses to writer in a compact columnar layout:
+    a header, one array per block field, geometry and confidences as float32, i.e.
+    about 7 significant digits, and all the strings, ids included, stored once in a
+    string table. Blocks are grouped by page so
+    BinaryDocument can load a single page. The layout is little endian.
+    """
+    if(isinstance(responsePages, dict)):
+        responsePages = [responsePages]
+
+    stringIndexes = {}
+    strings = []
+    def stringIndex(value):
+        index = stringIndexes.get(value)
+        if(index is None):
+            index = len(strings)
+            stringIndexes[value] = index
+            strings.append(value)
+        return index
+
+    metadata = {}
+    blocks = []
+    blockPages = []
+    pagesSeen = 0
+    for response in responsePages:
+        for key, value in response.items():
+            if(key not in ('Blocks', 'NextToken') and key not in metadata):
+                metadata[key] = value
+        for block in response['Blocks']:
+            if(block['BlockType'] == 'PAGE'):
+                pagesSeen = pagesSeen + 1
+            blocks.append(block)
+            blockPages.append(block.get('Page', max(pagesSeen, 1)))
+
+    pageCount = max(blockPages) if blockPages else 0
+    order = sorted(range(len(blocks)), key=blockPages.__getitem__)
+
+    columns = {name: array(typecode) for name, typecode in _BinaryColumns.LAYOUT}
+    columns['pointStarts'].append(0)
+    columns['groupStarts'].append(0)
+    columns['idStarts'].append(0)
+    pageStarts = columns['pageStarts']
+    nan = float('nan')
+
+    for i in order:
+        block = blocks[i]
+        while(len(pageStarts) < blockPages[i]):
+            pageStarts.append(len(columns['ids']))
+        columns['ids'].append(stringIndex(block.get('Id', '')))
+        columns['types'].append(stringIndex(block['BlockType']))
+        columns['texts'].append(stringIndex(block['Text']) if 'Text' in block else -1)
+        extras = {key: value for key, value in block.items() if key not in _BINARY_BLOCK_FIELDS}
+        columns['extras'].append(stringIndex(json.dumps(extras, separators=(',', ':'))) if extras else -1)
+        columns['pageNumbers'].append(block.get('Page', 0))
+        columns['confidences'].append(block.get('Confidence', nan))
+        columns['cells'].extend((block.get('RowIndex', 0), block.get('ColumnIndex', 0),
+                                 block.get('RowSpan', 0), block.get('ColumnSpan', 0)))
+        geometry = block.get('Geometry')
+        if(geometry and 'BoundingBox' in geometry):
+            box = geometry['BoundingBox']
+            columns['boxes'].extend((box['Width'], box['Height'], box['Left'], box['Top']))
+        else:
+            columns['boxes'].extend((nan, nan, nan, nan))
+        if(geometry and 'Polygon' in geometry):
+            for point in geometry['Polygon']:
+                columns['points'].extend((point['X'], point['Y']))
+        columns['pointStarts'].append(len(columns['points']) // 2)
+        for relationship in block.get('Relationships', []):
+            columns['groupTypes'].append(stringIndex(relationship['Type']))
+            columns['groupIds'].extend(stringIndex(rid) for rid in relationship['Ids'])
+            columns['idStarts'].append(len(columns['groupIds']))
+        columns['groupStarts'].append(len(columns['groupTypes']))
+    while(len(pageStarts) < pageCount + 1):
+        pageStarts.append(len(columns['ids']))
+
+    metadataIndex = stringIndex(json.dumps(metadata, separators=(',', ':')))
+    encoded = [s.encode('utf-8') for s in strings]
+    stringStarts = columns['stringStarts']
+    stringStarts.append(0)
+    for value in encoded:
+        stringStarts.append(stringStarts[-1] + len(value))
+
+    writer.write(BINARY_HEADER.pack(BINARY_MAGIC, BINARY_VERSION, 0, len(columns['ids']), len(strings), pageCount,
+                                    len(columns['points']) // 2, len(columns['groupTypes']), len(columns['groupIds']),
+                                    metadataIndex))
+    for name, typecode in _BinaryColumns.LAYOUT:
+        column = columns[name]
+        if(sys.byteorder != 'little'):
+            column.byteswap()
+        writer.write(column.tobytes())
+    writer.write(b"".join(encoded))
+
+class _BinaryBlockMap(BlockMap):
+    """
+    Block map of a page loaded from a BinaryDocument. Blocks of other pages are
+    loaded the first time they are referenced.
+    """
+
+    def __init__(self, document, *args, **kwargs):
+        super().__init__(*args, **kwargs)
+        self._document = document
+
+    def __missing__(self, blockId):
+        index = self._document.indexOf(blockId)
+        if(index is None):
+            raise KeyError(blockId)
+        block = self._document.block(index)
+        self[blockId] = block
+        return block
+
+class BinaryDocument:
+    """
+    Reads documents written by writeBinaryDocument without parsing them up front:
+    columns are read in place from the buffer, e.g. a memory-mapped file, and pages
+    are only built when they are accessed.
+    """
+
+    def __init__(self, buffer):
+        self._buffer = memoryview(buffer)
+        (magic, version, reserved, self._blockCount, stringCount, self._pageCount, pointCount,
+         groupCount, idCount, self._metadataIndex) = BINARY_HEADER.unpack_from(self._buffer, 0)
+        if(magic != BINARY_MAGIC or version != BINARY_VERSION):
+            raise ValueError("Not a binary Textract document")
+
+        lengths = _BinaryColumns.lengths(self._blockCount, stringCount, self._pageCount, pointCount, groupCount, idCount)
+        offset = BINARY_HEADER.size
+        for name, typecode in _BinaryColumns.LAYOUT:
+            size = array(typecode).itemsize * lengths[name]
+            view = self._buffer[offset:offset + size]
+            if(sys.byteorder == 'little'):
+                column = view.cast(typecode)
+            else:
+                column = array(typecode, view.tobytes())
+                column.byteswap()
+            setattr(self, '_' + name, column)
+            offset = offset + size
+        self._strings = self._buffer[offset:]
+        self._decoded = [None] * stringCount
+        self._blockIndexes = None
+        self._pages = [None] * self._pageCount
+        self._file = None
+        self._mmap = None
+
+    @classmethod
+    def fromFile(cls, path):
+        """
+        Memory-maps the file at path, call close() once done with the document.
+        """
+        f = open(path, 'rb')
+        try:
+            m = mmap.mmap(f.fileno(), 0, access=mmap.ACCESS_READ)
+        except Exception:
+            f.close()
+            raise
+        document = cls(m)
+        document._file = f
+        document._mmap = m
+        return document
+
+    def __enter__(self):
+        return self
+
+    def __exit__(self, excType, excValue, traceback):
+        self.close()
+
+    def close(self):
+        if(self._mmap is not None):
+            # views on the map have to be released before it can be closed
+            for name, typecode in _BinaryColumns.LAYOUT:
+                column = getattr(self, '_' + name)
+                if(isinstance(column, memoryview)):
+                    column.release()
+            self._strings.release()
+            self._buffer.release()
+            self._mmap.close()
+            self._file.close()
+            self._mmap = None
+
+    def _string(self, index):
+        value = self._decoded[index]
+        if(value is None):
+            value = bytes(self._strings[self._stringStarts[index]:self._stringStarts[index + 1]]).decode('utf-8')
+            self._decoded[index] = value
+        return value
+
+    @property
+    def metadata(self):
+        return json.loads(self._string(self._metadataIndex))
+
+    @property
+    def pageCount(self):
+        return self._pageCount
+
+    def indexOf(self, blockId):
+        if(self._blockIndexes is None):
+            self._blockIndexes = {self._string(stringIndex): i for i, stringIndex in enumerate(self._ids)}
+        return self._blockIndexes.get(blockId)
+
+    def block(self, index):
+        """
+        Rebuilds the Textract block stored at index.
+        """
+        return self._blocks(index, index + 1)[0]
+
+    def _blocks(self, start, end):
+        # columns are sliced once per range, indexing the views one value at a time is much slower
+        string = self._string
+        types = self._types[start:end].tolist()
+        ids = self._ids[start:end].tolist()
+        texts = self._texts[start:end].tolist()
+        extras = self._extras[start:end].tolist()
+        confidences = self._confidences[start:end].tolist()
+        pageNumbers = self._pageNumbers[start:end].tolist()
+        cells = self._cells[4 * start:4 * end].tolist()
+        boxes = self._boxes[4 * start:4 * end].tolist()
+        pointStarts = self._pointStarts[start:end + 1].tolist()
+        points = self._points[2 * pointStarts[0]:2 * pointStarts[-1]].tolist()
+        groupStarts = self._groupStarts[start:end + 1].tolist()
+        groupTypes = self._groupTypes[groupStarts[0]:groupStarts[-1]].tolist()
+        idStarts = self._idStarts[groupStarts[0]:groupStarts[-1] + 1].tolist()
+        groupIds = self._groupIds[idStarts[0]:idStarts[-1]].tolist()
+
+        blocks = []
+        for i in range(end - start):
+            block = {'BlockType': string(types[i])}
+            if(confidences[i] == confidences[i]):
+                block['Confidence'] = confidences[i]
+            if(texts[i] >= 0):
+                block['Text'] = string(texts[i])
+            if(extras[i] >= 0):
+                block.update(json.loads(string(extras[i])))
+            if(cells[4 * i]):
+                block['RowIndex'] = cells[4 * i]
+                block['ColumnIndex'] = cells[4 * i + 1]
+                block['RowSpan'] = cells[4 * i + 2]
+                block['ColumnSpan'] = cells[4 * i + 3]
+            width = boxes[4 * i]
+            pointStart = 2 * (pointStarts[i] - pointStarts[0])
+            pointEnd = 2 * (pointStarts[i + 1] - pointStarts[0])
+            if(width == width or pointEnd > pointStart):
+                geometry = {}
+                if(width == width):
+                    geometry['BoundingBox'] = {'Width': width, 'Height': boxes[4 * i + 1],
+                                               'Left': boxes[4 * i + 2], 'Top': boxes[4 * i + 3]}
+                if(pointEnd > pointStart):
+                    geometry['Polygon'] = [{'X': points[p], 'Y': points[p + 1]} for p in range(pointStart, pointEnd, 2)]
+                block['Geometry'] = geometry
+            block['Id'] = string(ids[i])
+            if(groupStarts[i + 1] > groupStarts[i]):
+                relationships = []
+                for g in range(groupStarts[i] - groupStarts[0], groupStarts[i + 1] - groupStarts[0]):
+                    idStart = idStarts[g] - idStarts[0]
+                    idEnd = idStarts[g + 1] - idStarts[0]
+                    relationships.append({'Type': string(groupTypes[g]),
+                                          'Ids': [string(rid) for rid in groupIds[idStart:idEnd]]})
+                block['Relationships'] = relationships
+            if(pageNumbers[i]):
+                block['Page'] = pageNumbers[i]
+            blocks.append(block)
+        return blocks
+
+    def pageBlocks(self, pageIndex):
+        """
+        Textract blocks of a page, pageIndex starting at 0.
+        """
+        return self._blocks(self._pageStarts[pageIndex], self._pageStarts[pageIndex + 1])
+
+    def page(self, pageIndex):
+        """
+        Page object of a page, pageIndex starting at 0. Pages are built on first access.
+        """
+        page = self._pages[pageIndex]
+        if(page is None):
+            blocks = self.pageBlocks(pageIndex)
+            blockMap = _BinaryBlockMap(self)
+            for block in blocks:
+                blockMap[block['Id']] = block
+            page = Page(blocks, blockMap)
+            self._pages[pageIndex] = page
+        return page
+
+    @property
+    def pages(self):
+        return [self.page(i) for i in range(self._pageCount)]
+
+    @property
+    def blocks(self):
+        """
+        All the blocks in a single Textract response, as read by Document.
+        """
+        response = self.metadata
+        response['Blocks'] = self._blocks(0, self._blockCount)
+        return [response]
+
+    @property
+    def text(self):
+        text = TextBuffer()
+        for i in range(self._pageCount):
+            text.append(self.page(i).text + "\n")
+        return text.text
@@ -729,7 +729,8 @@ export class CdkTextractStack extends cdk.Stack {
             environment: {
                 DOCUMENTS_BUCKET: documentsS3Bucket.bucketName,
                 OUTPUT_TABLE: outputTable.tableName,
-                DOCUMENTS_TABLE: documentsTable.tableName
+                DOCUMENTS_TABLE: documentsTable.tableName,
+                BULK_CONCURRENCY: "8"
             }
         });
         documentBulkProcessor.addLayers(helperLayer);
@@ -748,6 +749,11 @@ export class CdkTextractStack extends cdk.Stack {
             new s3n.SqsDestination(documentBulkProcessingQueue),
             { prefix: 'documentDrop/' }
         );
+        bulkProcessingBucket.addEventNotification(
+            s3.EventType.OBJECT_CREATED_COMPLETE_MULTIPART_UPLOAD,
+            new s3n.SqsDestination(documentBulkProcessingQueue),
+            { prefix: 'documentDrop/' }
+        );
 
         documentBulkProcessor.addEventSource(
             new SqsEventSource(documentBulkProcessingQueue, {
@@ -765,7 +771,11 @@ export class CdkTextractStack extends cdk.Stack {
             environment: {
                 SYNC_QUEUE_URL: syncJobsQueue.queueUrl,
                 ASYNC_QUEUE_URL: asyncJobsQueue.queueUrl,
-                ERROR_HANDLER_QUEUE_URL: jobErrorHandlerQueue.queueUrl
+                ERROR_HANDLER_QUEUE_URL: jobErrorHandlerQueue.queueUrl,
+                DOCUMENTS_TABLE: documentsTable.tableName,
+                SYNC_MAX_PDF_PAGES: "1",
+                SYNC_MAX_PDF_BYTES: String(10 * 1024 * 1024),
+                SYNC_MAX_IMAGE_BYTES: String(5 * 1024 * 1024)
             },
             vpc: vpc
         });
@@ -777,7 +787,9 @@ export class CdkTextractStack extends cdk.Stack {
         documentProcessor.addEventSource(
             new DynamoEventSource(documentsTable, {
                 startingPosition: lambda.StartingPosition.TRIM_HORIZON,
-                batchSize: 1
+                batchSize: 10,
+                reportBatchItemFailures: true,
+                retryAttempts: 3
             })
         );
 
@@ -858,7 +870,8 @@ export class CdkTextractStack extends cdk.Stack {
         //Trigger
         syncProcessor.addEventSource(
             new SqsEventSource(syncJobsQueue, {
-                batchSize: 1
+                batchSize: 5,
+                reportBatchItemFailures: true
             })
         );
 
@@ -955,7 +968,8 @@ export class CdkTextractStack extends cdk.Stack {
         // Triggers
         jobResultProcessor.addEventSource(
             new SqsEventSource(jobResultsQueue, {
-                batchSize: 1
+                batchSize: 1,
+                reportBatchItemFailures: true
             })
         );
 
@@ -1061,6 +1075,7 @@ export class CdkTextractStack extends cdk.Stack {
         // Layer
         apiProcessor.addLayers(elasticSearchLayer);
         apiProcessor.addLayers(helperLayer);
+        apiProcessor.addLayers(textractorLayer);
 
         // Permissions
         documentsTable.grantReadWriteData(apiProcessor);
@@ -1084,6 +1099,12 @@ export class CdkTextractStack extends cdk.Stack {
             })
         );
         esEncryptionKey.grantEncryptDecrypt(apiProcessor);
+        apiProcessor.addToRolePolicy(
+            new iam.PolicyStatement({
+                actions: ['comprehend:BatchDetectEntities', 'comprehend:DetectEntities'],
+                resources: ['*'] // Currently, Comprehend does not support resource level permissions
+            })
+        );
 
         // API
 
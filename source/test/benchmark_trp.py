@@ -0,0 +1,124 @@
+import sys
+sys.path.append("./lambda/textractor/python")
+import io
+import json
+import random
+import timeit
+import trp
+from test_trp import ResponseBuilder
+
+# Micro benchmarks for the Textract response parser, run from the source folder:
+#   python3 test/benchmark_trp.py
+
+
+def legacyLinesInReadingOrder(lines):
+    # column grouping used before the sweep based implementation, kept for comparison
+    columns = []
+    ordered = []
+    for item in lines:
+        column_found = False
+        for index, column in enumerate(columns):
+            bbox_left = item.geometry.boundingBox.left
+            bbox_right = item.geometry.boundingBox.left + item.geometry.boundingBox.width
+            bbox_centre = item.geometry.boundingBox.left + item.geometry.boundingBox.width/2
+            column_centre = column['left'] + column['right']/2
+            if (bbox_centre > column['left'] and bbox_centre < column['right']) or (column_centre > bbox_left and column_centre < bbox_right):
+                ordered.append([index, item.text])
+                column_found = True
+                break
+        if not column_found:
+            columns.append({'left': item.geometry.boundingBox.left, 'right': item.geometry.boundingBox.left + item.geometry.boundingBox.width})
+            ordered.append([len(columns)-1, item.text])
+    ordered.sort(key=lambda x: x[0])
+    return ordered
+
+
+def buildColumnPage(numOfColumns, numOfLines):
+    random.seed(numOfColumns)
+    builder = ResponseBuilder()
+    builder.page()
+    columnWidth = 0.9 / numOfColumns
+    rows = numOfLines // numOfColumns
+    for row in range(rows):
+        for column in range(numOfColumns):
+            # ragged lines, as in justified text with short paragraph endings
+            width = columnWidth * random.uniform(0.3, 0.9)
+            left = 0.05 + column * columnWidth + random.uniform(0, 0.02)
+            builder.line("column {} row {}".format(column, row), left=left, top=row / rows, width=width)
+    return trp.Document(builder.responses(blocksPerResponse=len(builder.blocks))).pages[0]
+
+
+def benchmarkReadingOrder():
+    print("Reading order (seconds per page)")
+    for numOfColumns in (2, 3, 6):
+        for numOfLines in (1200, 4800):
+            page = buildColumnPage(numOfColumns, numOfLines)
+            legacy = min(timeit.repeat(lambda: legacyLinesInReadingOrder(page.lines), number=1, repeat=3))
+            current = min(timeit.repeat(page.getLinesInReadingOrder, number=1, repeat=3))
+            print("  {} columns, {} lines: legacy {:.4f}, current {:.4f}".format(
+                numOfColumns, numOfLines, legacy, current))
+
+
+def legacyDocumentText(document):
+    # text assembly used before TextBuffer, kept for comparison
+    docText = ""
+    for page in document.pages:
+        pageText = ""
+        for line in page.lines:
+            pageText = pageText + line.text + '\n'
+        page.legacyText = pageText
+    for page in document.pages:
+        docText = docText + page.legacyText + "\n"
+    return docText
+
+
+def buildTextResponses(numOfPages, linesPerPage):
+    builder = ResponseBuilder()
+    for p in range(numOfPages):
+        builder.page()
+        for i in range(linesPerPage):
+            builder.line("line {} of page {} with some more text to make it longer".format(i, p), top=i / linesPerPage)
+    return builder.responses()
+
+
+def benchmarkTextAssembly():
+    # Page and Document assemble their text while parsing, so the current figure is the whole
+    # of Document(...).text and the legacy one only the legacy assembly on a parsed document
+    print("Document text assembly (seconds per document)")
+    for numOfPages, linesPerPage in ((50, 200), (300, 200)):
+        responses = buildTextResponses(numOfPages, linesPerPage)
+        document = trp.Document(responses)
+        parse = min(timeit.repeat(lambda: trp.Document(responses), number=1, repeat=3))
+        legacy = min(timeit.repeat(lambda: legacyDocumentText(document), number=1, repeat=3))
+        current = min(timeit.repeat(lambda: trp.Document(responses).text, number=1, repeat=3))
+        print("  {} pages of {} lines: parse and legacy text {:.4f}, parse and document.text {:.4f}".format(
+            numOfPages, linesPerPage, parse + legacy, current))
+
+
+def benchmarkBinaryDocument():
+    print("Reloading a processed document (seconds per document)")
+    for numOfPages in (50, 300):
+        builder = ResponseBuilder()
+        for p in range(numOfPages):
+            builder.page()
+            for i in range(100):
+                builder.line("line {} of page {} with some more text".format(i, p), top=i / 100)
+        responses = builder.responses()
+        content = json.dumps(responses[0] if len(responses) == 1 else {"Blocks": builder.blocks})
+        buffer = io.BytesIO()
+        trp.writeBinaryDocument(responses, buffer)
+        binary = buffer.getvalue()
+
+        fromJson = min(timeit.repeat(lambda: trp.Document(json.loads(content)).pages[-1].text, number=1, repeat=3))
+        fromBinary = min(timeit.repeat(lambda: trp.BinaryDocument(binary).page(numOfPages - 1).text, number=1, repeat=3))
+        allFromJson = min(timeit.repeat(lambda: [p.text for p in trp.Document(json.loads(content)).pages], number=1, repeat=3))
+        allFromBinary = min(timeit.repeat(lambda: [p.text for p in trp.BinaryDocument(binary).pages], number=1, repeat=3))
+        print("  {} pages: json {} bytes, binary {} bytes".format(numOfPages, len(content), len(binary)))
+        print("    one page: json {:.4f}, binary {:.4f}".format(fromJson, fromBinary))
+        print("    all pages: json {:.4f}, binary {:.4f}".format(allFromJson, allFromBinary))
+
+
+if __name__ == '__main__':
+    benchmarkReadingOrder()
+    benchmarkTextAssembly()
+    benchmarkBinaryDocument()
@@ -0,0 +1,50 @@
+import sys
+sys.path.append("./lambda/helper/python")
+import shutil
+import tempfile
+import unittest
+from comprehendCache import ComprehendCache, MemoryCacheBackend, DiskCacheBackend
+
+
+class TestComprehendCache(unittest.TestCase):
+    def setUp(self):
+        self.directory = tempfile.mkdtemp()
+
+    def tearDown(self):
+        shutil.rmtree(self.directory)
+
+    def test_key_depends_on_api_language_and_text(self):
+        key = ComprehendCache.key('detect_entities_v2', 'page text')
+        self.assertEqual(key, ComprehendCache.key('detect_entities_v2', 'page text', 'en'))
+        self.assertNotEqual(key, ComprehendCache.key('infer_icd10_cm', 'page text'))
+        self.assertNotEqual(key, ComprehendCache.key('detect_entities_v2', 'page text', 'es'))
+        self.assertNotEqual(key, ComprehendCache.key('detect_entities_v2', 'other text'))
+
+    def test_memory_backend_evicts_least_recently_used(self):
+        backend = MemoryCacheBackend(maxEntries=2)
+        backend.put('a', 1)
+        backend.put('b', 2)
+        backend.get('a')
+        backend.put('c', 3)
+        self.assertEqual(backend.get('a'), 1)
+        self.assertIsNone(backend.get('b'))
+        self.assertEqual(backend.get('c'), 3)
+
+    def test_disk_backend_round_trip(self):
+        backend = DiskCacheBackend(self.directory)
+        self.assertIsNone(backend.get('missing'))
+        backend.put('key', [{'Text': 'aspirin', 'Score': 0.99}])
+        self.assertEqual(backend.get('key'), [{'Text': 'aspirin', 'Score': 0.99}])
+
+    def test_hit_in_later_backend_fills_earlier_ones(self):
+        memory = MemoryCacheBackend()
+        disk = DiskCacheBackend(self.directory)
+        ComprehendCache([disk]).put('infer_icd10_cm', 'page text', [])
+        cache = ComprehendCache([memory, disk])
+        self.assertEqual(cache.get('infer_icd10_cm', 'page text'), [])
+        self.assertEqual(memory.get(ComprehendCache.key('infer_icd10_cm', 'page text')), [])
+        self.assertIsNone(cache.get('detect_entities_v2', 'page text'))
+
+
+if __name__ == '__main__':
+    unittest.main()
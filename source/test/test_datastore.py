@@ -112,6 +112,35 @@ class TestDocumentStore(unittest.TestCase):
         self.assertEqual(response['documentId'], documentId)
         self.assertEqual(response['bucketName'], "dusstack-sample-s3-bucket")
 
+    def test_update_document_mime_type(self):
+        documentId = 'b1a99fda-1809-49d7-8f19-0d1688eb65b9'
+        self.assertTrue('mimeType' not in self.ds.getDocument(documentId))
+        response = self.ds.updateDocumentMimeType(documentId, "application/pdf")
+        self.assertEqual(response, None)
+        self.assertEqual(self.ds.getDocument(documentId)['mimeType'], "application/pdf")
+        response = self.ds.updateDocumentMimeType("b1333fda-1809-49d7-8f19-0d1688eb65b9", "application/pdf")
+        self.assertEqual(response, {'Error': 'Document does not exist.'})
+
+    def test_update_document_routing(self):
+        documentId = 'b1a99fda-1809-49d7-8f19-0d1688eb65b9'
+        response = self.ds.updateDocumentRouting(documentId, "sync", 2048, 1)
+        self.assertEqual(response, None)
+        document = self.ds.getDocument(documentId)
+        self.assertEqual(document['routingPath'], "sync")
+        self.assertEqual(document['objectSize'], 2048)
+        self.assertEqual(document['pageCount'], 1)
+
+    def test_mark_document_queued(self):
+        documentId = 'b1a99fda-1809-49d7-8f19-0d1688eb65b9'
+        self.assertTrue('documentQueuedOn' not in self.ds.getDocument(documentId))
+        response = self.ds.markDocumentQueued(documentId)
+        self.assertEqual(response, None)
+        self.assertTrue('documentQueuedOn' in self.ds.getDocument(documentId))
+
+    def test_mark_document_queued_throws_error_when_document_does_not_exist(self):
+        response = self.ds.markDocumentQueued("b1333fda-1809-49d7-8f19-0d1688eb65b9")
+        self.assertEqual(response, {'Error': 'Document does not exist.'})
+
     def tearDown(self):
         self.conn.delete_table(TableName=DOCUMENTS_TABLE_NAME)
 
@@ -2,14 +2,21 @@ import sys
 sys.path.append("./lambda/helper/python")
 import boto3
 import unittest
+import threading
+import time
 from moto import mock_s3
 from moto import mock_dynamodb2
 from helper import S3Helper
+from helper import S3MultipartWriter
 from helper import DynamoDBHelper
+from helper import DynamoDBBatchWriter
+from helper import AwsHelper
+from helper import TokenBucket
 
 BUCKET_NAME = "test-bucket"
 S3_FILE_NAME = "test_file_name.txt"
 TABLE_NAME = "TestsTable"
+OUTPUT_TABLE_NAME = "OutputTestsTable"
 
 current_session = boto3.session.Session()
 REGION = current_session.region_name
@@ -43,6 +50,40 @@ class TestS3Helper(unittest.TestCase):
         body = S3Helper.readFromS3(BUCKET_NAME, S3_FILE_NAME, REGION)
         self.assertEqual(body,"Test")
     
+    def test_multipart_writer(self):
+        with S3MultipartWriter(BUCKET_NAME, S3_FILE_NAME, REGION, partSize=5 * 1024 * 1024) as writer:
+            for i in range(11):
+                writer.write("x" * 1024 * 1024)
+        body = self.conn.Object(BUCKET_NAME, S3_FILE_NAME).get()['Body'].read()
+        self.assertEqual(len(body), 11 * 1024 * 1024)
+
+    def test_multipart_writer_small_content(self):
+        with S3MultipartWriter(BUCKET_NAME, S3_FILE_NAME, REGION) as writer:
+            writer.write("Hello ")
+            writer.write(b"World")
+        body = self.conn.Object(BUCKET_NAME, S3_FILE_NAME).get()['Body'].read().decode('utf-8')
+        self.assertEqual(body, "Hello World")
+
+    def test_read_bytes_from_s3(self):
+        self.conn.Object(BUCKET_NAME, S3_FILE_NAME).put(Body="%PDF-1.7 rest of the file")
+        self.assertEqual(S3Helper.readBytesFromS3(BUCKET_NAME, S3_FILE_NAME, 0, 8, REGION), b"%PDF-1.7")
+        self.assertEqual(S3Helper.readBytesFromS3(BUCKET_NAME, S3_FILE_NAME, -4, 4, REGION), b"file")
+        self.assertEqual(S3Helper.readBytesFromS3(BUCKET_NAME, S3_FILE_NAME, 0, 8192, REGION), b"%PDF-1.7 rest of the file")
+
+    def test_copy_object(self):
+        self.conn.Object(BUCKET_NAME, S3_FILE_NAME).put(Body="Copy me")
+        size = S3Helper.copyObject(BUCKET_NAME, S3_FILE_NAME, BUCKET_NAME, "copy.txt", REGION)
+        self.assertEqual(size, 7)
+        body = self.conn.Object(BUCKET_NAME, "copy.txt").get()['Body'].read().decode('utf-8')
+        self.assertEqual(body, "Copy me")
+
+    def test_copy_object_in_parts(self):
+        content = b"".join(bytes([i]) * 1024 * 1024 for i in range(12))
+        self.conn.Object(BUCKET_NAME, S3_FILE_NAME).put(Body=content)
+        S3Helper.copyObject(BUCKET_NAME, S3_FILE_NAME, BUCKET_NAME, "copy.txt", REGION, partSize=5 * 1024 * 1024)
+        body = self.conn.Object(BUCKET_NAME, "copy.txt").get()['Body'].read()
+        self.assertEqual(body, content)
+
     def tearDown(self):
         buckets = boto3.client('s3').list_buckets()
         for bucket in buckets['Buckets']:
@@ -80,9 +121,70 @@ class TestDynamoDBHelper(unittest.TestCase):
             }
         ddbResponse = DynamoDBHelper.insertItem(TABLE_NAME, new_item)
         self.assertEqual(ddbResponse['ResponseMetadata']['HTTPStatusCode'],200)
+
+    def test_batch_writer_flushes_all_items(self):
+        with DynamoDBBatchWriter(TABLE_NAME) as writer:
+            for i in range(60):
+                writer.putItem({"forum_name": "Batch{}".format(i), "subject": "batch subject"})
+        items = self.conn.scan(TableName=TABLE_NAME)["Items"]
+        self.assertEqual(len(items), 61)
+
+    def test_delete_items(self):
+        self.conn.create_table(
+            TableName = OUTPUT_TABLE_NAME,
+            KeySchema = [{"AttributeName": "documentId","KeyType":"HASH"}, {"AttributeName": "outputType","KeyType":"RANGE"}],
+            AttributeDefinitions=[{"AttributeName": "documentId", "AttributeType": "S"}, {"AttributeName": "outputType", "AttributeType": "S"}],
+            ProvisionedThroughput={"ReadCapacityUnits": 5, "WriteCapacityUnits": 5},
+        )
+        with DynamoDBBatchWriter(OUTPUT_TABLE_NAME) as writer:
+            for i in range(30):
+                writer.putItem({"documentId": "doc", "outputType": "page-{}-Forms".format(i)})
+        DynamoDBHelper.deleteItems(OUTPUT_TABLE_NAME, "documentId", "doc", "outputType")
+        self.assertEqual(DynamoDBHelper.getItems(OUTPUT_TABLE_NAME, "documentId", "doc"), [])
+        self.conn.delete_table(TableName=OUTPUT_TABLE_NAME)
     
     def tearDown(self):
         self.conn.delete_table(TableName=TABLE_NAME)
 
+class TestAwsHelper(unittest.TestCase):
+    def setUp(self):
+        AwsHelper.clearPool()
+
+    def test_clients_are_pooled(self):
+        client = AwsHelper().getClient('s3', REGION)
+        self.assertIs(AwsHelper().getClient('s3', REGION), client)
+        self.assertIsNot(AwsHelper().getClient('s3', REGION, config={'max_pool_connections': 5}), client)
+        stats = AwsHelper.getPoolStats()
+        self.assertEqual(stats['hits'], 1)
+        self.assertEqual(stats['misses'], 2)
+        self.assertEqual(stats['clients'], 2)
+
+    def test_resources_are_pooled_across_threads(self):
+        resource = AwsHelper().getResource('s3', REGION)
+        self.assertIs(AwsHelper().getResource('s3', REGION), resource)
+        resources = []
+        thread = threading.Thread(target=lambda: resources.append(AwsHelper().getResource('s3', REGION)))
+        thread.start()
+        thread.join()
+        self.assertIs(resources[0], resource)
+        self.assertEqual(AwsHelper.getPoolStats()['resources'], 1)
+
+    def test_clear_pool_clears_resources_of_all_threads(self):
+        resources = []
+        thread = threading.Thread(target=lambda: resources.append(AwsHelper().getResource('s3', REGION)))
+        thread.start()
+        thread.join()
+        AwsHelper.clearPool()
+        self.assertEqual(AwsHelper.getPoolStats()['resources'], 0)
+        self.assertIsNot(AwsHelper().getResource('s3', REGION), resources[0])
+
+class TestTokenBucket(unittest.TestCase):
+    def test_acquire_is_paced_at_rate(self):
+        bucket = TokenBucket(50, capacity=1)
+        start = time.monotonic()
+        for i in range(11):
+            bucket.acquire()
+        self.assertGreaterEqual(time.monotonic() - start, 0.19)
+
 if __name__=='__main__':
     unittest.main()
@@ -0,0 +1,148 @@
+import sys
+sys.path.append("./lambda/helper/python")
+sys.path.append("./lambda/textractor/python")
+sys.path.append("./lambda/apiprocessor")
+import io
+import os
+import json
+import boto3
+import unittest
+from unittest import mock
+from moto import mock_s3
+from moto import mock_dynamodb2
+import trp
+import redact
+from test_trp import buildDocument
+
+BUCKET_NAME = "test-content-bucket"
+DOCUMENTS_TABLE_NAME = "DocumentsTestTable"
+OUTPUT_TABLE_NAME = "OutputTestTable"
+DOCUMENT_ID = "b1a54fda-1809-49d7-8f19-0d1688eb65b9"
+BINARY_RESPONSE_PATH = "public/samples/report.pdf-analysis/{}/textract/response.bin".format(DOCUMENT_ID)
+
+current_session = boto3.session.Session()
+REGION = current_session.region_name
+print(f"Test region is {REGION}")
+
+
+def noEntities(documentId, page, lines):
+    return [{"Entities": []} for line in lines]
+
+
+def mention(pageText, text, type):
+    begin = pageText.index(text)
+    return {"Text": text, "Type": type, "Score": 0.99, "BeginOffset": begin, "EndOffset": begin + len(text)}
+
+
+@mock_s3
+@mock_dynamodb2
+class TestRedact(unittest.TestCase):
+    def setUp(self):
+        os.environ['CONTENT_BUCKET'] = BUCKET_NAME
+        s3 = boto3.resource('s3', region_name=REGION)
+        if(REGION=='us-east-1'):
+            s3.create_bucket(Bucket=BUCKET_NAME)
+        else:
+            s3.create_bucket(Bucket=BUCKET_NAME, CreateBucketConfiguration={'LocationConstraint': REGION})
+
+        self.conn = boto3.client('dynamodb', region_name=REGION)
+        self.conn.create_table(
+            TableName = DOCUMENTS_TABLE_NAME,
+            KeySchema = [{"AttributeName": "documentId","KeyType":"HASH"}],
+            AttributeDefinitions=[{"AttributeName": "documentId", "AttributeType": "S"}],
+            ProvisionedThroughput={"ReadCapacityUnits": 5, "WriteCapacityUnits": 5},
+        )
+        self.conn.create_table(
+            TableName = OUTPUT_TABLE_NAME,
+            KeySchema = [{"AttributeName": "documentId","KeyType":"HASH"},
+                         {"AttributeName": "outputType","KeyType":"RANGE"}],
+            AttributeDefinitions=[{"AttributeName": "documentId", "AttributeType": "S"},
+                                  {"AttributeName": "outputType", "AttributeType": "S"}],
+            ProvisionedThroughput={"ReadCapacityUnits": 5, "WriteCapacityUnits": 5},
+        )
+        self.conn.put_item(
+            TableName = DOCUMENTS_TABLE_NAME,
+            Item={
+                "documentId": {"S" : DOCUMENT_ID},
+                "objectName": {"S": "public/samples/report.pdf"},
+                "bucketName": {"S": BUCKET_NAME},
+                "documentStatus": {"S": "SUCCEEDED"}
+            }
+        )
+
+        buffer = io.BytesIO()
+        trp.writeBinaryDocument(buildDocument(3).responses(), buffer)
+        s3.Object(BUCKET_NAME, BINARY_RESPONSE_PATH).put(Body=buffer.getvalue())
+        self.conn.put_item(
+            TableName = OUTPUT_TABLE_NAME,
+            Item={
+                "documentId": {"S" : DOCUMENT_ID},
+                "outputType": {"S": redact.BINARY_RESPONSE_OUTPUT_TYPE},
+                "outputPath": {"S": BINARY_RESPONSE_PATH}
+            }
+        )
+
+    def request(self, page):
+        return {
+            "documentsTable": DOCUMENTS_TABLE_NAME,
+            "outputTable": OUTPUT_TABLE_NAME,
+            "documentId": DOCUMENT_ID,
+            "page": page
+        }
+
+    def test_get_page_response_from_binary_document(self):
+        blocks = redact.getPageResponse(self.request(2))["textractResponse"]
+        self.assertTrue(isinstance(blocks, list))
+        self.assertEqual(blocks[0]["BlockType"], "PAGE")
+        self.assertEqual([block["Text"] for block in blocks if block["BlockType"] == "LINE"][0], "page 2 first line")
+
+    def test_text_from_binary_document(self):
+        with mock.patch.object(redact, "detectLineEntities", side_effect=noEntities):
+            response = redact.text(self.request(3))
+        texts = [line[0]["text"] for line in response["lines"]]
+        self.assertEqual(texts[:2], ["page 3 first line", "page 3 second line"])
+        self.assertEqual(response["entities"]["null"], len(texts))
+
+    def test_binary_document_is_looked_up_once(self):
+        with mock.patch.object(redact.DynamoDBHelper, "getItems", wraps=redact.DynamoDBHelper.getItems) as getItems:
+            redact.getPageResponse(self.request(1))
+            redact.getPageResponse(self.request(2))
+        self.assertEqual(getItems.call_count, 1)
+
+    def putPageMentions(self, mentions):
+        comprehendEntities = {"results": [{"Page": 1, "Entities": [], "Mentions": mentions}]}
+        boto3.resource('s3', region_name=REGION).Object(BUCKET_NAME, redact.COMPREHEND_ENTITIES_PATH.format(DOCUMENT_ID)).put(
+            Body=json.dumps(comprehendEntities))
+
+    def test_line_entities_from_comprehend_offsets(self):
+        lines = ["May I help", "Signed by Ann on May 5", "may"]
+        # the page text ComprehendHelper sends to Comprehend
+        pageText = "." + "".join(". " + line for line in lines)
+        self.putPageMentions([mention(pageText, "May 5", "DATE"), mention(pageText, "Ann", "PERSON")])
+        with mock.patch.object(redact, "detectEntities") as detectEntities:
+            results = redact.detectLineEntities(DOCUMENT_ID, 1, lines)
+        detectEntities.assert_not_called()
+        self.assertEqual(results[0], {"Entities": []})
+        self.assertEqual([(e["Text"], e["Type"], e["BeginOffset"]) for e in results[1]["Entities"]],
+                         [("Ann", "PERSON", 10), ("May 5", "DATE", 17)])
+        self.assertEqual(results[2], {"Entities": []})
+
+    def test_line_entities_are_detected_when_the_lines_do_not_match(self):
+        pageText = ".. Signed by Ann"
+        self.putPageMentions([mention(pageText, "Ann", "PERSON")])
+        with mock.patch.object(redact, "detectEntities", return_value=[{"Entities": []}]) as detectEntities:
+            redact.detectLineEntities(DOCUMENT_ID, 1, ["Signed by Bob"])
+        detectEntities.assert_called_once_with(["Signed by Bob"])
+
+    def tearDown(self):
+        for document, fileName in redact.binaryDocuments.values():
+            if(document is not None):
+                document.close()
+                os.remove(fileName)
+        redact.binaryDocuments.clear()
+        self.conn.delete_table(TableName=DOCUMENTS_TABLE_NAME)
+        self.conn.delete_table(TableName=OUTPUT_TABLE_NAME)
+
+
+if __name__=='__main__':
+    unittest.main()
@@ -0,0 +1,83 @@
+import sys
+sys.path.append("./lambda/helper/python")
+import os
+import unittest
+from routingHelper import RoutingHelper
+from routingHelper import SYNC_ROUTING_PATH
+from routingHelper import ASYNC_ROUTING_PATH
+from routingHelper import PDF_TAIL_BYTES
+
+SAMPLE_PDF = "samples/ClassicMode/Medical/HIPAA Release Form.pdf"
+# the sniffed head of a document
+HEAD_BYTES = 8192
+
+
+def buildPdf(objects, trailer=b""):
+    pdf = b"%PDF-1.4\n"
+    for number, body in enumerate(objects, 1):
+        pdf += b"%d 0 obj\n" % number + body + b"\nendobj\n"
+    return pdf + b"xref\n0 1\n0000000000 65535 f \ntrailer\n<< /Size 4 >>\n" + trailer + b"startxref\n9\n%%EOF\n"
+
+
+class TestRoutingHelper(unittest.TestCase):
+
+    def test_get_pdf_page_count_linearized(self):
+        head = b"%PDF-1.5\n1 0 obj\n<< /Linearized 1 /L 118045 /O 4 /E 23310 /N 12 /T 117602 /H [ 502 180 ] >>\nendobj\n"
+        self.assertEqual(RoutingHelper.getPdfPageCount(head, b""), 12)
+
+    def test_get_pdf_page_count_linearized_sample(self):
+        with open(SAMPLE_PDF, "rb") as pdf:
+            head = pdf.read(HEAD_BYTES)
+        self.assertEqual(RoutingHelper.getPdfPageCount(head, b""), 2)
+
+    def test_get_pdf_page_count_page_tree_in_tail(self):
+        pdf = buildPdf([
+            b"<< /Type /Catalog /Pages 2 0 R >>",
+            b"<< /Type /Pages /Kids [3 0 R 4 0 R 5 0 R] /Count 3 >>",
+            b"<< /Type /Pages /Parent 2 0 R /Kids [6 0 R] /Count 1 >>",
+            b"<< /Type /Page /Parent 2 0 R >>",
+        ], trailer=b"<< /Root 1 0 R >>\n")
+        head = b"%PDF-1.4\n" + b"\0" * 100
+        self.assertEqual(RoutingHelper.getPdfPageCount(head, pdf[-PDF_TAIL_BYTES:]), 3)
+
+    def test_get_pdf_page_count_incremental_update(self):
+        pdf = buildPdf([b"<< /Type /Pages /Kids [2 0 R] /Count 1 >>"])
+        pdf += buildPdf([b"<< /Type /Pages /Kids [2 0 R 3 0 R] /Count 2 >>"])
+        self.assertEqual(RoutingHelper.getPdfPageCount(pdf, pdf), 2)
+
+    def test_get_pdf_page_count_unknown(self):
+        # the page tree is in a compressed object stream
+        pdf = buildPdf([
+            b"<< /Type /Catalog /Pages 4 0 R >>",
+            b"<< /Type /ObjStm /N 1 /First 4 /Filter /FlateDecode /Length 12 >>\nstream\nx\x9c\x03\x00\x00\x00\x00\x01\nendstream",
+        ])
+        self.assertEqual(RoutingHelper.getPdfPageCount(pdf, pdf), None)
+        self.assertEqual(RoutingHelper.getPdfPageCount(b"not a pdf", b""), None)
+
+    def test_get_routing_path_single_page_pdf(self):
+        self.assertEqual(RoutingHelper.getRoutingPath("application/pdf", 2048, 1), SYNC_ROUTING_PATH)
+
+    def test_get_routing_path_multi_page_pdf(self):
+        self.assertEqual(RoutingHelper.getRoutingPath("application/pdf", 2048, 2), ASYNC_ROUTING_PATH)
+
+    def test_get_routing_path_unknown_page_count_falls_back_to_async(self):
+        self.assertEqual(RoutingHelper.getRoutingPath("application/pdf", 2048, None), ASYNC_ROUTING_PATH)
+        self.assertEqual(RoutingHelper.getRoutingPath("application/pdf", 2048), ASYNC_ROUTING_PATH)
+
+    def test_get_routing_path_large_pdf(self):
+        self.assertEqual(RoutingHelper.getRoutingPath("application/pdf", 20 * 1024 * 1024, 1), ASYNC_ROUTING_PATH)
+
+    def test_get_routing_path_images(self):
+        self.assertEqual(RoutingHelper.getRoutingPath("image/png", 2048), SYNC_ROUTING_PATH)
+        self.assertEqual(RoutingHelper.getRoutingPath("image/jpeg", 6 * 1024 * 1024), ASYNC_ROUTING_PATH)
+
+    def test_get_routing_path_limits_from_environment(self):
+        os.environ['SYNC_MAX_PDF_PAGES'] = "3"
+        try:
+            self.assertEqual(RoutingHelper.getRoutingPath("application/pdf", 2048, 3), SYNC_ROUTING_PATH)
+        finally:
+            del os.environ['SYNC_MAX_PDF_PAGES']
+
+
+if __name__=='__main__':
+    unittest.main()
@@ -0,0 +1,357 @@
+import sys
+sys.path.append("./lambda/textractor/python")
+import io
+import os
+import tempfile
+import unittest
+import trp
+
+
+def geometry(left, top, width, height):
+    return {
+        "BoundingBox": {"Width": width, "Height": height, "Left": left, "Top": top},
+        "Polygon": [
+            {"X": left, "Y": top},
+            {"X": left + width, "Y": top},
+            {"X": left + width, "Y": top + height},
+            {"X": left, "Y": top + height}
+        ]
+    }
+
+
+class ResponseBuilder:
+    """
+    Builds small synthetic Textract responses.
+    """
+
+    def __init__(self):
+        self.blocks = []
+        self._nextId = 0
+
+    def _id(self):
+        self._nextId += 1
+        return "block-{}".format(self._nextId)
+
+    def _add(self, block):
+        self.blocks.append(block)
+        return block["Id"]
+
+    def page(self):
+        return self._add({"BlockType": "PAGE", "Id": self._id(), "Geometry": geometry(0, 0, 1, 1)})
+
+    def word(self, text, left=0.1, top=0.1, width=0.1):
+        return self._add({"BlockType": "WORD", "Id": self._id(), "Text": text, "Confidence": 99.0,
+                          "Geometry": geometry(left, top, width, 0.02)})
+
+    def line(self, text, left=0.1, top=0.1, width=0.3):
+        wordIds = [self.word(w, left, top) for w in text.split(" ")]
+        return self._add({"BlockType": "LINE", "Id": self._id(), "Text": text, "Confidence": 99.0,
+                          "Geometry": geometry(left, top, width, 0.02),
+                          "Relationships": [{"Type": "CHILD", "Ids": wordIds}]})
+
+    def field(self, key, value):
+        valueId = self._id()
+        keyWords = [self.word(w) for w in key.split(" ")]
+        valueWords = [self.word(w) for w in value.split(" ")]
+        self._add({"BlockType": "KEY_VALUE_SET", "Id": self._id(), "EntityTypes": ["KEY"], "Confidence": 90.0,
+                   "Geometry": geometry(0.1, 0.1, 0.2, 0.02),
+                   "Relationships": [{"Type": "VALUE", "Ids": [valueId]}, {"Type": "CHILD", "Ids": keyWords}]})
+        self._add({"BlockType": "KEY_VALUE_SET", "Id": valueId, "EntityTypes": ["VALUE"], "Confidence": 90.0,
+                   "Geometry": geometry(0.4, 0.1, 0.2, 0.02),
+                   "Relationships": [{"Type": "CHILD", "Ids": valueWords}]})
+
+    def table(self, rows):
+        cellIds = []
+        for r, row in enumerate(rows):
+            for c, text in enumerate(row):
+                wordIds = [self.word(w) for w in text.split(" ")] if text else []
+                cell = {"BlockType": "CELL", "Id": self._id(), "Confidence": 90.0,
+                        "RowIndex": r + 1, "ColumnIndex": c + 1, "RowSpan": 1, "ColumnSpan": 1,
+                        "Geometry": geometry(0.1 * c, 0.1 * r, 0.1, 0.1)}
+                if wordIds:
+                    cell["Relationships"] = [{"Type": "CHILD", "Ids": wordIds}]
+                cellIds.append(self._add(cell))
+        return self._add({"BlockType": "TABLE", "Id": self._id(), "Confidence": 90.0,
+                          "Geometry": geometry(0, 0, 0.5, 0.5),
+                          "Relationships": [{"Type": "CHILD", "Ids": cellIds}]})
+
+    def responses(self, blocksPerResponse=1000):
+        return [{"Blocks": self.blocks[i:i + blocksPerResponse]}
+                for i in range(0, len(self.blocks), blocksPerResponse)]
+
+
+def buildDocument(numOfPages):
+    builder = ResponseBuilder()
+    for p in range(numOfPages):
+        builder.page()
+        builder.line("page {} first line".format(p + 1), top=0.1)
+        builder.line("page {} second line".format(p + 1), top=0.2)
+        builder.field("Name:", "Jane Doe {}".format(p + 1))
+        builder.table([["a", "b"], ["c", "d"]])
+    return builder
+
+
+class TestPageStream(unittest.TestCase):
+
+    def test_stream_matches_document(self):
+        responses = buildDocument(5).responses(blocksPerResponse=7)
+        document = trp.Document(responses)
+        streamed = list(trp.PageStream(responses))
+
+        self.assertEqual(len(streamed), 5)
+        self.assertEqual([p.text for p in streamed], [p.text for p in document.pages])
+        self.assertEqual([p.form.fields[0].value.text for p in streamed], ["Jane Doe {}".format(i) for i in range(1, 6)])
+        self.assertEqual(streamed[2].tables[0].rows[1].cells[1].text, "d ")
+
+    def test_stream_resolves_children_through_lookahead(self):
+        builder = ResponseBuilder()
+        builder.page()
+        builder.line("late")
+        builder.page()
+        # the word of the first page's line is emitted after the next PAGE block
+        wordBlock = builder.blocks.pop(1)
+        builder.blocks.append(wordBlock)
+
+        pages = list(trp.PageStream(builder.responses(), lookahead=10))
+        self.assertEqual(len(pages), 2)
+        self.assertEqual(pages[0].lines[0].words[0].text, "late")
+
+    def test_stream_accepts_single_response_and_generators(self):
+        responses = buildDocument(3).responses(blocksPerResponse=5)
+        self.assertEqual(len(list(trp.PageStream(r for r in responses))), 3)
+        single = buildDocument(1).responses()[0]
+        self.assertEqual(len(list(trp.PageStream(single))), 1)
+
+
+class TestGeometryStore(unittest.TestCase):
+
+    def test_geometry_views(self):
+        document = trp.Document(buildDocument(2).responses())
+        line = document.pages[1].lines[1]
+        self.assertAlmostEqual(line.geometry.boundingBox.top, 0.2, places=5)
+        self.assertAlmostEqual(line.geometry.boundingBox.width, 0.3, places=5)
+        self.assertEqual(len(line.geometry.polygon), 4)
+        self.assertAlmostEqual(line.geometry.polygon[2].x, 0.4, places=5)
+        self.assertAlmostEqual(line.words[0].geometry.boundingBox.left, 0.1, places=5)
+
+    def test_document_shares_one_store(self):
+        document = trp.Document(buildDocument(2).responses())
+        store = document.pages[0].geometry._store
+        self.assertIs(document.pages[1].lines[0].geometry._store, store)
+        self.assertIs(document.pages[1].tables[0].rows[0].cells[0].geometry._store, store)
+        self.assertGreater(len(store), 2)
+
+    def test_standalone_geometry_without_polygon(self):
+        geometry = trp.Geometry({"BoundingBox": {"Width": 0.5, "Height": 0.25, "Left": 0.125, "Top": 0.0625}})
+        self.assertEqual(geometry.boundingBox.height, 0.25)
+        self.assertEqual(geometry.polygon, [])
+        self.assertEqual(str(trp.BoundingBox(1, 2, 3, 4)), "width: 1, height: 2, left: 3, top: 4")
+
+    def test_standalone_geometry_keeps_full_precision_without_a_store(self):
+        standalone = trp.Geometry(geometry(0.123456789, 0.2, 0.3, 0.4))
+        self.assertIsNone(standalone._store)
+        self.assertEqual(standalone.boundingBox.left, 0.123456789)
+        self.assertEqual(standalone.polygon[1].x, 0.123456789 + 0.3)
+        page = trp.Page([{"BlockType": "PAGE", "Id": "page", "Geometry": geometry(0, 0, 1, 1)}], {})
+        self.assertIsNone(page.geometry._store)
+
+
+class TestWordInterning(unittest.TestCase):
+
+    def test_children_are_built_lazily(self):
+        document = trp.Document(buildDocument(1).responses())
+        page = document.pages[0]
+        self.assertIsNone(page.lines[0]._words)
+        self.assertEqual(page.form.fields[0].key.text, "Name:")
+        self.assertIsNone(page.form.fields[0].key._content)
+        self.assertEqual(page.tables[0].rows[0].cells[0].text, "a ")
+        self.assertIsNone(page.tables[0].rows[0].cells[0]._content)
+        self.assertEqual([w.text for w in page.lines[0].words], ["page", "1", "first", "line"])
+
+    def test_shared_word_is_wrapped_once(self):
+        builder = ResponseBuilder()
+        builder.page()
+        lineId = builder.line("shared")
+        wordId = builder.blocks[1]["Id"]
+        builder._add({"BlockType": "CELL", "Id": "cell-1", "Confidence": 90.0, "RowIndex": 1, "ColumnIndex": 1,
+                      "RowSpan": 1, "ColumnSpan": 1, "Geometry": geometry(0, 0, 0.1, 0.1),
+                      "Relationships": [{"Type": "CHILD", "Ids": [wordId]}]})
+        builder._add({"BlockType": "TABLE", "Id": "table-1", "Confidence": 90.0, "Geometry": geometry(0, 0, 0.1, 0.1),
+                      "Relationships": [{"Type": "CHILD", "Ids": ["cell-1"]}]})
+        page = trp.Document(builder.responses()).pages[0]
+        self.assertEqual(page.lines[0].id, lineId)
+        self.assertIs(page.lines[0].words[0], page.tables[0].rows[0].cells[0].content[0])
+
+
+class TestReadingOrder(unittest.TestCase):
+
+    def test_columns_are_read_left_to_right_and_top_to_bottom(self):
+        builder = ResponseBuilder()
+        builder.page()
+        # emitted row by row across both columns, bottom rows first
+        for row in reversed(range(3)):
+            builder.line("left {}".format(row), left=0.05, top=0.1 * (row + 1), width=0.4)
+            builder.line("right {}".format(row), left=0.55, top=0.1 * (row + 1), width=0.4)
+        page = trp.Document(builder.responses()).pages[0]
+
+        lines = page.getLinesInReadingOrder()
+        self.assertTrue(all(isinstance(line, trp.Line) for line in lines))
+        self.assertEqual([line.text for line in lines],
+                         ["left 0", "left 1", "left 2", "right 0", "right 1", "right 2"])
+        self.assertEqual(page.getTextInReadingOrder(), "left 0\nleft 1\nleft 2\nright 0\nright 1\nright 2\n")
+
+    def test_short_lines_stay_in_their_column(self):
+        builder = ResponseBuilder()
+        builder.page()
+        builder.line("second column", left=0.55, top=0.1, width=0.4)
+        builder.line("first column", left=0.05, top=0.1, width=0.4)
+        builder.line("end", left=0.05, top=0.2, width=0.05)
+        builder.line("indented", left=0.6, top=0.2, width=0.2)
+        page = trp.Document(builder.responses()).pages[0]
+
+        self.assertEqual([line.text for line in page.getLinesInReadingOrder()],
+                         ["first column", "end", "second column", "indented"])
+
+
+class TestTextAssembly(unittest.TestCase):
+
+    def test_text_buffer_caches_until_appended(self):
+        buffer = trp.TextBuffer()
+        buffer.extend(["a", "b"])
+        self.assertEqual(buffer.text, "ab")
+        self.assertIs(buffer.text, buffer.text)
+        buffer.append("c")
+        self.assertEqual(str(buffer), "abc")
+
+    def test_document_and_stream_text(self):
+        responses = buildDocument(2).responses()
+        expected = "page 1 first line\npage 1 second line\n\npage 2 first line\npage 2 second line\n\n"
+        self.assertEqual(trp.Document(responses).text, expected)
+
+        stream = trp.PageStream(responses)
+        pages = iter(stream)
+        next(pages)
+        self.assertEqual(stream.text, "page 1 first line\npage 1 second line\n\n")
+        next(pages)
+        self.assertEqual(stream.text, expected)
+
+
+class TestFormIndex(unittest.TestCase):
+
+    def setUp(self):
+        builder = ResponseBuilder()
+        builder.page()
+        builder.field("Patient Name:", "Jane Doe")
+        builder.field("Date of Birth:", "01/02/1980")
+        builder.field("patient  name:", "John Doe")
+        builder.field("Phone", "555")
+        self.form = trp.Document(builder.responses()).pages[0].form
+
+    def test_get_fields_by_key_returns_every_match(self):
+        self.assertEqual(self.form.getFieldByKey("Patient Name:").value.text, "Jane Doe")
+        self.assertEqual([f.value.text for f in self.form.getFieldsByKey("PATIENT NAME:")], ["Jane Doe", "John Doe"])
+        self.assertEqual(self.form.getFieldsByKey("Address"), [])
+
+    def test_search_fields_by_key(self):
+        self.assertEqual([f.value.text for f in self.form.searchFieldsByKey("name")], ["Jane Doe", "John Doe"])
+        self.assertEqual([f.value.text for f in self.form.searchFieldsByKey("BIRTH")], ["01/02/1980"])
+        self.assertEqual([f.value.text for f in self.form.searchFieldsByKey("ph")], ["555"])
+        self.assertEqual(self.form.searchFieldsByKey("zip code"), [])
+
+    def test_search_fields_by_key_prefix(self):
+        self.assertEqual([f.value.text for f in self.form.searchFieldsByKeyPrefix("pat")], ["Jane Doe", "John Doe"])
+        self.assertEqual([f.value.text for f in self.form.searchFieldsByKeyPrefix("Date of")], ["01/02/1980"])
+        self.assertEqual(self.form.searchFieldsByKeyPrefix("name"), [])
+
+
+class TestTableGrid(unittest.TestCase):
+
+    def test_cell_addressing_and_columns(self):
+        table = trp.Document(buildDocument(1).responses()).pages[0].tables[0]
+        self.assertEqual((table.rowCount, table.columnCount), (2, 2))
+        self.assertEqual(table.cell(2, 1).text, "c ")
+        self.assertIsNone(table.cell(3, 1))
+        self.assertEqual([cell.text for cell in table.column(2)], ["b ", "d "])
+        self.assertEqual([[cell.text for cell in column] for column in table.columns], [["a ", "c "], ["b ", "d "]])
+        self.assertEqual(table.toArray(), [["a ", "b "], ["c ", "d "]])
+
+    def test_spans_and_merged_cells(self):
+        builder = ResponseBuilder()
+        builder.page()
+        builder.table([["h1", "h2", "h3"], ["a", "b", "c"], ["d", "e", "f"]])
+        tableBlock = builder.blocks[-1]
+        cellIds = tableBlock["Relationships"][0]["Ids"]
+        # the first header cell spans two columns, the second column holds no cell
+        first = builder.blocks[[b["Id"] for b in builder.blocks].index(cellIds[0])]
+        first["ColumnSpan"] = 2
+        tableBlock["Relationships"][0]["Ids"] = [cellIds[0]] + cellIds[2:]
+        builder._add({"BlockType": "MERGED_CELL", "Id": "merged-1", "Confidence": 90.0,
+                      "RowIndex": 2, "ColumnIndex": 3, "RowSpan": 2, "ColumnSpan": 1,
+                      "Geometry": geometry(0, 0, 0.1, 0.2),
+                      "Relationships": [{"Type": "CHILD", "Ids": [cellIds[5], cellIds[8]]}]})
+        tableBlock["Relationships"].append({"Type": "MERGED_CELL", "Ids": ["merged-1"]})
+
+        table = trp.Document(builder.responses()).pages[0].tables[0]
+        self.assertIs(table.cell(1, 1), table.cell(1, 2))
+        self.assertIsInstance(table.cell(3, 3), trp.MergedCell)
+        self.assertIs(table.cell(2, 3), table.cell(3, 3))
+        self.assertEqual(table.cell(2, 3).text, "c f ")
+        self.assertEqual(table.toArray(), [["h1 ", "", "h3 "], ["a ", "b ", "c f "], ["d ", "e ", ""]])
+        self.assertEqual(len(table.rows[0].cells), 2)
+
+
+class TestBinaryDocument(unittest.TestCase):
+
+    def binary(self, responses):
+        buffer = io.BytesIO()
+        trp.writeBinaryDocument(responses, buffer)
+        return buffer.getvalue()
+
+    def test_round_trip(self):
+        responses = buildDocument(3).responses(blocksPerResponse=7)
+        responses[0]["DocumentMetadata"] = {"Pages": 3}
+        document = trp.BinaryDocument(self.binary(responses))
+        original = trp.Document(responses)
+
+        self.assertEqual(document.pageCount, 3)
+        self.assertEqual(document.metadata, {"DocumentMetadata": {"Pages": 3}})
+        self.assertEqual([p.text for p in document.pages], [p.text for p in original.pages])
+        self.assertEqual(document.page(2).form.fields[0].value.text, "Jane Doe 3")
+        self.assertEqual(document.page(0).tables[0].toArray(), [["a ", "b "], ["c ", "d "]])
+
+        blocks = [b for r in responses for b in r["Blocks"]]
+        restored = document.blocks[0]["Blocks"]
+        self.assertEqual([b["Id"] for b in restored], [b["Id"] for b in blocks])
+        self.assertEqual(restored[5]["Relationships"], blocks[5]["Relationships"])
+        key = [b["BlockType"] for b in blocks].index("KEY_VALUE_SET")
+        self.assertEqual(restored[key]["EntityTypes"], ["KEY"])
+        self.assertEqual(restored[key]["Relationships"], blocks[key]["Relationships"])
+        self.assertAlmostEqual(restored[2]["Geometry"]["Polygon"][2]["X"], blocks[2]["Geometry"]["Polygon"][2]["X"], places=6)
+
+    def test_pages_are_loaded_lazily_from_a_file(self):
+        builder = ResponseBuilder()
+        builder.page()
+        builder.line("shared")
+        builder.page()
+        # the line of the second page points at a word stored with the first page
+        builder._add({"BlockType": "LINE", "Id": "cross", "Text": "shared", "Confidence": 99.0, "Geometry": geometry(0, 0, 1, 1),
+                      "Relationships": [{"Type": "CHILD", "Ids": [builder.blocks[1]["Id"]]}]})
+
+        fd, path = tempfile.mkstemp()
+        with os.fdopen(fd, "wb") as f:
+            trp.writeBinaryDocument(builder.responses(), f)
+        try:
+            with trp.BinaryDocument.fromFile(path) as document:
+                self.assertIsNone(document._pages[0])
+                self.assertEqual(document.page(1).lines[0].words[0].text, "shared")
+                self.assertIsNone(document._pages[0])
+        finally:
+            os.remove(path)
+
+    def test_rejects_other_content(self):
+        with self.assertRaises(ValueError):
+            trp.BinaryDocument(b"{}" * 32)
+
+
+if __name__ == '__main__':
+    unittest.main()